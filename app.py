@@ -1,52 +1,78 @@
 from flask import Flask, request, render_template, send_file, jsonify
 from flask_cors import CORS
-import pdfkit
 import io
 import os
 import html
-from bs4 import BeautifulSoup
+from renderer import WKHTMLTOPDF_PATH, get_renderer, render_pdf
+from jobs import accept_job, register_job_routes, wants_async
+from singleflight import SingleFlight, payload_key
+from static_flyers import flyer_input_hash, pregenerated_response, register_flyer_routes
+from text_fit import fit_flyer_context
 
 app = Flask(__name__)
-CORS(app, resources={r"/generate-pdf": {"origins": "*"}})
+CORS(app, resources={r"/generate-pdf": {"origins": "*"}, r"/jobs/*": {"origins": "*"}, r"/flyers/*": {"origins": "*"}})
+register_job_routes(app)
+register_flyer_routes(app)
+flights = SingleFlight()  # Identical payloads in flight share one render
 
-WKHTMLTOPDF_PATH = r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe"
 if not os.path.exists(WKHTMLTOPDF_PATH):
     raise FileNotFoundError(f"wkhtmltopdf not found at {WKHTMLTOPDF_PATH}")
 
-config = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
-
-# Helper function to truncate HTML while preserving tag structure
-def truncate_html_preserving_tags(html_content, char_limit):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    total_chars = 0
-
-    def truncate_node(node):
-        nonlocal total_chars
-        if node.name is None:  # NavigableString
-            if total_chars >= char_limit:
-                node.extract()
-                return
-            text_len = len(node)
-            if total_chars + text_len > char_limit:
-                node.replace_with(node[:char_limit - total_chars])
-                total_chars = char_limit
-            else:
-                total_chars += text_len
-        else:
-            for child in list(node.contents):
-                if total_chars >= char_limit:
-                    child.extract()
-                else:
-                    truncate_node(child)
-
-    truncate_node(soup)
-
-    if total_chars >= char_limit:
-        note = soup.new_tag("p")
-        note.string = "[... check website to see more]"
-        soup.append(note)
-
-    return str(soup)
+TRUNCATION_NOTE = "[... check website to see more]"
+FLYER_BACKEND = 'html'  # Storefront payloads always render the HTML template with wkhtmltopdf
+
+def payload_context(data):
+    """Template context for a storefront payload"""
+    # Process Table of Contents (HTML safe)
+    toc = html.unescape(data.get('toc', ''))
+
+    # Process About the Book (HTML safe)
+    book_desc = html.unescape(data.get('book_desc', ''))
+
+    # Process About the Author (HTML safe)
+    about_author = html.unescape(data.get('about_author', ''))
+
+    context = dict(
+        product_title=data.get('product_title'),
+        product_image=data.get('product_image'),
+        product_category=data.get('product_category'),
+        publisher_imprint=data.get('publisher'),
+        edition=data.get('edition'),
+        volume=data.get('volume'),
+        publishing_date=data.get('publishing_date'),
+        pages=data.get('pages'),
+        isbn=data.get('isbn'),
+        author=data.get('author'),
+        variants=data.get('variants'),
+        price=data.get('price'),
+        book_desc=book_desc,
+        about_author=about_author,
+        toc=toc
+    )
+    # The storefront sends the descriptions as shown on the product page; only the contents
+    # are cut, at the line that fills the sidebar
+    fit_flyer_context(context, TRUNCATION_NOTE, sections=('toc',))
+    return context
+
+def build_flyer_pdf(context, download_name):
+    """Render the flyer for a payload's template context; returns (pdf_bytes, download_name)"""
+    # Render HTML with template
+    rendered_html = render_template('flyer_template.html', **context)
+
+    # PDF generation options
+    options = {
+        'page-size': 'A4',
+        'encoding': 'UTF-8',
+        'margin-top': '0',
+        'margin-right': '0',
+        'margin-bottom': '0',
+        'margin-left': '0',
+        'zoom': '1',
+        'enable-local-file-access': None,
+    }
+
+    pdf = render_pdf(rendered_html, options)
+    return pdf, download_name
 
 @app.route('/generate-pdf', methods=['POST', 'OPTIONS'])
 def generate_pdf():
@@ -59,58 +85,27 @@ def generate_pdf():
         if not data:
             return jsonify({"error": "No JSON data received"}), 400
 
-        # Character limits
-        TOC_CHAR_LIMIT = 900
-        CHAR_LIMIT = 1200
-
-        # Process Table of Contents (HTML safe)
-        toc_raw = html.unescape(data.get('toc', ''))
-        toc = truncate_html_preserving_tags(toc_raw, TOC_CHAR_LIMIT)
-
-        # Process About the Book (HTML safe)
-        book_desc = html.unescape(data.get('book_desc', ''))
-        # book_desc = truncate_html_preserving_tags(book_desc_raw, CHAR_LIMIT)
-
-        # Process About the Author (HTML safe)
-        about_author = html.unescape(data.get('about_author', ''))
-        # about_author = truncate_html_preserving_tags(about_author_raw, CHAR_LIMIT)
-
-        # Render HTML with template
-        rendered_html = render_template(
-            'flyer_template.html',
-            product_title=data.get('product_title'),
-            product_image=data.get('product_image'),
-            product_category=data.get('product_category'),
-            publisher_imprint=data.get('publisher'),
-            edition=data.get('edition'),
-            volume=data.get('volume'),
-            publishing_date=data.get('publishing_date'),
-            pages=data.get('pages'),
-            isbn=data.get('isbn'),
-            author=data.get('author'),
-            variants=data.get('variants'),
-            price=data.get('price'),
-            book_desc=book_desc,
-            about_author=about_author,
-            toc=toc
-        )
+        context = payload_context(data)
+        download_name = f"{data.get('product_title', 'flyer')}_flyer.pdf"
+
+        # The pre-generated flyer for the ISBN is served only when it was rendered from this same content
+        pregenerated = pregenerated_response(data.get('isbn'), download_name,
+                                             flyer_input_hash(context, FLYER_BACKEND))
+        if pregenerated is not None:
+            return pregenerated
+
+        # Concurrent requests with the same payload wait for the first one's render
+        key = payload_key('generate-pdf', data)
 
-        # PDF generation options
-        options = {
-            'page-size': 'A4',
-            'encoding': 'UTF-8',
-            'margin-top': '0',
-            'margin-right': '0',
-            'margin-bottom': '0',
-            'margin-left': '0',
-            'zoom': '1',
-        }
+        # ?async=1 answers 202 with a job id; the flyer renders on the job pool
+        if wants_async():
+            return accept_job(flights.do, key, build_flyer_pdf, context, download_name, key=key)
 
-        pdf = pdfkit.from_string(rendered_html, False, configuration=config, options=options)
+        pdf, download_name = flights.do(key, build_flyer_pdf, context, download_name)
 
         return send_file(
             io.BytesIO(pdf),
-            download_name=f"{data.get('product_title', 'flyer')}_flyer.pdf",
+            download_name=download_name,
             mimetype='application/pdf'
         )
 
@@ -118,4 +113,5 @@ def generate_pdf():
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
+    get_renderer()  # Warm the renderer workers before serving requests
     app.run(debug=True)
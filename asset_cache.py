@@ -0,0 +1,155 @@
+import os
+import re
+import html
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Asset cache configuration
+ASSET_CACHE_DIR = Path(os.getenv('ASSET_CACHE_DIR', '.flyer_cache/assets'))
+ASSET_FETCH_WORKERS = int(os.getenv('ASSET_FETCH_WORKERS', '8'))
+DEFAULT_IMAGE_CSS_WIDTH = 250  # .book_image img { max-width: 250px } in flyer_template.html
+PRINT_SCALE = 2  # Device pixels per CSS pixel kept for print (~192 DPI at wkhtmltopdf's 96 DPI)
+JPEG_QUALITY = 85
+ASSET_FAILURE_TTL = int(os.getenv('ASSET_FAILURE_TTL', '300'))  # Seconds a failed image URL is not retried
+
+IMG_TAG_RE = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+IMG_SRC_RE = re.compile(r'(\bsrc=")(https?://[^"]+)(")', re.IGNORECASE)
+IMG_WIDTH_RE = re.compile(r'\bwidth="(\d+)"', re.IGNORECASE)
+
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=ASSET_FETCH_WORKERS))
+_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=ASSET_FETCH_WORKERS))
+
+_localized = {}  # (url, css_width) -> local path, for this process
+_failed = {}  # url -> monotonic time its download last failed, for this process
+_localized_lock = threading.Lock()
+
+
+def _index_path(url, css_width):
+    key = hashlib.sha256(f'{css_width}:{url}'.encode('utf-8')).hexdigest()
+    return ASSET_CACHE_DIR / 'index' / key
+
+
+def _write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def downscale_image(image_bytes, max_width):
+    """Shrink an image to max_width device pixels; returns (bytes, extension)"""
+    with Image.open(BytesIO(image_bytes)) as image:
+        image_format = (image.format or '').upper()
+        if image.width <= max_width and image_format in ('JPEG', 'PNG'):
+            return image_bytes, 'jpg' if image_format == 'JPEG' else 'png'
+
+        height = max(1, round(image.height * max_width / image.width))
+        if image.width > max_width:
+            image = image.resize((max_width, height), Image.LANCZOS)
+
+        output = BytesIO()
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image.save(output, format='PNG', optimize=True)
+            return output.getvalue(), 'png'
+        image.convert('RGB').save(output, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+        return output.getvalue(), 'jpg'
+
+
+def localize_image(url, css_width=DEFAULT_IMAGE_CSS_WIDTH):
+    """Return a local path for a print-sized copy of an image URL, or None on failure.
+
+    Each URL is downloaded once; the downscaled result is stored under its
+    content hash so identical images share one file. A URL that failed is
+    not retried for ASSET_FAILURE_TTL seconds, so a dead link costs one
+    timeout rather than one per flyer.
+    """
+    if not url:
+        return None
+    key = (url, css_width)
+    with _localized_lock:
+        path = _localized.get(key)
+    if path and path.exists():
+        return path
+
+    index_path = _index_path(url, css_width)
+    try:
+        path = ASSET_CACHE_DIR / index_path.read_text().strip()
+        if not path.exists():
+            path = None
+    except OSError:
+        path = None
+
+    if path is None:
+        with _localized_lock:
+            failed_at = _failed.get(url)
+        if failed_at is not None and time.monotonic() - failed_at < ASSET_FAILURE_TTL:
+            return None
+        try:
+            response = _session.get(url, timeout=30)
+            response.raise_for_status()
+            data, extension = downscale_image(response.content, css_width * PRINT_SCALE)
+            digest = hashlib.sha256(data).hexdigest()
+            path = ASSET_CACHE_DIR / digest[:2] / f'{digest}.{extension}'
+            if not path.exists():
+                _write_atomic(path, data)
+            _write_atomic(index_path, path.relative_to(ASSET_CACHE_DIR).as_posix().encode('utf-8'))
+        except Exception as e:
+            logger.warning(f"Could not cache image {url}: {str(e)}")
+            with _localized_lock:
+                _failed[url] = time.monotonic()
+            return None
+
+    path = path.resolve()
+    with _localized_lock:
+        _localized[key] = path
+    return path
+
+
+def localize_html_images(html_content):
+    """Point every remote <img> at its local print-sized copy.
+
+    The CSS width is taken from the tag's width attribute when present and
+    defaults to the cover image width otherwise.
+    """
+    def replace(tag_match):
+        tag = tag_match.group(0)
+        src_match = IMG_SRC_RE.search(tag)
+        if not src_match:
+            return tag
+        width_match = IMG_WIDTH_RE.search(tag)
+        css_width = int(width_match.group(1)) if width_match else DEFAULT_IMAGE_CSS_WIDTH
+        path = localize_image(html.unescape(src_match.group(2)), css_width)
+        if path is None:
+            return tag
+        return tag[:src_match.start(2)] + path.as_uri() + tag[src_match.end(2):]
+
+    return IMG_TAG_RE.sub(replace, html_content)
+
+
+def has_remote_images(html_content):
+    """True when an <img> still points at a remote URL, e.g. one localize_html_images could not fetch"""
+    return any(IMG_SRC_RE.search(tag) for tag in IMG_TAG_RE.findall(html_content))
+
+
+def prefetch_images(urls, css_width=DEFAULT_IMAGE_CSS_WIDTH, max_workers=ASSET_FETCH_WORKERS):
+    """Download and downscale a batch of images concurrently ahead of rendering"""
+    unique_urls = list(dict.fromkeys(url for url in urls if url))
+    if not unique_urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        paths = executor.map(lambda url: localize_image(url, css_width), unique_urls)
+        return dict(zip(unique_urls, paths))
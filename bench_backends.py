@@ -0,0 +1,125 @@
+"""Compare the native flyer backend with the wkhtmltopdf one: latency and size.
+
+    python bench_backends.py
+    python bench_backends.py --skus skus.txt --rounds 5
+
+Each backend is timed per flyer, alone and merged (native with and without
+the stamped background overlay). Without --skus it runs on built-in sample
+products; with --skus it fetches them from Shopify. Layout parity between
+the backends is checked by test_flyer_backends.py.
+"""
+import time
+import argparse
+
+from bench_truncate import sample_metafields
+from flyer_product import flyer_product
+from native_flyer import FlyerLayout, NativeFlyerBackend, NativeLayoutError
+from pdf_optimize import format_size
+from streamlitbulk import FLYER_BACKENDS, fetch_all_products, prepare_template_context
+
+
+def sample_contexts():
+    """Template contexts of made-up products covering short, long and missing sections"""
+    about_book, about_author, toc, plain, paragraph, long_book = sample_metafields()
+    products = [
+        ('SAMPLE-LONG', about_book, about_author, toc),
+        ('SAMPLE-SHORT', paragraph, '', plain),
+        ('SAMPLE-OVERFULL', long_book, about_author * 3, toc * 2),
+        ('SAMPLE-EMPTY', '', '', ''),
+    ]
+    contexts = []
+    for sku, book, author, contents in products:
+        variant = {'sku': sku, 'title': 'Hardback', 'price': '995.00', 'metafield': {'value': '2nd'}}
+        product = {
+            'id': f"gid://shopify/Product/{sku}",
+            'title': 'Trade and Empire in the Mediterranean World',
+            'productType': 'History',
+            'variants': {'edges': [{'node': variant}]},
+        }
+        product.update(
+            (f"custom_{key}", {'value': value})
+            for key, value in (
+                ('author', 'Jane Doe'), ('publisher', 'Atlantic Publishers'), ('pages', '320'),
+                ('publication_date', '2024'), ('volume', 'Vol. 2'), ('about_the_book', book),
+                ('about_the_author', author), ('table_of_contents', contents),
+            )
+        )
+        context, error = prepare_template_context(flyer_product(variant, product))
+        if not error:
+            contexts.append((sku, context))
+    return contexts
+
+
+def fetch_contexts(path):
+    from pregenerate import read_skus
+
+    products, errors = fetch_all_products(read_skus(path))
+    for error in errors:
+        print(f"  {error}")
+    contexts = []
+    for sku, product_data in products.items():
+        context, error = prepare_template_context(product_data)
+        if error:
+            print(f"  {sku}: {error}")
+        else:
+            contexts.append((sku, context))
+    return contexts
+
+
+def unsupported(context):
+    """Why the native layout would hand this flyer to wkhtmltopdf, or None"""
+    try:
+        FlyerLayout(context)
+    except NativeLayoutError as e:
+        return str(e)
+    return None
+
+
+def timed(backend, contexts, rounds):
+    """(seconds per flyer, bytes per flyer, merged bytes per flyer), or None when the backend fails"""
+    sizes = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _, context in contexts:
+            pdf_bytes, error = backend.render(context)
+            if error:
+                return None
+            sizes.append(len(pdf_bytes))
+    latency = (time.perf_counter() - start) / len(sizes)
+    merged, _, errors = backend.render_chunk(contexts * rounds)
+    if merged is None or errors:
+        return None
+    return latency, sum(sizes) / len(sizes), len(merged) / len(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--skus', help='file of SKUs to compare on')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    contexts = fetch_contexts(args.skus) if args.skus else sample_contexts()
+    for sku, context in contexts:
+        reason = unsupported(context)
+        if reason:
+            print(f"{sku}: native layout unsupported, falls back: {reason}")
+
+    # Flyers the native backend hands to wkhtmltopdf would only time wkhtmltopdf twice
+    drawable = [(sku, context) for sku, context in contexts if not unsupported(context)]
+    backends = [
+        ('html', FLYER_BACKENDS['html']),
+        ('native', NativeFlyerBackend(overlay=False)),
+        ('overlay', NativeFlyerBackend(overlay=True)),
+    ]
+    for name, backend in backends:
+        result = timed(backend, drawable, args.rounds) if drawable else None
+        if result is None:
+            print(f"{name:>7}: unavailable")
+            continue
+        latency, size, merged_size = result
+        print(f"{name:>7}: {latency * 1000:8.1f} ms/flyer, {format_size(size)}/flyer alone, "
+              f"{format_size(merged_size)}/flyer merged")
+
+
+if __name__ == '__main__':
+    main()
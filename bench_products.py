@@ -0,0 +1,135 @@
+"""Compare FlyerProduct parsing with the raw GraphQL records it replaced: time and memory.
+
+    python bench_products.py
+    python bench_products.py --skus 10000 --variants 3
+
+Builds productVariants responses like Shopify's, in pages of 100 edges,
+for made-up products whose descriptions are shaped like the store's
+metafields. It then parses them both ways. Time covers decoding and record
+building. Memory is what the resulting products_by_sku dict keeps alive
+once the responses are dropped.
+"""
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+
+from bench_truncate import sample_metafields
+from flyer_fields import parse_metafields
+from flyer_product import flyer_product, json_loads, orjson
+
+PAGE_SIZE = 100  # Edges per productVariants response
+
+
+def reference_records(data):
+    """The previous parsing: whole variant and product dicts per SKU (without its debug print)"""
+    products_by_sku = {}
+    for edge in data['data']['productVariants']['edges']:
+        node = edge.get('node') or {}
+        sku = node.get('sku')
+        if not sku:
+            continue
+        product = node.get('product') or {}
+        metafields = parse_metafields(product)
+        variant_metafield = None
+        for v_edge in (product.get('variants') or {}).get('edges') or []:
+            v_node = v_edge.get('node') or {}
+            if v_node.get('sku') == sku:
+                variant_metafield = (v_node.get('metafield') or {}).get('value')
+                break
+        products_by_sku[sku] = {
+            'variant': node,
+            'product': product,
+            'metafields': metafields,
+            'edition': variant_metafield
+        }
+    return products_by_sku
+
+
+def compact_records(data):
+    products_by_sku = {}
+    shared = {}
+    for edge in data['data']['productVariants']['edges']:
+        node = edge.get('node') or {}
+        if node.get('sku'):
+            products_by_sku[node['sku']] = flyer_product(node, node.get('product') or {}, shared)
+    return products_by_sku
+
+
+def sample_responses(skus, variants_per_product):
+    """Encoded productVariants responses covering ``skus`` SKUs"""
+    about_book, about_author, toc = sample_metafields()[:3]
+    edges = []
+    for p in range(skus // variants_per_product + 1):
+        variants = [
+            {'sku': f"978{p:07d}{v:03d}", 'title': ['Hardcover', 'Paperback', 'eBook'][v % 3],
+             'price': f"{495 + 100 * v}.00", 'metafield': {'value': f"{v + 1}"}}
+            for v in range(variants_per_product)
+        ]
+        product = {
+            'id': f"gid://shopify/Product/{p}",
+            'title': f"Sample Book {p}",
+            'productType': 'Books',
+            'updatedAt': '2026-01-01T00:00:00Z',
+            'featuredImage': {'url': f"https://cdn.shopify.com/s/files/sample-{p}.jpg"},
+            'variants': {'edges': [{'node': variant} for variant in variants]},
+            'custom_about_the_book': {'value': f"<p>Book {p}.</p>{about_book}"},
+            'custom_about_the_author': {'value': f"<p>Author {p}.</p>{about_author}"},
+            'custom_table_of_contents': {'value': toc},
+            'custom_author': {'value': f"Author {p}"},
+            'custom_publisher': {'value': 'Atlantic'},
+            'custom_pages': {'value': '320'},
+        }
+        for variant in variants:
+            edges.append({'node': {key: variant[key] for key in ('sku', 'title', 'price')} | {'product': product}})
+    edges = edges[:skus]
+    return [
+        json.dumps({'data': {'productVariants': {'edges': edges[i:i + PAGE_SIZE]}}}).encode('utf-8')
+        for i in range(0, len(edges), PAGE_SIZE)
+    ]
+
+
+def parse_all(responses, decode, build):
+    products_by_sku = {}
+    for response in responses:
+        products_by_sku.update(build(decode(response)))
+    return products_by_sku
+
+
+def measure(responses, decode, build):
+    """(seconds, bytes retained by the parsed records)"""
+    gc.collect()
+    start = time.perf_counter()
+    parse_all(responses, decode, build)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    records = parse_all(responses, decode, build)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return elapsed, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--skus', type=int, default=10000)
+    parser.add_argument('--variants', type=int, default=3, help='variants (SKUs) per product')
+    args = parser.parse_args()
+
+    responses = sample_responses(args.skus, args.variants)
+    print(f"{args.skus} SKUs in {len(responses)} responses, {sum(map(len, responses)) / 1e6:.1f} MB of JSON, "
+          f"decoder: {'orjson' if orjson is not None else 'json'}")
+
+    raw_time, raw_memory = measure(responses, json.loads, reference_records)
+    compact_time, compact_memory = measure(responses, json_loads, compact_records)
+    print(f"Raw GraphQL records: {raw_time * 1000:8.1f} ms, {raw_memory / 1e6:7.1f} MB retained")
+    print(f"FlyerProduct:        {compact_time * 1000:8.1f} ms, {compact_memory / 1e6:7.1f} MB retained "
+          f"({raw_time / compact_time:.1f}x faster, {raw_memory / compact_memory:.1f}x smaller)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Compare the streaming HTML truncator with the BeautifulSoup tree walk it replaced.
+
+    python bench_truncate.py
+    python bench_truncate.py --skus skus.txt --rounds 50
+
+Without --skus it runs on built-in samples shaped like the store's
+about-the-book, about-the-author and table-of-contents metafields. With
+--skus it fetches those metafields from Shopify. Every input is checked for
+identical output before anything is timed.
+"""
+import time
+import argparse
+
+from bs4 import BeautifulSoup
+
+import html_truncate
+from html_truncate import truncate_html_preserving_tags
+
+METAFIELDS = ('custom_about_the_book', 'custom_about_the_author', 'custom_table_of_contents')
+LIMITS = (900, 1100, 1300)
+
+
+def reference_truncate(html_content, char_limit, note=html_truncate.TRUNCATION_NOTE):
+    """The previous BeautifulSoup implementation, kept for comparison"""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    total_chars = 0
+
+    def truncate_node(node):
+        nonlocal total_chars
+        if node.name is None:  # NavigableString
+            if total_chars >= char_limit:
+                node.extract()
+                return
+            text_len = len(node)
+            if total_chars + text_len > char_limit:
+                node.replace_with(node[:char_limit - total_chars])
+                total_chars = char_limit
+            else:
+                total_chars += text_len
+        else:
+            for child in list(node.contents):
+                if total_chars >= char_limit:
+                    child.extract()
+                else:
+                    truncate_node(child)
+
+    truncate_node(soup)
+
+    if total_chars >= char_limit:
+        note_tag = soup.new_tag("p")
+        note_tag.string = note
+        soup.append(note_tag)
+
+    return str(soup)
+
+
+def sample_metafields():
+    """Metafield HTML in the shapes the storefront's rich text editor produces"""
+    paragraph = (
+        "<p>In this <strong>landmark study</strong>, the author traces the history of the "
+        "<em>Mediterranean</em> trade routes from antiquity to the early modern period &mdash; "
+        "drawing on archives in Venice, Genoa &amp; Istanbul.&nbsp;The book&#8217;s argument "
+        "is that <a href=\"https://example.com/series?id=12&amp;lang=en\" class=\"link  series\">"
+        "commerce</a>, not conquest, shaped the region.</p>\n"
+    )
+    about_book = paragraph * 6
+    about_author = (
+        "<p><b>Jane Doe</b> is Professor of History at the University of Somewhere.</p>\n"
+        "<p>Her previous books include <i>Salt &amp; Silver</i> (2015) and "
+        "<i>Harbours of the Levant</i> (2019).<br>She lives in London.</p>\n"
+    ) * 4
+    toc = "<ul>\n" + "".join(
+        f"  <li>Chapter {n}: The {name} Question<br/><span style=\"color:#555\">pp. {n * 23}&ndash;{n * 23 + 20}"
+        f"</span></li>\n"
+        for n, name in enumerate(['Venetian', 'Genoese', 'Ottoman', 'Spanish', 'Dutch', 'English'] * 8, 1)
+    ) + "</ul>\n<!-- generated by the catalogue export -->\n"
+    plain = "A short description without any markup, but with an ampersand & and <angle> text."
+    return [about_book, about_author, toc, plain, paragraph, paragraph * 40]
+
+
+def fetch_metafields(path):
+    from pregenerate import read_skus
+    from streamlitbulk import fetch_all_products
+
+    products, errors = fetch_all_products(read_skus(path))
+    for error in errors:
+        print(f"  {error}")
+    return [
+        product.metafields[name]
+        for product in products.values()
+        for name in METAFIELDS
+        if isinstance(product.metafields.get(name), str) and product.metafields[name]
+    ]
+
+
+def timed(func, inputs, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for html_content, limit in inputs:
+            func(html_content, limit)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--skus', help='file of SKUs whose metafields to benchmark on')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    documents = fetch_metafields(args.skus) if args.skus else sample_metafields()
+    inputs = [(document, limit) for document in documents for limit in LIMITS]
+    mismatches = 0
+    for html_content, limit in inputs:
+        if html_truncate._truncate(html_content, limit, html_truncate.TRUNCATION_NOTE) != reference_truncate(
+                html_content, limit):
+            mismatches += 1
+            print(f"Output differs at limit {limit}: {html_content[:80]!r}")
+    print(f"{len(inputs)} inputs, {sum(len(d) for d in documents)} characters of HTML, {mismatches} mismatches")
+
+    streaming = timed(lambda content, limit: html_truncate._truncate(content, limit, html_truncate.TRUNCATION_NOTE),
+                      inputs, args.rounds)
+    reference = timed(reference_truncate, inputs, args.rounds)
+    truncate_html_preserving_tags(*inputs[0])
+    memoized = timed(truncate_html_preserving_tags, inputs, args.rounds)
+
+    calls = len(inputs) * args.rounds
+    print(f"BeautifulSoup tree walk: {reference / calls * 1e6:8.1f} us/call")
+    print(f"Streaming truncator:     {streaming / calls * 1e6:8.1f} us/call ({reference / streaming:.1f}x)")
+    print(f"Memoized:                {memoized / calls * 1e6:8.1f} us/call ({reference / memoized:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
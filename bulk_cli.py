@@ -0,0 +1,205 @@
+"""Generate flyers from the command line into a directory, resumably.
+
+    python bulk_cli.py skus.txt --out flyers
+    cat skus.txt | python bulk_cli.py - --out flyers --resume
+
+SKUs are read as a stream (one per line or comma separated), fetched in
+slices with fetch_all_products and rendered with generate_single_flyer
+into OUT/<sku>.pdf. Each flyer is appended to OUT/checkpoint.jsonl once its
+file is in place, so a crash loses at most the flyers still rendering.
+With --resume, SKUs the checkpoint lists whose file is still there and
+whose product record, templates and backend hash the same are skipped.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from asset_cache import prefetch_images
+from pdf_cache import TEMPLATE_VERSION
+from pregenerate import write_atomic
+from renderer import get_renderer
+from static_flyers import flyer_filename
+from streamlitbulk import (
+    FETCH_CHUNK_SIZE, FLYER_BACKEND, MAX_WORKERS, fetch_all_products, generate_single_flyer, group_by_flyer,
+    normalize_sku
+)
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = 'checkpoint.jsonl'  # Completed flyers, one JSON object per line
+IN_FLIGHT_PER_WORKER = 2  # Flyer groups queued per render thread before the next slice is fetched
+
+
+def read_sku_stream(lines):
+    """Normalized SKUs from lines of text as they are read, without repeats"""
+    seen = set()
+    for line in lines:
+        for value in line.split(','):
+            sku = normalize_sku(value)
+            if sku and sku not in seen:
+                seen.add(sku)
+                yield sku
+
+
+def slices(skus, size):
+    """Lists of up to ``size`` SKUs from an iterable"""
+    batch = []
+    for sku in skus:
+        batch.append(sku)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def input_hash(product_data):
+    """Hash of everything a SKU's flyer is rendered from: its product record, the templates and the backend"""
+    digest = hashlib.sha256(f"{TEMPLATE_VERSION}:{FLYER_BACKEND}".encode('utf-8'))
+    digest.update(json.dumps(product_data._asdict(), sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+def load_checkpoint(path):
+    """SKU -> latest checkpoint entry; a line cut short by a crash is ignored"""
+    done = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    done[entry['sku']] = entry
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except OSError:
+        pass
+    return done
+
+
+def end_last_line(path):
+    """Terminate a checkpoint line cut short by a crash, so appended entries start on their own line"""
+    try:
+        with open(path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+    except OSError:
+        pass
+
+
+def render_group(skus, products_data, out_dir):
+    """Render one flyer group (see group_by_flyer) and write it under each SKU's filename.
+
+    Returns (pdf_bytes, error).
+    """
+    pdf_bytes, error = generate_single_flyer(skus[0], products_data)
+    if error:
+        return None, error
+    for sku in skus:
+        write_atomic(os.path.join(out_dir, flyer_filename(sku)), pdf_bytes)
+    return pdf_bytes, None
+
+
+def run(skus, out_dir, resume=False, workers=MAX_WORKERS, fetch_size=FETCH_CHUNK_SIZE):
+    """Render an iterable of SKUs into ``out_dir``, checkpointing every flyer.
+
+    Returns (stats, errors).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint_path = os.path.join(out_dir, CHECKPOINT_FILE)
+    done = {}
+    if resume:
+        done = load_checkpoint(checkpoint_path)
+        end_last_line(checkpoint_path)
+    stats = {'rendered': 0, 'shared': 0, 'skipped': 0, 'failed': 0}
+    errors = []
+    pending = {}  # Future -> (group, input hashes)
+
+    get_renderer()
+    with open(checkpoint_path, 'a' if resume else 'w', encoding='utf-8') as checkpoint, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+
+        def collect(futures):
+            """Checkpoint finished groups; only this thread writes the checkpoint"""
+            for future in futures:
+                group, hashes = pending.pop(future)
+                pdf_bytes, error = future.result()
+                if error:
+                    errors.extend(f"{sku}: {error}" for sku in group)
+                    stats['failed'] += len(group)
+                    continue
+                etag = hashlib.sha256(pdf_bytes).hexdigest()[:32]
+                for i, sku in enumerate(group):
+                    checkpoint.write(json.dumps({
+                        'sku': sku,
+                        'file': flyer_filename(sku),
+                        'input_hash': hashes[sku],
+                        'etag': etag,
+                        'generated_at': int(time.time()),
+                    }) + '\n')
+                    stats['shared' if i else 'rendered'] += 1
+                checkpoint.flush()
+
+        for batch in slices(skus, fetch_size):
+            products_data, fetch_errors = fetch_all_products(batch)
+            errors.extend(fetch_errors)
+            stats['failed'] += sum(1 for sku in batch if sku not in products_data)
+
+            stale = []
+            hashes = {}
+            for sku in batch:
+                if sku not in products_data:
+                    continue
+                hashes[sku] = input_hash(products_data[sku])
+                entry = done.get(sku)
+                if (entry and entry.get('input_hash') == hashes[sku]
+                        and os.path.exists(os.path.join(out_dir, entry.get('file', '')))):
+                    stats['skipped'] += 1
+                else:
+                    stale.append(sku)
+            prefetch_images(products_data[sku].image_url for sku in stale)
+
+            for group in group_by_flyer(stale, products_data):
+                future = executor.submit(render_group, group, products_data, out_dir)
+                pending[future] = (group, hashes)
+                # Bound the queue, so SKUs keep streaming in rather than being fetched all up front
+                while len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            logger.info(f"Checkpointed {stats['rendered'] + stats['shared']} flyers, "
+                        f"skipped {stats['skipped']}, {stats['failed']} failed")
+        collect(wait(pending).done)
+
+    return stats, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('skus', help='file of SKUs, or - for stdin')
+    parser.add_argument('--out', required=True, help='directory the PDFs and checkpoint are written to')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip SKUs the checkpoint lists as done whose inputs are unchanged')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    parser.add_argument('--fetch-size', type=int, default=FETCH_CHUNK_SIZE, help='SKUs fetched per Shopify slice')
+    args = parser.parse_args()
+
+    if args.skus == '-':
+        stats, errors = run(read_sku_stream(sys.stdin), args.out, args.resume, args.workers, args.fetch_size)
+    else:
+        with open(args.skus, encoding='utf-8') as f:
+            stats, errors = run(read_sku_stream(f), args.out, args.resume, args.workers, args.fetch_size)
+    print(f"{stats['rendered']} rendered, {stats['shared']} sharing a render, {stats['skipped']} already done, "
+          f"{stats['failed']} failed")
+    for error in errors:
+        print(f"  {error}")
+    sys.exit(1 if stats['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Field manifest for the flyer: everything the templates read from Shopify.
+
+The GraphQL queries are generated from these declarations, so adding a
+field to the flyer means adding it here rather than over-fetching
+``metafields(first: 100)`` for every product.
+"""
+import json
+
+from asset_cache import DEFAULT_IMAGE_CSS_WIDTH, PRINT_SCALE
+
+# Product metafields read by prepare_template_context and the /getproduct route
+PRODUCT_METAFIELDS = [
+    ('custom', 'about_the_book'),
+    ('custom', 'about_the_author'),
+    ('custom', 'table_of_contents'),
+    ('custom', 'author'),
+    ('custom', 'author2'),
+    ('custom', 'author3'),
+    ('custom', 'publisher'),
+    ('custom', 'imprint'),
+    ('custom', 'publication_date'),
+    ('custom', 'pages'),
+    ('custom', 'subject'),
+    ('custom', 'volume'),
+    ('custom', 'edition'),
+]
+
+PRODUCT_FIELDS = ['id', 'title', 'productType', 'updatedAt']  # updatedAt drives incremental pre-generation
+VARIANT_FIELDS = ['sku', 'title', 'price']
+VARIANT_EDITION_METAFIELD = ('custom', 'edition')
+MAX_VARIANTS = 10  # Variants listed on a flyer
+IMAGE_PRINT_WIDTH = DEFAULT_IMAGE_CSS_WIDTH * PRINT_SCALE  # Cover pixels requested from the CDN
+
+
+def metafield_alias(namespace, key):
+    """Field alias a product metafield is selected under, and its key in parsed metafields"""
+    return f"{namespace}_{key}"
+
+
+def _metafield_selections():
+    return [
+        f'{metafield_alias(namespace, key)}: metafield(namespace: "{namespace}", key: "{key}") {{ value }}'
+        for namespace, key in PRODUCT_METAFIELDS
+    ]
+
+
+def _indent(text, spaces):
+    return '\n'.join(' ' * spaces + line if line else line for line in text.splitlines())
+
+
+def _variant_selection(bulk=False):
+    namespace, key = VARIANT_EDITION_METAFIELD
+    fields = (['id'] if bulk else []) + VARIANT_FIELDS
+    return '\n'.join(fields + [
+        f'metafield(namespace: "{namespace}", key: "{key}") {{',
+        '  value',
+        '}',
+    ])
+
+
+def product_selection(bulk=False):
+    """Selection set for a product, limited to the fields the flyer uses.
+
+    Bulk operations do not accept a ``first`` argument on nested connections.
+    Metafields are selected one alias per manifest key, which the Admin API
+    and bulk operations both accept as plain fields on the product.
+    """
+    variants_args = '' if bulk else f'(first: {MAX_VARIANTS})'
+    return '\n'.join(PRODUCT_FIELDS + [
+        'featuredImage {',
+        f'  url(transform: {{maxWidth: {IMAGE_PRINT_WIDTH}}})',
+        '}',
+        f'variants{variants_args} {{',
+        '  edges {',
+        '    node {',
+        _indent(_variant_selection(bulk), 6),
+        '    }',
+        '  }',
+        '}',
+    ] + _metafield_selections())
+
+
+def build_variants_query(first=None):
+    """productVariants query for a SKU search string, paged with ``$after``.
+
+    ``first`` fixes the page size in the query text; without it the query
+    takes a ``$first`` variable.
+    """
+    first_arg = first if first is not None else '$first'
+    first_var = '' if first is not None else '$first: Int!, '
+    return f"""
+query GetProductsBySkus({first_var}$query: String!, $after: String) {{
+  productVariants(first: {first_arg}, query: $query, after: $after) {{
+    pageInfo {{
+      hasNextPage
+      endCursor
+    }}
+    edges {{
+      node {{
+{_indent(chr(10).join(VARIANT_FIELDS), 8)}
+        product {{
+{_indent(product_selection(), 10)}
+        }}
+      }}
+    }}
+  }}
+}}
+"""
+
+
+def build_bulk_products_query(search=None):
+    """Catalog-wide products query for bulkOperationRunQuery, optionally filtered by a search string"""
+    products_args = f'(query: {json.dumps(search)})' if search else ''
+    return f"""
+{{
+  products{products_args} {{
+    edges {{
+      node {{
+{_indent(product_selection(bulk=True), 8)}
+      }}
+    }}
+  }}
+}}
+"""
+
+
+def parse_metafields(product):
+    """Flatten product metafields into {namespace_key: value}.
+
+    Reads the per-key aliases selected by the manifest queries, and also
+    accepts the ``metafields { edges { node } }`` connection shape.
+    """
+    product = product or {}
+    metafields = {}
+    for namespace, key in PRODUCT_METAFIELDS:
+        alias = metafield_alias(namespace, key)
+        value = (product.get(alias) or {}).get('value')
+        if value is not None:
+            metafields[alias] = value
+
+    raw = product.get('metafields')
+    for edge in (raw.get('edges') or []) if isinstance(raw, dict) else []:
+        node = (edge or {}).get('node')
+        if not node:
+            continue
+        namespace = node.get('namespace')
+        key = node.get('key')
+        value = node.get('value')
+        if namespace and key and value is not None:
+            metafields[metafield_alias(namespace, key)] = value
+    return metafields
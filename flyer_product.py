@@ -0,0 +1,101 @@
+"""Compact per-SKU product records, holding only what the flyer reads.
+
+Fetches used to keep each variant's whole GraphQL ``node`` and ``product``
+dicts. A FlyerProduct keeps the handful of fields prepare_template_context
+uses. The variants of one product share a single metafields dict and
+variant tuple, and the (large) metafield values are interned, so a product
+fetched again for another SKU or batch does not hold another copy.
+"""
+import sys
+import json
+from collections import namedtuple
+
+from flyer_fields import VARIANT_FIELDS, parse_metafields
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard library decoder is used without it
+    orjson = None
+
+# One variant listed on the flyer
+FlyerVariant = namedtuple('FlyerVariant', 'sku title price edition')
+
+# One SKU's flyer inputs; ``variants`` and ``metafields`` are shared by the SKUs of a product
+FlyerProduct = namedtuple(
+    'FlyerProduct', 'sku product_id title product_type updated_at image_url price edition variants metafields'
+)
+
+
+def json_loads(data):
+    """Decode JSON (str or bytes) with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _edition(variant):
+    return (variant.get('metafield') or {}).get('value')
+
+
+def product_parts(product):
+    """(metafields, variants) of a raw GraphQL product, to share between its SKUs"""
+    metafields = {key: _intern(value) for key, value in parse_metafields(product).items()}
+    variants = tuple(
+        FlyerVariant(*(_intern(node.get(field)) for field in VARIANT_FIELDS), _intern(_edition(node)))
+        for node in ((edge or {}).get('node') or {} for edge in ((product.get('variants') or {}).get('edges') or []))
+    )
+    return metafields, variants
+
+
+def flyer_product(variant, product, shared=None):
+    """FlyerProduct for a raw GraphQL variant node and its product.
+
+    ``shared`` (product id -> product_parts) lets the variants of a product
+    parsed in the same pass share one copy of its metafields and variants.
+    """
+    product = product or {}
+    product_id = product.get('id')
+    if shared is not None and product_id:
+        if product_id not in shared:
+            shared[product_id] = product_parts(product)
+        metafields, variants = shared[product_id]
+    else:
+        metafields, variants = product_parts(product)
+    sku = variant.get('sku')
+    if 'metafield' in variant:
+        edition = _edition(variant)
+    else:
+        # productVariants nodes select the edition only on the product's own variant list
+        edition = next((v.edition for v in variants if v.sku == sku), None)
+    return FlyerProduct(
+        sku=sku,
+        product_id=product_id,
+        title=_intern(product.get('title')),
+        product_type=_intern(product.get('productType')),
+        updated_at=product.get('updatedAt'),
+        image_url=(product.get('featuredImage') or {}).get('url'),
+        price=variant.get('price'),
+        edition=_intern(edition),
+        variants=variants,
+        metafields=metafields,
+    )
+
+
+def to_json(record):
+    """Serialize a FlyerProduct for the persistent product cache"""
+    return json.dumps(record._asdict())
+
+
+def from_json(text):
+    """FlyerProduct from ``to_json`` output; raises ValueError for anything else"""
+    try:
+        fields = json_loads(text)
+        fields['variants'] = tuple(FlyerVariant(*variant) for variant in fields['variants'])
+        fields['metafields'] = {key: _intern(value) for key, value in fields['metafields'].items()}
+        return FlyerProduct(**fields)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Not a FlyerProduct record: {str(e)}") from None
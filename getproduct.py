@@ -1,58 +1,38 @@
 from flask import Flask, request, render_template, send_file, jsonify
 from flask_cors import CORS
-import pdfkit
 import io
 import os
-from bs4 import BeautifulSoup
+import hmac
+import base64
+import hashlib
+import logging
 import requests
 from datetime import datetime
 from dotenv import load_dotenv
 load_dotenv()
+from renderer import WKHTMLTOPDF_PATH, get_renderer, render_pdf
+from product_cache import get_product_cache, skus_from_webhook
+from flyer_fields import build_variants_query
+from flyer_product import flyer_product, json_loads
+from jobs import FlyerRequestError, accept_job, register_job_routes, wants_async
+from singleflight import SingleFlight
+from static_flyers import get_pregenerated, pregenerated_response, register_flyer_routes
+from text_fit import fit_flyer_context
+
+logger = logging.getLogger(__name__)
 
 SHOPIFY_DOMAIN = os.getenv("SHOPIFY_DOMAIN")
 SHOPIFY_ACCESS_TOKEN = os.getenv("SHOPIFY_ACCESS_TOKEN")
+SHOPIFY_WEBHOOK_SECRET = os.getenv("SHOPIFY_WEBHOOK_SECRET")
 
 app = Flask(__name__)
-CORS(app, resources={r"/getproduct": {"origins": "*"}})
+CORS(app, resources={r"/getproduct": {"origins": "*"}, r"/jobs/*": {"origins": "*"}, r"/flyers/*": {"origins": "*"}})
+register_job_routes(app)
+flights = SingleFlight()  # Concurrent clicks for one ISBN share one fetch and render
 
 # PDF Tool Config
-WKHTMLTOPDF_PATH = r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe"
 if not os.path.exists(WKHTMLTOPDF_PATH):
     raise FileNotFoundError(f"wkhtmltopdf not found at {WKHTMLTOPDF_PATH}")
-config = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
-
-def truncate_html_preserving_tags(html_content, char_limit):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    total_chars = 0
-
-    def truncate_node(node):
-        nonlocal total_chars
-        if node.name is None:  # NavigableString
-            if total_chars >= char_limit:
-                node.extract()
-                return
-            text_len = len(node)
-            if total_chars + text_len > char_limit:
-                node.replace_with(node[:char_limit - total_chars])
-                total_chars = char_limit
-            else:
-                total_chars += text_len
-        else:
-            for child in list(node.contents):
-                if total_chars >= char_limit:
-                    child.extract()
-                else:
-                    truncate_node(child)
-
-    truncate_node(soup)
-
-    if total_chars >= char_limit:
-        note = soup.new_tag("p")
-        note.string = "[... visit our website to learn more]"
-        soup.append(note)
-
-    return str(soup)
-
 
 def safe_get(dictionary, keys, default=''):
     """Safely get nested dictionary keys"""
@@ -71,6 +51,12 @@ def fetch_products_by_skus(skus):
 
     if not skus or not isinstance(skus, str):
         return None, ["Invalid SKUs input. It must be a non-empty string."]
+
+    # Serve from the product cache when the record is still fresh
+    product_cache = get_product_cache()
+    cached, _ = product_cache.get_many([skus])
+    if cached:
+        return cached, []
     
     headers = {
         "X-Shopify-Access-Token": SHOPIFY_ACCESS_TOKEN,
@@ -79,47 +65,7 @@ def fetch_products_by_skus(skus):
     }
 
     try:
-        query = """
-        query GetProductsBySkus($query: String!) {
-          productVariants(first: 25, query: $query) {
-            edges {
-              node {
-                sku
-                title
-                price
-                product {
-                  title
-                  productType
-                  featuredImage {
-                    url
-                  }
-                  variants(first: 10) {
-                    edges {
-                      node {
-                        sku
-                        title
-                        price
-                        metafield(namespace: "custom", key: "edition") {
-                          value
-                        }
-                      }
-                    }
-                  }
-                  metafields(first: 100) {
-                    edges {
-                      node {
-                        namespace
-                        key
-                        value
-                      }
-                    }
-                  }
-                }
-              }
-            }
-          }
-        }
-        """
+        query = build_variants_query(first=25)
         variables = {
             "query": skus
         }
@@ -130,7 +76,7 @@ def fetch_products_by_skus(skus):
         )
         response.raise_for_status()
 
-        data = response.json()
+        data = json_loads(response.content)
 
         if safe_get(data, 'errors'):
             errors = [err.get('message', 'Unknown GraphQL error') for err in safe_get(data, 'errors', [])]
@@ -142,45 +88,22 @@ def fetch_products_by_skus(skus):
 
         products_by_sku = {}
         errors = []
+        shared = {}  # Product id -> parts shared by that product's SKUs
 
         for edge in edges:
+            sku = None
             try:
                 node = safe_get(edge, 'node', {})
                 sku = safe_get(node, 'sku')
                 if not sku:
                     continue
 
-                product = safe_get(node, 'product', {})
-
-                # Process metafields
-                metafield_edges = safe_get(product, ['metafields', 'edges'], [])
-                metafields = {}
-                for mf in metafield_edges:
-                    mf_node = safe_get(mf, 'node', {})
-                    namespace = safe_get(mf_node, 'namespace')
-                    key = safe_get(mf_node, 'key')
-                    value = safe_get(mf_node, 'value')
-                    if namespace and key and value is not None:
-                        metafields[f"{namespace}_{key}"] = value
-
-                # Get edition from variant metafield
-                variant_metafield = None
-                for v_edge in safe_get(product, ['variants', 'edges'], []):
-                    v_node = safe_get(v_edge, 'node', {})
-                    if safe_get(v_node, 'sku') == sku:
-                        variant_metafield = safe_get(v_node, ['metafield', 'value'])
-                        break
-
-                products_by_sku[sku] = {
-                    'variant': node,
-                    'product': product,
-                    'metafields': metafields,
-                    'edition': variant_metafield
-                }
+                products_by_sku[sku] = flyer_product(node, safe_get(node, 'product', {}), shared)
             except Exception as e:
                 error_msg = f"Error processing product {sku}: {str(e)}"
                 errors.append(error_msg)
 
+        product_cache.put_many(products_by_sku)
         return products_by_sku, errors
 
     except requests.exceptions.RequestException as e:
@@ -190,6 +113,90 @@ def fetch_products_by_skus(skus):
         error_msg = f"Unexpected error: {str(e)}"
         return None, [error_msg]
  
+def build_product_flyer(datasku, data):
+    """Fetch a product by ISBN and render its flyer; returns (pdf_bytes, download_name)"""
+    products, errors = fetch_products_by_skus(str(datasku))
+    if errors:
+        raise FlyerRequestError({"errors": errors}, 400)
+    product = products.get(datasku) if products else None
+    print(product)
+    if not product:
+        raise FlyerRequestError({"error": "Product not found"}, 404)
+    # Extraction code
+    product_title = product.title
+    image_url = product.image_url
+    variants = [
+        {
+      "title": variant.title,
+      "sku": variant.sku,
+      "isbn": variant.sku,
+      "price": variant.price,
+      "currency": "USD",  # Assuming currency is USD as it's not in the response
+      "edition": product.edition,
+        }
+        for variant in product.variants
+    ]
+
+    metafields = product.metafields
+    subject_raw = metafields.get("custom_subject")
+    # Remove brackets and quotes
+    subject = subject_raw.strip('[]').replace('"', '').replace("'", '') if subject_raw else None
+    # Optional: handle multiple items by splitting
+    subject = ", ".join(item.strip() for item in subject.split(',') if item.strip()) if subject else None
+    publisher = metafields.get("custom_publisher")
+    edition = metafields.get("custom_edition")  # This will be None if not present
+    volume = metafields.get("custom_volume")    # This will also be None if not present
+    pub_date = metafields.get("custom_publication_date")
+    formatted_date = None
+    if pub_date:
+      try:
+        date_obj = datetime.strptime(pub_date, "%Y-%m-%d")
+        formatted_date = date_obj.strftime("%B %d, %Y")
+      except ValueError:
+        formatted_date = pub_date  # Fallback to raw date if parsing fails
+    pages = metafields.get("custom_pages")
+
+    authors = ", ".join(filter(None, [
+        metafields.get("custom_author"),
+        metafields.get("custom_author2"),
+        metafields.get("custom_author3"),
+    ]))
+
+    context = dict(
+        product_title=product_title,
+        product_image=image_url,
+        product_category=subject,
+        publisher=publisher,
+        edition=edition,
+        volume=volume,
+        publishing_date=formatted_date,
+        pages=pages,
+        variants=variants,
+        book_desc=metafields.get("custom_about_the_book", ""),
+        author=authors,
+        about_author=metafields.get("custom_about_the_author", ""),
+        toc=metafields.get("custom_table_of_contents", "")
+    )
+    # Cut the HTML sections at the lines that fill the page instead of fixed character counts
+    fit_flyer_context(context)
+
+    # Render HTML template
+    rendered_html = render_template('flyer_template.html', **context)
+
+    options = {
+        'page-size': 'A4',
+        'encoding': 'UTF-8',
+        'margin-top': '0',
+        'margin-right': '0',
+        'margin-bottom': '0',
+        'margin-left': '0',
+        'zoom': '1',
+        'enable-local-file-access': None,
+    }
+
+    pdf = render_pdf(rendered_html, options)
+    return pdf, f"{data.get('product_title', 'flyer')}_flyer.pdf"
+
 @app.route('/getproduct', methods=['POST', 'OPTIONS'])
 def generate_pdf():
     if request.method == 'OPTIONS':
@@ -198,94 +205,56 @@ def generate_pdf():
     try:
         data = request.get_json()
         datasku = data.get("isbn")
-        products, errors = fetch_products_by_skus(str(datasku))
-        if errors:
-            return jsonify({"errors": errors}), 400
-        product = products.get(datasku) if products else None
-        print(product)
-        if not product:
-            return jsonify({"error": "Product not found"}), 404
-        # Extraction code
-        product_title = product["product"]["title"]
-        image_url = product["product"]["featuredImage"]["url"] if product["product"].get("featuredImage") else None
-        variants = [
-            {
-          "title": variant["node"]["title"],
-          "sku": variant["node"]["sku"],
-          "isbn": variant["node"]["sku"],
-          "price": variant["node"]["price"],
-          "currency": "USD",  # Assuming currency is USD as it's not in the response
-          "edition": product["edition"],
-            }
-            for variant in product["product"]["variants"]["edges"]
-        ]
-
-        metafields = product["metafields"]
-        subject_raw = metafields.get("custom_subject")
-        # Remove brackets and quotes
-        subject = subject_raw.strip('[]').replace('"', '').replace("'", '') if subject_raw else None
-        # Optional: handle multiple items by splitting
-        subject = ", ".join(item.strip() for item in subject.split(',') if item.strip()) if subject else None
-        publisher = metafields.get("custom_publisher")
-        edition = metafields.get("custom_edition")  # This will be None if not present
-        volume = metafields.get("custom_volume")    # This will also be None if not present
-        pub_date = metafields.get("custom_publication_date")
-        formatted_date = None
-        if pub_date:
-          try:
-            date_obj = datetime.strptime(pub_date, "%Y-%m-%d")
-            formatted_date = date_obj.strftime("%B %d, %Y")
-          except ValueError:
-            formatted_date = pub_date  # Fallback to raw date if parsing fails
-        pages = metafields.get("custom_pages")
-
-        # Assuming truncate_html_preserving_tags is a defined function
-        about_book = truncate_html_preserving_tags(metafields.get("custom_about_the_book", ""),1300)
-        authors = ", ".join(filter(None, [
-            metafields.get("custom_author"),
-            metafields.get("custom_author2"),
-            metafields.get("custom_author3"),
-        ]))
-        about_author = truncate_html_preserving_tags(metafields.get("custom_about_the_author", ""),1300)
-        toc = truncate_html_preserving_tags(metafields.get("custom_table_of_contents", ""), 1100)
-
-        # Render HTML template
-        rendered_html = render_template(
-            'flyer_template.html',
-            product_title=product_title,
-            product_image=image_url,
-            product_category=subject,
-            publisher=publisher,
-            edition=edition,
-            volume=volume,
-            publishing_date=formatted_date,
-            pages=pages,
-            variants=variants,
-            book_desc=about_book,
-            author=authors,
-            about_author=about_author,
-            toc=toc
-        )
 
-        options = {
-            'page-size': 'A4',
-            'encoding': 'UTF-8',
-            'margin-top': '0',
-            'margin-right': '0',
-            'margin-bottom': '0',
-            'margin-left': '0',
-            'zoom': '1',
-        }
+        # Pre-generated flyers are a static file read; a miss renders live below
+        pregenerated = pregenerated_response(datasku, f"{data.get('product_title', 'flyer')}_flyer.pdf")
+        if pregenerated is not None:
+            return pregenerated
+
+        # Concurrent requests for the same ISBN wait for the first one's fetch and render
+        key = f"getproduct:{datasku}"
+
+        # ?async=1 answers 202 with a job id; the Shopify fetch and render run on the job pool
+        if wants_async():
+            return accept_job(flights.do, key, build_product_flyer, datasku, data, key=key)
 
-        pdf = pdfkit.from_string(rendered_html, False, configuration=config, options=options)
+        pdf, download_name = flights.do(key, build_product_flyer, datasku, data)
 
         return send_file(
             io.BytesIO(pdf),
-            download_name=f"{data.get('product_title', 'flyer')}_flyer.pdf",
+            download_name=download_name,
             mimetype='application/pdf'
         )
+    except FlyerRequestError as e:
+        return jsonify(e.body), e.status
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def render_live_flyer(sku):
+    """Live render for /flyers/<sku>.pdf when the flyer is not pre-generated"""
+    return flights.do(f"getproduct:{sku}", build_product_flyer, sku, {})
+
+register_flyer_routes(app, render_live_flyer)
+
+def verify_webhook(raw_body, hmac_header):
+    """Check Shopify's X-Shopify-Hmac-Sha256 signature; unsigned webhooks pass when no secret is configured"""
+    if not SHOPIFY_WEBHOOK_SECRET:
+        return True
+    digest = hmac.new(SHOPIFY_WEBHOOK_SECRET.encode('utf-8'), raw_body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode('utf-8'), hmac_header or '')
+
+@app.route('/webhooks/products-update', methods=['POST'])
+def products_update_webhook():
+    if not verify_webhook(request.get_data(), request.headers.get('X-Shopify-Hmac-Sha256')):
+        return jsonify({"error": "Invalid webhook signature"}), 401
+
+    payload = request.get_json(silent=True) or {}
+    skus, product_id = skus_from_webhook(payload)
+    evicted = get_product_cache().evict(skus, [product_id] if product_id else [])
+    discarded = get_pregenerated().discard(skus)
+    logger.info(f"Product webhook for {product_id}: evicted {evicted} cached SKUs, {discarded} pre-generated flyers")
+    return jsonify({"evicted": evicted}), 200
+
 if __name__ == '__main__':
+    get_renderer()  # Warm the renderer workers before serving requests
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,312 @@
+import os
+import re
+import html
+import hashlib
+import logging
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from html.entities import html5
+from html.parser import HTMLParser
+
+logger = logging.getLogger(__name__)
+
+# Truncation configuration
+TRUNCATE_CACHE_SIZE = int(os.getenv('TRUNCATE_CACHE_SIZE', '2048'))  # Memoized (content, limit) results, 0 disables
+TRUNCATION_NOTE = "[... visit our website to learn more]"
+
+# Output matches BeautifulSoup(html, 'html.parser') serialized with str(): these are its tree-builder rules
+VOID_TAGS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta',
+    'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex',
+    'nextid', 'spacer',
+])
+PRESERVE_WHITESPACE_TAGS = frozenset(['pre', 'textarea'])
+RAW_TEXT_TAGS = frozenset(['script', 'style'])  # Text inside is written unescaped
+LIST_ATTRIBUTES = {  # Whitespace-separated values, normalized to single spaces
+    '*': frozenset(['class', 'accesskey', 'dropzone']),
+    'a': frozenset(['rel', 'rev']),
+    'link': frozenset(['rel', 'rev']),
+    'td': frozenset(['headers']),
+    'th': frozenset(['headers']),
+    'form': frozenset(['accept-charset']),
+    'object': frozenset(['archive']),
+    'area': frozenset(['rel']),
+    'icon': frozenset(['sizes']),
+    'iframe': frozenset(['sandbox']),
+    'output': frozenset(['for']),
+}
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+# (prefix, suffix) of the non-text nodes that count toward the limit like text does
+COMMENT = ('<!--', '-->')
+DOCTYPE = ('<!DOCTYPE ', '>\n')
+CDATA = ('<![CDATA[', ']]>')
+DECLARATION = ('<?', '?>')
+PROCESSING_INSTRUCTION = ('<?', '>')
+
+_NONWHITESPACE_RE = re.compile(r'\S+')
+
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _quote(value):
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    return '"' + value.replace('"', '&quot;') + '"'
+
+
+def _charref(name):
+    """Decode a numeric character reference the way BeautifulSoup does"""
+    number = int(name[1:], 16) if name[:1] in 'xX' else int(name)
+    if number == 0 or number > 0x10FFFF or 0xD800 <= number <= 0xDFFF:
+        return '\ufffd'
+    # html.unescape drops control characters and noncharacters, BeautifulSoup keeps them
+    return html.unescape(f'&#{number};') or chr(number)
+
+
+def start_tag_html(tag, attrs):
+    """A start tag serialized the way BeautifulSoup writes it"""
+    values = {}
+    for name, value in attrs:
+        values[name] = '' if value is None else value
+    list_attributes = LIST_ATTRIBUTES['*'] | LIST_ATTRIBUTES.get(tag, frozenset())
+    rendered = []
+    for name, value in sorted(values.items()):
+        if name in list_attributes:
+            value = ' '.join(_NONWHITESPACE_RE.findall(value))
+        rendered.append(f" {name}={_quote(_escape(value))}")
+    return f"<{tag}{''.join(rendered)}{'/' if tag in VOID_TAGS else ''}>"
+
+
+class _BudgetSpent(Exception):
+    pass
+
+
+class TextNodeParser(HTMLParser):
+    """Replays BeautifulSoup's html.parser tree building as a stream of events.
+
+    Text is buffered per node between tag events, as BeautifulSoup does,
+    because whitespace-only nodes collapse to one character. Subclasses get
+    ``start_tag``, ``end_tag`` (for every tag closed, including ones closed
+    implicitly by an outer end tag) and ``text_node`` with the node's text
+    and its kind (None for text, or one of the (prefix, suffix) pairs).
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.stack = []  # Open (non-void) tag names
+        self.text = []  # Data of the current text node
+        self.closed_void = []  # Void tags whose </tag> should be ignored
+
+    def start_tag(self, tag, attrs):
+        pass
+
+    def end_tag(self, tag):
+        pass
+
+    def text_node(self, text, kind):
+        pass
+
+    def flush(self, kind=None):
+        if not self.text:
+            return
+        text = ''.join(self.text)
+        self.text = []
+        if not text.strip(ASCII_SPACES) and not any(name in PRESERVE_WHITESPACE_TAGS for name in self.stack):
+            text = '\n' if '\n' in text else ' '
+        self.text_node(text, kind)
+
+    def handle_starttag(self, tag, attrs, close_void=True):
+        self.flush()
+        self.start_tag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.stack.append(tag)
+        elif close_void:
+            self.closed_void.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, close_void=False)
+        self.handle_endtag(tag, check_void=False)
+
+    def handle_endtag(self, tag, check_void=True):
+        if check_void and tag in self.closed_void:
+            self.closed_void.remove(tag)
+            return
+        self.flush()
+        if tag in self.stack:
+            # Like BeautifulSoup, close every tag opened inside the one being closed
+            while True:
+                name = self.stack.pop()
+                self.end_tag(name)
+                if name == tag:
+                    break
+
+    def handle_data(self, data):
+        self.text.append(data)
+
+    def handle_charref(self, name):
+        self.text.append(_charref(name))
+
+    def handle_entityref(self, name):
+        self.text.append(html5.get(f"{name};", f"&{name}"))
+
+    def _handle_node(self, data, kind):
+        self.flush()
+        self.text.append(data)
+        self.flush(kind)
+
+    def handle_comment(self, data):
+        self._handle_node(data, COMMENT)
+
+    def handle_decl(self, decl):
+        self._handle_node(decl[len('DOCTYPE '):], DOCTYPE)
+
+    def unknown_decl(self, data):
+        if data.upper().startswith('CDATA['):
+            self._handle_node(data[len('CDATA['):], CDATA)
+        else:
+            self._handle_node(data, DECLARATION)
+
+    def handle_pi(self, data):
+        self._handle_node(data, PROCESSING_INSTRUCTION)
+
+
+class _TruncatingParser(TextNodeParser):
+    """Copies HTML to the output until ``char_limit`` characters of text have been seen.
+
+    Once the limit is reached ``text_node`` raises, so the rest of the input
+    is never parsed; the still-open tags are closed by ``result``.
+    """
+
+    def __init__(self, char_limit):
+        super().__init__()
+        self.remaining = char_limit
+        self.out = []
+
+    def start_tag(self, tag, attrs):
+        self.out.append(start_tag_html(tag, attrs))
+
+    def end_tag(self, tag):
+        self.out.append(f"</{tag}>")
+
+    def text_node(self, text, kind):
+        raw = bool(self.stack) and self.stack[-1] in RAW_TEXT_TAGS
+        if len(text) > self.remaining:
+            # The node that crosses the limit is cut and kept as plain text
+            text = text[:self.remaining]
+            self.out.append(text if raw else _escape(text))
+            self.remaining = 0
+        else:
+            self.remaining -= len(text)
+            if kind:
+                self.out.append(kind[0] + text + kind[1])
+            else:
+                self.out.append(text if raw else _escape(text))
+        if self.remaining <= 0:
+            raise _BudgetSpent()
+
+    def result(self, note):
+        closing = ''.join(f"</{name}>" for name in reversed(self.stack))
+        suffix = f"<p>{_escape(note)}</p>" if self.remaining <= 0 else ''
+        return ''.join(self.out) + closing + suffix
+
+
+class SerializingParser(TextNodeParser):
+    """Serializes the HTML as _TruncatingParser does, without a limit.
+
+    Every text node's offset, output position and open tags are kept, so
+    ``cut`` can return what truncate_html_preserving_tags would for any
+    limit within the text parsed so far, without parsing it again.
+    Subclasses extending ``text_node`` call this one first.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.out = []
+        self.chars = 0  # Characters of text seen, counted as the limit counts them
+        self.node_ends = []  # Offset just past each text node
+        self.nodes = []  # (start offset, index in out, open tags, text, raw) of each text node
+
+    def start_tag(self, tag, attrs):
+        self.out.append(start_tag_html(tag, attrs))
+
+    def end_tag(self, tag):
+        self.out.append(f"</{tag}>")
+
+    def text_node(self, text, kind):
+        raw = bool(self.stack) and self.stack[-1] in RAW_TEXT_TAGS
+        self.nodes.append((self.chars, len(self.out), tuple(self.stack), text, raw))
+        self.chars += len(text)
+        self.node_ends.append(self.chars)
+        if kind:
+            self.out.append(kind[0] + text + kind[1])
+        else:
+            self.out.append(text if raw else _escape(text))
+
+    def cut(self, char_limit, note=TRUNCATION_NOTE):
+        """The HTML truncated at ``char_limit``, or None when the text parsed so far ends before it"""
+        if char_limit <= 0:
+            return f"<p>{_escape(note)}</p>"
+        index = bisect_left(self.node_ends, char_limit)
+        if index == len(self.nodes):
+            return None
+        start, position, stack, text, raw = self.nodes[index]
+        if len(text) > char_limit - start:
+            text = text[:char_limit - start]
+            last = text if raw else _escape(text)
+        else:
+            last = self.out[position]
+        closing = ''.join(f"</{name}>" for name in reversed(stack))
+        return ''.join(self.out[:position]) + last + closing + f"<p>{_escape(note)}</p>"
+
+
+def _truncate(html_content, char_limit, note):
+    if char_limit <= 0:
+        return f"<p>{_escape(note)}</p>"
+    parser = _TruncatingParser(char_limit)
+    try:
+        parser.feed(html_content)
+        parser.close()
+        parser.flush()
+    except _BudgetSpent:
+        pass
+    return parser.result(note)
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def truncate_html_preserving_tags(html_content, char_limit, note=TRUNCATION_NOTE):
+    """Cut HTML to ``char_limit`` characters of text, keeping tags balanced.
+
+    Output is the same as the BeautifulSoup tree walk this replaces, with
+    ``note`` appended as a paragraph when the limit is reached. Results are
+    memoized on (content hash, limit, note).
+    """
+    if not html_content or not isinstance(html_content, str):
+        return ''
+
+    key = (hashlib.sha256(html_content.encode('utf-8', 'surrogatepass')).digest(), char_limit, note)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    try:
+        truncated = _truncate(html_content, char_limit, note)
+    except Exception as e:
+        logger.error(f"HTML truncation failed: {str(e)}")
+        return html_content[:char_limit]
+
+    if TRUNCATE_CACHE_SIZE > 0:
+        with _cache_lock:
+            _cache[key] = truncated
+            while len(_cache) > TRUNCATE_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return truncated
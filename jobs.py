@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import uuid
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Response, current_app, jsonify, request, send_file, stream_with_context, url_for
+
+from output_spool import SPOOL_DIR, discard
+
+logger = logging.getLogger(__name__)
+
+# Job configuration
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))  # Flyers rendered concurrently for async requests
+JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', '100'))  # Queued or running jobs before new ones get a 503
+JOB_TTL = int(os.getenv('JOB_TTL', '900'))  # Seconds a finished job and its PDF stay downloadable
+JOB_EVENT_KEEPALIVE = 15  # Seconds between SSE comments so proxies keep the stream open
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class FlyerRequestError(Exception):
+    """A request that cannot produce a flyer, with the HTTP status and JSON body to answer with"""
+
+    def __init__(self, body, status=400):
+        super().__init__(body.get('error') or body.get('errors'))
+        self.body = body
+        self.status = status
+
+
+class JobQueueFull(Exception):
+    """Raised when the job backlog is at JOB_MAX_PENDING"""
+
+
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.key = None
+        self.status = QUEUED
+        self.error = None  # JSON body for a failed job
+        self.error_status = None
+        self.path = None  # Spooled PDF of a finished job
+        self.download_name = None
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        job = {
+            'job_id': self.id,
+            'status': self.status,
+            'status_url': url_for('job_status', job_id=self.id),
+            'events_url': url_for('job_events', job_id=self.id),
+        }
+        if self.status == DONE:
+            job['download_url'] = url_for('job_download', job_id=self.id)
+        if self.status == FAILED:
+            job['error'] = self.error
+        return job
+
+
+class JobQueue:
+    """Runs flyer jobs on a bounded worker pool and keeps their PDFs on disk until they expire"""
+
+    def __init__(self, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, ttl=JOB_TTL, spool_dir=SPOOL_DIR):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='flyer-job')
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.spool_dir = spool_dir
+        self.jobs = {}
+        self.in_flight = {}  # Coalescing key -> queued or running job
+        self.pending = 0
+        self._cond = threading.Condition()
+
+    def submit(self, func, *args, key=None):
+        """Queue ``func(*args)``, which returns (pdf_bytes, download_name).
+
+        A request with the same ``key`` as a job still queued or running
+        gets that job back instead of a new one.
+        """
+        with self._cond:
+            self._prune()
+            if key is not None and key in self.in_flight:
+                return self.in_flight[key]
+            if self.pending >= self.max_pending:
+                raise JobQueueFull(f"{self.pending} flyer jobs already pending")
+            job = Job(uuid.uuid4().hex)
+            job.key = key
+            self.jobs[job.id] = job
+            if key is not None:
+                self.in_flight[key] = job
+            self.pending += 1
+        self.executor.submit(self._run, job, func, args)
+        return job
+
+    def _run(self, job, func, args):
+        self._set_status(job, RUNNING)
+        try:
+            pdf_bytes, download_name = func(*args)
+            path = os.path.join(self.spool_dir or tempfile.gettempdir(), f"flyer_job_{job.id}.pdf")
+            with open(path, 'wb') as f:
+                f.write(pdf_bytes)
+            job.path, job.download_name = path, download_name
+            self._set_status(job, DONE)
+        except FlyerRequestError as e:
+            job.error, job.error_status = e.body, e.status
+            self._set_status(job, FAILED)
+        except Exception as e:
+            logger.error(f"Flyer job {job.id} failed: {str(e)}")
+            job.error, job.error_status = {"error": str(e)}, 500
+            self._set_status(job, FAILED)
+
+    def _set_status(self, job, status):
+        with self._cond:
+            job.status = status
+            if status in (DONE, FAILED):
+                job.finished = time.time()
+                self.pending -= 1
+                self.in_flight.pop(job.key, None)
+            self._cond.notify_all()
+
+    def _prune(self):
+        """Drop finished jobs older than the TTL, with their PDFs; caller holds the lock"""
+        cutoff = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished < cutoff]:
+            job = self.jobs.pop(job_id)
+            if job.path:
+                discard(job.path)
+
+    def get(self, job_id):
+        with self._cond:
+            self._prune()
+            return self.jobs.get(job_id)
+
+    def wait_for_change(self, job, status, timeout):
+        """Block until the job leaves ``status`` or the timeout passes; returns the current status"""
+        with self._cond:
+            self._cond.wait_for(lambda: job.status != status, timeout=timeout)
+            return job.status
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the process-wide flyer job queue"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
+
+
+def wants_async():
+    """True when the client asked for a job id instead of the PDF (?async=1 or Prefer: respond-async)"""
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+
+def accept_job(func, *args, key=None):
+    """Queue a flyer job and answer 202 with its URLs, or 503 when the queue is full.
+
+    Requests sharing ``key`` with a job in flight get that job's id.
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        # render_template needs the app context the request thread had
+        with app.app_context():
+            return func(*args)
+
+    try:
+        job = get_job_queue().submit(run, key=key)
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '5'}
+    return jsonify(job.to_dict()), 202, {'Location': url_for('job_status', job_id=job.id)}
+
+
+def register_job_routes(app):
+    """Add the /jobs status, events and download routes to an app"""
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        job = get_job_queue().get(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job.to_dict()), 200
+
+    @app.route('/jobs/<job_id>/events', methods=['GET'])
+    def job_events(job_id):
+        job_queue = get_job_queue()
+        job = job_queue.get(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+
+        def events():
+            status = None
+            while True:
+                current = job_queue.wait_for_change(job, status, JOB_EVENT_KEEPALIVE)
+                if current == status:
+                    yield ": keep-alive\n\n"
+                    continue
+                status = current
+                yield f"event: {status}\ndata: {json.dumps(job.to_dict())}\n\n"
+                if status in (DONE, FAILED):
+                    return
+
+        return Response(
+            stream_with_context(events()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    @app.route('/jobs/<job_id>/download', methods=['GET'])
+    def job_download(job_id):
+        job = get_job_queue().get(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        if job.status == FAILED:
+            return jsonify(job.error), job.error_status
+        if job.status != DONE:
+            return jsonify(job.to_dict()), 202
+        return send_file(
+            job.path,
+            download_name=job.download_name,
+            mimetype='application/pdf',
+            conditional=True
+        )
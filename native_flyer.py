@@ -0,0 +1,612 @@
+"""Draws the flyer straight to PDF with reportlab, without HTML or WebKit.
+
+The page mirrors templates/_flyer_page.html: the same column geometry, the
+fonts text_fit measures with (Helvetica's metrics are the ones its width
+tables hold) and the line breaks text_fit computes, so the text a section
+was fitted to is the text that gets drawn. The 794 x 1398 px flyer is scaled
+uniformly onto an A4 page.
+
+Anything the layout does not model (images or tables inside the HTML
+sections, characters outside the standard PDF fonts) raises
+NativeLayoutError, and the backend hands that flyer to its fallback.
+
+In overlay mode the chrome (panels, header, logo, footer) is drawn once per
+template version into a background page; each flyer only draws its own
+fields and is stamped onto that page.
+"""
+import os
+import time
+import logging
+import threading
+from io import BytesIO
+from functools import lru_cache
+
+from PyPDF2 import PdfMerger, PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject, NameObject, RectangleObject
+)
+
+from asset_cache import DEFAULT_IMAGE_CSS_WIDTH, localize_image
+from pdf_cache import TEMPLATE_VERSION
+from text_fit import (
+    BASE_FONT_SIZE, CONTAINER_HEIGHT, DESCRIPTION_FONT_SIZE, FOOTER_HEIGHT, HEADER_HEIGHT, HR_HEIGHT, LETTER_SPACING,
+    LINE_HEIGHT, MAIN_COLUMN_WIDTH, SIDEBAR_COLUMN_WIDTH, COVER_HEIGHT, layout_lines, text_width, wrap_text
+)
+
+try:
+    from reportlab import rl_config
+    from reportlab.lib.colors import HexColor, white, black
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    rl_config.useA85 = 0  # Binary image streams: ASCII85 is pure Python here and a quarter larger
+except ImportError:  # reportlab not installed: every flyer goes to the fallback backend
+    canvas = None
+
+logger = logging.getLogger(__name__)
+
+FLYER_OVERLAY = os.getenv('FLYER_OVERLAY', '1') != '0'  # Stamp each flyer's fields onto one cached background page
+LOGO_RETRY_TTL = int(os.getenv('LOGO_RETRY_TTL', '300'))  # Seconds flyers go without the logo before it is fetched again
+BACKGROUND_XOBJECT = '/FlyerBackground'
+
+# Flyer geometry in CSS px, from templates/_flyer_styles.html
+FLYER_WIDTH = 794  # .flyer_container, full page width
+FLYER_HEIGHT = CONTAINER_HEIGHT + 22  # 370mm including the 10px padding and 1px border
+PADDING = 11  # .flyer_container padding plus border
+SIDEBAR_WIDTH = 270.2  # .sidebar: 35% of 772px
+MAIN_WIDTH = 501.8  # .flyer_content: 65% of 772px
+CONTENT_BOTTOM = PADDING + CONTAINER_HEIGHT
+COVER_MAX_HEIGHT = COVER_HEIGHT - 30  # Taller covers are scaled down so the fitted contents still fit
+ASCENT, DESCENT = 0.905, 0.212  # Line box metrics of the browser's sans-serif, as a fraction of the font size
+
+LOGO_URL = "https://cdn.shopify.com/s/files/1/0666/3471/1191/files/Atlantic_LOgo.png"
+WEBSITE = "www.atlanticbooks.com"
+BRAND_COLOR = '#1c69a1'  # .bg-dark, .heading, .title
+AUTHOR_COLOR = '#c01a2c'  # .author
+SIDEBAR_COLOR = '#f0f7f8'  # .sidebar
+BORDER_COLOR = '#cccccc'  # .flyer_container border
+RULE_COLOR = '#9a9a9a'  # hr
+
+FONTS = {  # (bold, italic) -> standard PDF font
+    (False, False): 'Helvetica',
+    (True, False): 'Helvetica-Bold',
+    (False, True): 'Helvetica-Oblique',
+    (True, True): 'Helvetica-BoldOblique',
+}
+UNSUPPORTED_MARKUP = ('<img', '<table', '<svg', '<iframe', '<video')
+SECTIONS = ('book_desc', 'about_author', 'toc')
+
+# Static footer text, as in templates/_flyer_page.html
+FOOTER_CAPTION = "Please send your orders to:"
+FOOTER_COMPANY = "Atlantic Publishers & Distributors (P) Ltd."
+FOOTER_OFFICE = ("Corporate Office: ", "7/22, Ansari Road, Darya Ganj, New Delhi-110002")
+FOOTER_CONTACTS = ("+91-11-4077 5247, 4077 5200", "orders@atlanticbooks.com")
+FOOTER_COLUMNS = [  # [(city, [agent lines, ...]), ...] per column
+    [("Delhi:", [
+        ("Nitin Sharma: +91 9717670228", "Email: nitin@atlanticbooks.com"),
+        ("Ram Nath Gaur: +91-11-40775220", "Email: orders@atlanticbooks.com"),
+        ("Pradeep Sharma: +91 9911727215", "Email: pradeep@atlanticbooks.com"),
+    ])],
+    [("Chennai:", [
+        ("S. Nagarajan: +91 9445627797", "Email: nagarajan@atlanticbooks.com"),
+        ("P.C. Mukandan: +91 4448531784", "Email: chennai@atlanticbooks.com"),
+    ])],
+    [("Kolkata:", [
+        ("Subrata Basak: +91 9874607483", "Email: kolkata@atlanticbooks.com"),
+    ]), ("Pune:", [
+        ("Chitra Gajanan Lele: +91 8421917315", "Email: chitra@atlanticbooks.com"),
+    ])],
+]
+
+
+class NativeLayoutError(Exception):
+    """The flyer uses something the native layout does not draw"""
+
+
+def _check_text(text):
+    try:
+        text.encode('cp1252')  # WinAnsiEncoding, all the standard fonts can show
+    except UnicodeEncodeError as e:
+        raise NativeLayoutError(f"character {text[e.start]!r} is outside the standard PDF fonts") from None
+    return text
+
+
+def _baseline(top, line_height, font_size):
+    """Baseline of text in a CSS line box starting at ``top``"""
+    return top + (line_height - (ASCENT + DESCENT) * font_size) / 2 + ASCENT * font_size
+
+
+@lru_cache(maxsize=256)
+def _image_size(path):
+    return ImageReader(path).getSize()
+
+
+def _image(url, css_width):
+    """(path, width, height) of a localized image, or None when it cannot be fetched"""
+    if not url:
+        return None
+    try:
+        path = localize_image(url, css_width)
+        if path is None:
+            return None
+        width, height = _image_size(str(path))
+    except Exception as e:
+        logger.warning(f"Flyer image {url} unavailable: {str(e)}")
+        return None
+    return str(path), width, height
+
+
+def _break_all(text, width, font_size):
+    """Lines of ``text`` broken anywhere, as `word-break: break-all` does"""
+    lines, line = [], ''
+    for char in text:
+        if line and text_width(line + char, font_size) > width:
+            lines.append(line)
+            line = char.lstrip()
+        else:
+            line += char
+    return lines + [line] if line else lines
+
+
+def _product_meta(context):
+    """The h4.product_meta line: volume and each variant's edition"""
+    parts = [str(context.get('volume') or '')]
+    for v in context.get('variants') or []:
+        edition = str(v.get('edition') or '')
+        if 'Edition' in edition:
+            parts.append(f"| {edition}")
+        elif edition:
+            parts.append(f"| {edition} Edition")
+    return ' '.join(part for part in parts if part)
+
+
+class FlyerLayout:
+    """Everything one flyer draws, laid out and validated before any drawing.
+
+    Building it raises NativeLayoutError, so a flyer that cannot be drawn
+    never leaves a half-drawn page on a shared canvas.
+    """
+
+    def __init__(self, context):
+        for key in SECTIONS:
+            value = context.get(key) or ''
+            if isinstance(value, str) and any(tag in value.lower() for tag in UNSUPPORTED_MARKUP):
+                raise NativeLayoutError(f"{key} contains markup the native layout does not draw")
+
+        self.title = _check_text(' '.join(str(context.get('product_title') or '').split()).upper())
+        self.product_meta = ''
+        if context.get('volume') or context.get('edition'):
+            self.product_meta = _check_text(_product_meta(context))
+        self.author = _check_text(f"BY {' '.join(str(context.get('author') or '').split()).upper()}")
+        self.meta = [_check_text(str(context.get('product_category') or '').upper())]
+        lines = [f"{context.get('publisher') or ''} | {context.get('publishing_date') or ''} | "
+                 f"{context.get('pages') or ''}pp"]
+        lines += [
+            f"{v.get('isbn') or ''} | {v.get('title') or ''} | {v.get('currency') or ''} {v.get('price') or ''}"
+            for v in context.get('variants') or []
+        ]
+        self.meta += [_check_text(' '.join(line.split()).upper()) for line in lines]
+
+        self.book = self._lines(context.get('book_desc'), MAIN_COLUMN_WIDTH, DESCRIPTION_FONT_SIZE)
+        self.about_author = self._lines(context.get('about_author'), MAIN_COLUMN_WIDTH, DESCRIPTION_FONT_SIZE)
+        self.toc = self._lines(context.get('toc'), SIDEBAR_COLUMN_WIDTH, BASE_FONT_SIZE)
+        self.cover = _image(context.get('product_image'), DEFAULT_IMAGE_CSS_WIDTH)
+
+    @staticmethod
+    def _lines(html_content, width, font_size):
+        if not html_content or not isinstance(html_content, str):
+            return ()
+        lines = layout_lines(html_content, width, font_size, CONTAINER_HEIGHT)
+        for line in lines:
+            for word, _, _ in line.words or ():
+                _check_text(word)
+        return lines
+
+
+class _Page:
+    """Draws in CSS px, y growing downwards, on a canvas scaled onto the page"""
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+
+    def begin(self):
+        page_width, page_height = A4
+        scale = min(page_width / FLYER_WIDTH, page_height / FLYER_HEIGHT)
+        self.pdf.saveState()
+        self.pdf.translate((page_width - FLYER_WIDTH * scale) / 2, (page_height - FLYER_HEIGHT * scale) / 2)
+        self.pdf.scale(scale, scale)
+
+    def end(self):
+        self.pdf.restoreState()
+        self.pdf.showPage()
+
+    def rect(self, x, y, width, height, fill=None, stroke=None):
+        if fill:
+            self.pdf.setFillColor(HexColor(fill))
+        if stroke:
+            self.pdf.setStrokeColor(HexColor(stroke))
+        self.pdf.rect(x, FLYER_HEIGHT - y - height, width, height, stroke=1 if stroke else 0, fill=1 if fill else 0)
+
+    def rule(self, x, y, width):
+        self.pdf.setStrokeColor(HexColor(RULE_COLOR))
+        self.pdf.setLineWidth(1)
+        self.pdf.line(x, FLYER_HEIGHT - y, x + width, FLYER_HEIGHT - y)
+
+    def image(self, path, x, y, width, height):
+        self.pdf.drawImage(path, x, FLYER_HEIGHT - y - height, width, height, mask='auto')
+
+    def text(self, runs, x, top, line_height, font_size, color, word_space=0):
+        """One line of (text, bold, italic) runs from ``x``"""
+        text = self.pdf.beginText()
+        text.setTextOrigin(x, FLYER_HEIGHT - _baseline(top, line_height, font_size))
+        text.setCharSpace(LETTER_SPACING)
+        text.setWordSpace(word_space)  # Text state outlives the text object, so it is always set
+        text.setFillColor(color if not isinstance(color, str) else HexColor(color))
+        for run, bold, italic in runs:
+            text.setFont(FONTS[bold, italic], font_size)
+            text.textOut(run)
+        self.pdf.drawText(text)
+
+    def plain(self, lines, x, top, width, font_size, color, bold=False, align='left', line_height=None):
+        """Plain text lines, left aligned or centered; returns the y below them"""
+        line_height = line_height or font_size * LINE_HEIGHT
+        for line in lines:
+            offset = (width - text_width(line, font_size, bold)) / 2 if align == 'center' else 0
+            self.text([(line, bold, False)], x + offset, top, line_height, font_size, color)
+            top += line_height
+        return top
+
+    def section(self, lines, x, top, width, bottom, justify):
+        """Lines laid out by text_fit, stopping at ``bottom``; returns the y below them"""
+        for line in lines:
+            if top + line.height > bottom:
+                break
+            if line.words is None:
+                self.rule(x, top + HR_HEIGHT / 2, width)
+                top += line.height
+                continue
+            size = line.font_size
+            left = x + line.indent
+            if line.marker:
+                marker_width = text_width(line.marker, size)
+                self.text([(line.marker, False, False)], left - marker_width - 6, top, line.height, size, black)
+            runs = []  # Consecutive words in the same font go out as one string
+            for word, bold, italic in line.words:
+                if runs and runs[-1][1:] == [bold, italic]:
+                    runs[-1][0] += ' ' + word
+                else:
+                    if runs:
+                        runs[-1][0] += ' '
+                    runs.append([word, bold, italic])
+            word_space = 0
+            gaps = len(line.words) - 1
+            if justify and not line.last and gaps:
+                space = text_width(' ', size)
+                used = sum(text_width(word, size, bold) for word, bold, _ in line.words) + space * gaps
+                word_space = max(0, (width - line.indent - used) / gaps)
+            self.text(runs, left, top, line.height, size, black, word_space)
+            top += line.height
+        return top
+
+
+class _MeasuringPage(_Page):
+    """A page that only advances positions, for measuring what a draw call takes"""
+
+    def rect(self, *args, **kwargs):
+        pass
+
+    def rule(self, *args):
+        pass
+
+    def image(self, *args):
+        pass
+
+    def text(self, *args, **kwargs):
+        pass
+
+
+def _draw_footer(page, top):
+    """The order addresses from ``top``; returns the y below them"""
+    x, width = PADDING + SIDEBAR_WIDTH + 10, MAIN_WIDTH - 20
+    top = page.plain([FOOTER_CAPTION], x, top + 10, width, 16, white, align='center')
+    top = page.plain([FOOTER_COMPANY], x, top + 5, width, 16, white, bold=True, align='center') + 5
+    label, address = FOOTER_OFFICE
+    label_width = text_width(label, 16, True)
+    address_lines = wrap_text(address, width - label_width, 16)
+    first = label_width + text_width(address_lines[0], 16)
+    page.text([(label, True, False), (address_lines[0], False, False)], x + (width - first) / 2, top, 24, 16, white)
+    top = page.plain(address_lines[1:], x, top + 24, width, 16, white, align='center')
+    contacts = '     '.join(FOOTER_CONTACTS)
+    top = page.plain([contacts], x, top + 5, width, 16, white, align='center') + 15
+
+    column_width = width / 3
+    bottom = top
+    for number, column in enumerate(FOOTER_COLUMNS):
+        padding = 5 if number == 1 else 0  # .middle_content
+        column_x, inner = x + number * column_width + padding, column_width - 2 * padding
+        column_top = top
+        for city, agents in column:
+            column_top = page.plain([city], column_x, column_top, inner, 12, white, bold=True)
+            for agent in agents:
+                lines = [part for line in agent for part in _break_all(line, inner, 10)]
+                column_top = page.plain(lines, column_x, column_top + 5, inner, 10, white) + 5
+        bottom = max(bottom, column_top)
+    return bottom + 10
+
+
+@lru_cache(maxsize=1)
+def footer_top():
+    """Where the footer starts: it sits at the bottom of the column at its natural height"""
+    return CONTENT_BOTTOM - max(FOOTER_HEIGHT, _draw_footer(_MeasuringPage(None), 0))
+
+
+_logo = {'image': None, 'failed_at': None}
+_logo_lock = threading.Lock()
+
+
+def logo_image():
+    """The localized logo, or None while a failed fetch is less than LOGO_RETRY_TTL seconds old"""
+    with _logo_lock:
+        if _logo['image']:
+            return _logo['image']
+        if _logo['failed_at'] is not None and time.monotonic() - _logo['failed_at'] < LOGO_RETRY_TTL:
+            return None
+    logo = _image(LOGO_URL, 200)
+    with _logo_lock:
+        _logo['image'] = logo
+        _logo['failed_at'] = None if logo else time.monotonic()
+    return logo
+
+
+def draw_background(page):
+    """The chrome every flyer shares: panels, header, footer.
+
+    Returns False when the logo could not be fetched, so a page missing it
+    is only kept as the background until the logo is tried again.
+    """
+    page.rect(0.5, 0.5, FLYER_WIDTH - 1, FLYER_HEIGHT - 1, stroke=BORDER_COLOR)
+    page.rect(PADDING, PADDING, SIDEBAR_WIDTH, CONTAINER_HEIGHT, fill=SIDEBAR_COLOR)
+
+    main_x = PADDING + SIDEBAR_WIDTH
+    page.rect(main_x, PADDING, MAIN_WIDTH, HEADER_HEIGHT, fill=BRAND_COLOR)
+    logo = logo_image()
+    if logo:
+        path, width, height = logo
+        logo_height = 200 * height / width
+        page.image(path, main_x + 20, PADDING + (HEADER_HEIGHT - logo_height) / 2, 200, logo_height)
+    website_width = text_width(WEBSITE, BASE_FONT_SIZE)
+    page.plain([WEBSITE], main_x + MAIN_WIDTH - 20 - website_width,
+               PADDING + (HEADER_HEIGHT - BASE_FONT_SIZE * LINE_HEIGHT) / 2, website_width, BASE_FONT_SIZE, white)
+
+    page.rect(main_x, footer_top(), MAIN_WIDTH, CONTENT_BOTTOM - footer_top(), fill=BRAND_COLOR)
+    _draw_footer(page, footer_top())
+    return logo is not None
+
+
+def draw_content(page, layout):
+    """The product's own fields: cover, details, contents, title and descriptions"""
+    top = PADDING
+    if layout.cover:
+        path, width, height = layout.cover
+        cover_width = SIDEBAR_WIDTH - 30
+        cover_height = cover_width * height / width
+        if cover_height > COVER_MAX_HEIGHT:
+            cover_width, cover_height = cover_width * COVER_MAX_HEIGHT / cover_height, COVER_MAX_HEIGHT
+        page.image(path, PADDING + (SIDEBAR_WIDTH - cover_width) / 2, top + 15, cover_width, cover_height)
+        top += cover_height + 30
+
+    x = PADDING + 8
+    meta_top = top
+    top += 15
+    meta_lines = [wrap_text(layout.meta[0], SIDEBAR_COLUMN_WIDTH, 15, True)]
+    meta_lines += [wrap_text(line, SIDEBAR_COLUMN_WIDTH, 13) for line in layout.meta[1:]]
+    meta_height = 30 + 5 * (len(meta_lines) - 1) + sum(
+        len(lines) * (15 if number == 0 else 13) * LINE_HEIGHT for number, lines in enumerate(meta_lines))
+    page.rect(PADDING, meta_top, SIDEBAR_WIDTH, meta_height, fill=BRAND_COLOR)
+    top = page.plain(meta_lines[0], x, top, SIDEBAR_COLUMN_WIDTH, 15, white, bold=True)
+    for lines in meta_lines[1:]:
+        top = page.plain(lines, x, top + 5, SIDEBAR_COLUMN_WIDTH, 13, white)
+    top = meta_top + meta_height + 10
+
+    if layout.toc:
+        heading_size = BASE_FONT_SIZE * 1.17
+        top = page.plain(["Content:"], x, top, SIDEBAR_COLUMN_WIDTH, heading_size, black, bold=True)
+        page.section(layout.toc, x, top, SIDEBAR_COLUMN_WIDTH, CONTENT_BOTTOM, justify=False)
+
+    x = PADDING + SIDEBAR_WIDTH + 20
+    top = PADDING + HEADER_HEIGHT + 30
+    top = page.plain(wrap_text(layout.title, MAIN_COLUMN_WIDTH, 20, True), x, top, MAIN_COLUMN_WIDTH, 20,
+                     BRAND_COLOR, bold=True, align='center') + 10
+    if layout.product_meta:
+        top = page.plain(wrap_text(layout.product_meta, MAIN_COLUMN_WIDTH, 16, True), x, top, MAIN_COLUMN_WIDTH, 16,
+                         black, bold=True, align='center')
+    top = page.plain(wrap_text(layout.author, MAIN_COLUMN_WIDTH, 16, True), x, top + 10, MAIN_COLUMN_WIDTH, 16,
+                     AUTHOR_COLOR, bold=True, align='center')
+
+    sections = [(heading, lines) for heading, lines in (("ABOUT THE BOOK", layout.book),
+                                                        ("ABOUT THE AUTHOR", layout.about_author)) if lines]
+    for heading, lines in sections:
+        page.rule(x, top + HR_HEIGHT / 2, MAIN_COLUMN_WIDTH)
+        top += HR_HEIGHT
+        top = page.plain([heading], x, top, MAIN_COLUMN_WIDTH, 18, BRAND_COLOR, bold=True) + 10
+        top = page.section(lines, x, top, MAIN_COLUMN_WIDTH, footer_top() - 30, justify=True)
+
+
+def draw_flyer(pdf, layout, background=True):
+    """Draw one laid-out flyer as the canvas's next page, without the chrome if ``background`` is False"""
+    page = _Page(pdf)
+    page.begin()
+    if background:
+        draw_background(page)
+    draw_content(page, layout)
+    page.end()
+
+
+_backgrounds = {}  # TEMPLATE_VERSION -> (the background page as a one-page PDF, monotonic expiry or None)
+_backgrounds_lock = threading.Lock()
+
+
+def background_pdf():
+    """The static chrome as a one-page PDF, drawn once per template version.
+
+    A page drawn without the logo is reused for LOGO_RETRY_TTL seconds, so
+    an unreachable CDN costs one fetch per interval rather than per flyer.
+    """
+    with _backgrounds_lock:
+        cached = _backgrounds.get(TEMPLATE_VERSION)
+    if cached and (cached[1] is None or time.monotonic() < cached[1]):
+        return cached[0]
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+    page = _Page(pdf)
+    page.begin()
+    complete = draw_background(page)
+    page.end()
+    pdf.save()
+    expires = None if complete else time.monotonic() + LOGO_RETRY_TTL
+    with _backgrounds_lock:
+        _backgrounds[TEMPLATE_VERSION] = (buffer.getvalue(), expires)
+    return buffer.getvalue()
+
+
+def stamp_background(overlay_pdf):
+    """Put the background under every page of ``overlay_pdf``.
+
+    The background becomes one form XObject that every page draws first, so
+    a document of many flyers carries the chrome once; IncrementalPdfWriter
+    then shares the identical form between merged chunks too.
+    """
+    writer = PdfWriter()
+    background = PdfReader(BytesIO(background_pdf())).pages[0]
+    contents = background.raw_get('/Contents').get_object()
+    form = EncodedStreamObject()
+    form._data = contents._data
+    form.update({key: value for key, value in dict.items(contents) if key in ('/Filter', '/DecodeParms')})
+    form.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Form'),
+        NameObject('/BBox'): RectangleObject(background.mediabox),
+        NameObject('/Resources'): background['/Resources'].clone(writer),
+    })
+    form_ref = writer._add_object(form)
+    stamp = DecodedStreamObject()
+    stamp.set_data(f"q {BACKGROUND_XOBJECT} Do Q\n".encode('ascii'))
+    stamp_ref = writer._add_object(stamp)
+
+    for page in PdfReader(BytesIO(overlay_pdf)).pages:
+        page = writer.add_page(page)
+        resources = page['/Resources']
+        if '/XObject' not in resources:
+            resources[NameObject('/XObject')] = DictionaryObject()
+        resources['/XObject'].get_object()[NameObject(BACKGROUND_XOBJECT)] = form_ref
+        page[NameObject('/Contents')] = ArrayObject([stamp_ref, page.raw_get('/Contents')])
+
+    stamped = BytesIO()
+    writer.write(stamped)
+    return stamped.getvalue()
+
+
+def render_layouts(layouts, overlay=None):
+    """PDF bytes with one page per FlyerLayout.
+
+    In overlay mode (FLYER_OVERLAY unless ``overlay`` says otherwise) only
+    the product's fields are drawn per page and the cached background is
+    stamped underneath.
+    """
+    overlay = FLYER_OVERLAY if overlay is None else overlay
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+    for layout in layouts:
+        draw_flyer(pdf, layout, background=not overlay)
+    pdf.save()
+    if overlay:
+        return stamp_background(buffer.getvalue())
+    return buffer.getvalue()
+
+
+class NativeFlyerBackend:
+    """Draws flyers with reportlab; flyers it cannot draw go to ``fallback``.
+
+    ``overlay`` overrides FLYER_OVERLAY for this backend.
+    """
+
+    name = 'native'
+
+    def __init__(self, fallback=None, overlay=None):
+        self.fallback = fallback
+        self.overlay = overlay
+
+    def _layout(self, context):
+        if canvas is None:
+            raise NativeLayoutError("reportlab is not installed")
+        return FlyerLayout(context)
+
+    def _fall_back(self, context, reason, stop=None):
+        if self.fallback is None:
+            return None, f"Native render failed: {reason}"
+        logger.info(f"Native render unsupported ({reason}), using the {self.fallback.name} backend")
+        return self.fallback.render(context, stop)
+
+    def render(self, context, stop=None):
+        """Render one prepared template context; returns (pdf_bytes, error).
+
+        ``stop`` (a run's stop Event) is handed to the fallback backend.
+        """
+        try:
+            layout = self._layout(context)
+        except NativeLayoutError as e:
+            return self._fall_back(context, str(e), stop)
+        try:
+            return render_layouts([layout], self.overlay), None
+        except Exception as e:
+            logger.error(f"Native render failed: {str(e)}")
+            return self._fall_back(context, str(e), stop)
+
+    def render_chunk(self, contexts, stop=None):
+        """Render (sku, context) pairs as one document; returns (pdf_bytes, rendered_skus, errors).
+
+        Consecutive flyers the native layout can draw share one canvas;
+        the others are rendered by the fallback and merged in between.
+        """
+        segments = []  # [('native', [(sku, layout), ...]) | ('fallback', (sku, context))]
+        for sku, context in contexts:
+            try:
+                layout = self._layout(context)
+            except NativeLayoutError as e:
+                logger.info(f"{sku}: native render unsupported ({str(e)})")
+                segments.append(('fallback', (sku, context)))
+                continue
+            if segments and segments[-1][0] == 'native':
+                segments[-1][1].append((sku, layout))
+            else:
+                segments.append(('native', [(sku, layout)]))
+
+        parts, rendered, errors = [], [], []
+        for kind, items in segments:
+            if kind == 'native':
+                try:
+                    parts.append(render_layouts([layout for _, layout in items], self.overlay))
+                    rendered += [sku for sku, _ in items]
+                except Exception as e:
+                    errors += [f"{sku}: Native render failed: {str(e)}" for sku, _ in items]
+                continue
+            sku, context = items
+            pdf_bytes, error = self._fall_back(context, 'unsupported layout', stop)
+            if pdf_bytes:
+                parts.append(pdf_bytes)
+                rendered.append(sku)
+            if error:
+                errors.append(f"{sku}: {error}")
+
+        if not parts:
+            return None, [], errors
+        if len(parts) == 1:
+            return parts[0], rendered, errors
+        merger = PdfMerger()
+        for part in parts:
+            merger.append(BytesIO(part))
+        merged = BytesIO()
+        merger.write(merged)
+        merger.close()
+        return merged.getvalue(), rendered, errors
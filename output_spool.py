@@ -0,0 +1,449 @@
+import os
+import time
+import hashlib
+import logging
+import weakref
+import zipfile
+import tempfile
+from io import BytesIO
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject
+)
+
+from pdf_optimize import PDF_IMAGE_MAX_DPI, downsample_image, image_display_widths
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DIR = os.getenv('FLYER_SPOOL_DIR') or None  # None means the system temp directory
+SESSION_RESULTS_MB = int(os.getenv('SESSION_RESULTS_MB', '256'))  # Flyers a UI session keeps to repackage them
+DOWNLOAD_MAX_MB = int(os.getenv('DOWNLOAD_MAX_MB', '1024'))  # Largest download the UI offers; a click reads it into memory
+PARTIAL_ZIP_FLYERS = int(os.getenv('PARTIAL_ZIP_FLYERS', '50'))  # Entries per rolling partial ZIP; 0 turns them off
+PARTIAL_ZIP_SECONDS = float(os.getenv('PARTIAL_ZIP_SECONDS', '10'))  # A partial ZIP is also cut once this old
+
+PDF_HEADER = b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n"
+_PAGES_NUM = 1  # Object numbers reserved for the page tree and catalog, written last
+_CATALOG_NUM = 2
+UNSHARED_TYPES = ('/Page', '/Pages', '/Annot', '/Catalog')  # Objects that must stay distinct per page
+
+
+def _serialize(obj):
+    body = BytesIO()
+    obj.write_to_stream(body, None)
+    return body.getvalue()
+
+
+class IncrementalPdfWriter:
+    """Append the pages of whole PDFs to an output stream one document at a time.
+
+    Unlike PdfMerger, which holds every source until ``write``, each
+    appended document is copied out and released immediately; only the
+    xref offsets, page references and object digests stay in memory.
+
+    Objects are written depth-first and keyed by a hash of their
+    serialized bytes, so a logo, font or ICC profile repeated in every
+    appended document is written once and shared by reference.
+    """
+
+    def __init__(self, stream, max_image_dpi=PDF_IMAGE_MAX_DPI):
+        self.stream = stream
+        self.max_image_dpi = max_image_dpi
+        self.offsets = [None, None, None]  # Index = object number; 1 and 2 are reserved
+        self.page_refs = []
+        self.digests = {}  # sha256 of a serialized object -> output object number
+        self.stats = {
+            'objects_written': 0,
+            'objects_shared': 0,
+            'bytes_shared': 0,
+            'images_resampled': 0,
+            'image_bytes_saved': 0,
+        }
+        self.stream.write(PDF_HEADER)
+
+    def _allocate(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def _write_object(self, number, obj, body=None):
+        if body is None:
+            body = _serialize(obj)
+        self.offsets[number] = self.stream.tell()
+        self.stream.write(f"{number} 0 obj\n".encode('ascii'))
+        self.stream.write(body)
+        self.stream.write(b"\nendobj\n")
+        self.stats['objects_written'] += 1
+
+    def _write_shared(self, obj):
+        """Write an object unless an identical one is already in the file; returns its number"""
+        body = _serialize(obj)
+        shareable = not (isinstance(obj, DictionaryObject) and obj.get('/Type') in UNSHARED_TYPES)
+        digest = hashlib.sha256(body).digest() if shareable else None
+        if digest in self.digests:
+            self.stats['objects_shared'] += 1
+            self.stats['bytes_shared'] += len(body)
+            return self.digests[digest]
+        number = self._allocate()
+        self._write_object(number, obj, body)
+        if digest:
+            self.digests[digest] = number
+        return number
+
+    def append(self, source):
+        """Copy every page of a PDF (bytes or path) to the output"""
+        reader = PdfReader(BytesIO(source) if isinstance(source, bytes) else source)
+        mapping = {}  # (source idnum, generation) -> output object number
+        in_progress = set()
+        image_widths = {}
+
+        def ref(indirect):
+            key = (indirect.idnum, indirect.generation)
+            if key in mapping:
+                return IndirectObject(mapping[key], 0, None)
+            if key in in_progress:
+                # Reference cycle: the object gets its number now and is not shared
+                mapping[key] = self._allocate()
+                return IndirectObject(mapping[key], 0, None)
+
+            in_progress.add(key)
+            obj = indirect.get_object()
+            clone = copy(obj)
+            in_progress.discard(key)
+
+            if key in image_widths and self.max_image_dpi:
+                resampled = downsample_image(clone, image_widths[key], self.max_image_dpi)
+                if resampled is not None:
+                    self.stats['images_resampled'] += 1
+                    self.stats['image_bytes_saved'] += len(clone._data) - len(resampled._data)
+                    clone = resampled
+
+            if key in mapping:
+                self._write_object(mapping[key], clone)
+            else:
+                mapping[key] = self._write_shared(clone)
+            return IndirectObject(mapping[key], 0, None)
+
+        def copy(obj):
+            if isinstance(obj, IndirectObject):
+                return ref(obj)
+            if isinstance(obj, StreamObject):
+                clone = obj.__class__()
+                clone._data = obj._data
+                clone.update({key: copy(value) for key, value in dict.items(obj)})
+                return clone
+            if isinstance(obj, DictionaryObject):
+                clone = DictionaryObject()
+                clone.update({key: copy(value) for key, value in dict.items(obj)
+                              if not (key == '/Parent' and obj.get('/Type') == '/Page')})
+                return clone
+            if isinstance(obj, ArrayObject):
+                return ArrayObject(copy(value) for value in list.__iter__(obj))
+            return obj
+
+        # Links may point at later pages, so every page gets its number up front;
+        # references to the source page tree resolve to the output page tree
+        root_pages = dict.__getitem__(reader.trailer['/Root'], '/Pages')
+        mapping[(root_pages.idnum, root_pages.generation)] = _PAGES_NUM
+        page_numbers = []
+        for page in reader.pages:
+            page_ref = page.indirect_reference
+            number = self._allocate()
+            mapping[(page_ref.idnum, page_ref.generation)] = number
+            page_numbers.append(number)
+            if self.max_image_dpi:
+                for key, width in image_display_widths(page, reader).items():
+                    image_widths[key] = max(image_widths.get(key, 0.0), width)
+
+        for number, page in zip(page_numbers, reader.pages):
+            # Pages from the reader carry inherited resources and boxes already
+            page_copy = copy(page)
+            page_copy[NameObject('/Parent')] = IndirectObject(_PAGES_NUM, 0, None)
+            self._write_object(number, page_copy)
+            self.page_refs.append(number)
+
+        return len(page_numbers)
+
+    def close(self):
+        """Write the page tree, catalog, xref table and trailer"""
+        kids = ArrayObject(IndirectObject(number, 0, None) for number in self.page_refs)
+        pages = DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): kids,
+            NameObject('/Count'): NumberObject(len(self.page_refs)),
+        })
+        catalog = DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(_PAGES_NUM, 0, None),
+        })
+        self._write_object(_PAGES_NUM, pages)
+        self._write_object(_CATALOG_NUM, catalog)
+
+        xref_offset = self.stream.tell()
+        self.stream.write(f"xref\n0 {len(self.offsets)}\n".encode('ascii'))
+        self.stream.write(b"0000000000 65535 f \n")
+        for offset in self.offsets[1:]:
+            self.stream.write(f"{offset:010d} 00000 n \n".encode('ascii'))
+        self.stream.write(
+            f"trailer\n<< /Size {len(self.offsets)} /Root {_CATALOG_NUM} 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n".encode('ascii')
+        )
+
+
+def _spool_file(prefix, suffix, spool_dir=SPOOL_DIR):
+    return tempfile.NamedTemporaryFile(prefix=prefix, suffix=suffix, dir=spool_dir, delete=False)
+
+
+class MergedPdfSpool:
+    """Merged PDF written to a temp file as parts finish.
+
+    Parts are numbered by input position. The next expected part is
+    appended straight away; parts finishing early wait on disk, not in
+    memory, until their turn.
+    """
+
+    def __init__(self, spool_dir=SPOOL_DIR):
+        self.spool_dir = spool_dir
+        self.file = _spool_file('merged_flyers_', '.pdf', spool_dir)
+        self.path = self.file.name
+        self.writer = IncrementalPdfWriter(self.file)
+        self.next_index = 0
+        self.waiting = {}  # index -> spooled part path, or None for a part that failed
+        self.page_count = 0
+        self.input_bytes = 0  # Size of the rendered parts before merging
+
+    def _append(self, source):
+        try:
+            self.page_count += self.writer.append(source)
+        except Exception as e:
+            logger.error(f"Could not append part to merged PDF: {str(e)}")
+
+    def _append_waiting(self, index):
+        path = self.waiting.pop(index)
+        if path:
+            self._append(path)
+            os.remove(path)
+
+    def add(self, index, pdf_bytes):
+        """Add part ``index``; pass None for a part that produced no PDF"""
+        self.input_bytes += len(pdf_bytes or b'')
+        if index != self.next_index:
+            path = None
+            if pdf_bytes:
+                with _spool_file('part_', '.pdf', self.spool_dir) as part:
+                    part.write(pdf_bytes)
+                    path = part.name
+            self.waiting[index] = path
+            return
+
+        if pdf_bytes:
+            self._append(pdf_bytes)
+        self.next_index += 1
+        while self.next_index in self.waiting:
+            self._append_waiting(self.next_index)
+            self.next_index += 1
+
+    def close(self):
+        """Finish the file, appending parts left behind a gap; returns its path"""
+        for index in sorted(self.waiting):
+            self._append_waiting(index)
+        self.writer.close()
+        self.file.close()
+        logger.info(f"Merged PDF size report: {self.report()}")
+        return self.path
+
+    def report(self):
+        """Bytes before and after merging, with what the optimizations saved"""
+        return dict(
+            self.writer.stats,
+            pages=self.page_count,
+            input_bytes=self.input_bytes,
+            output_bytes=os.path.getsize(self.path),
+        )
+
+
+def flyer_entry_name(sku):
+    """Name of a SKU's flyer inside the ZIP download"""
+    return f"flyer_{sku}.pdf"
+
+
+class ZipSpool:
+    """ZIP archive streamed to a temp file. Entries are stored, since PDFs are already compressed"""
+
+    def __init__(self, spool_dir=SPOOL_DIR):
+        self.file = _spool_file('flyers_', '.zip', spool_dir)
+        self.path = self.file.name
+        self.zip_file = zipfile.ZipFile(self.file, 'w', compression=zipfile.ZIP_STORED, allowZip64=True)
+        self.count = 0
+
+    def add(self, name, data):
+        self.zip_file.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+        self.count += 1
+
+    def close(self):
+        """Write the central directory; returns the archive path"""
+        self.zip_file.close()
+        self.file.close()
+        return self.path
+
+
+class RollingZipSpool:
+    """Finished flyers cut into a series of ZIP parts, so a run's output can be downloaded before it ends.
+
+    A part is finished once it holds ``max_entries`` entries or its first
+    entry is ``max_seconds`` old, whichever comes first.
+    """
+
+    def __init__(self, max_entries=PARTIAL_ZIP_FLYERS, max_seconds=PARTIAL_ZIP_SECONDS, spool_dir=SPOOL_DIR):
+        self.max_entries = max_entries
+        self.max_seconds = max_seconds
+        self.spool_dir = spool_dir
+        self.part = None
+        self.started = None
+        self.parts = 0
+
+    def add(self, name, data):
+        """Add an entry; returns (part number, ZIP bytes, entry count) when it finishes a part"""
+        if self.part is None:
+            self.part = ZipSpool(self.spool_dir)
+            self.started = time.monotonic()
+        self.part.add(name, data)
+        if self.part.count >= self.max_entries or time.monotonic() - self.started >= self.max_seconds:
+            return self.close()
+        return None
+
+    def close(self):
+        """Finish the current part; returns it as ``add`` does, or None when there is none"""
+        if self.part is None:
+            return None
+        part, self.part = self.part, None
+        path = part.close()
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        finally:
+            discard(path)
+        self.parts += 1
+        return self.parts, data, part.count
+
+    def discard(self):
+        """Drop the current part unread"""
+        if self.part is not None:
+            discard(self.part.close())
+            self.part = None
+
+
+def discard(path):
+    """Remove a spool file, ignoring one that is already gone"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class FlyerResults:
+    """The flyers of one bulk run, kept so they can be packaged again without regenerating.
+
+    Streamlit reruns the whole script on every widget change, so the UI keeps
+    this in its session state. It holds the flyer PDFs by SKU (individual
+    runs) or the merged chunks with their SKUs (merged runs), within
+    ``limit_mb``, plus one packaged download per format as a spool file
+    that is removed along with the results. Flyers past the limit are
+    dropped and ``complete`` turns False: what was already packaged can
+    still be downloaded, but the other format needs a new run.
+    """
+
+    def __init__(self, key, skus, limit_mb=SESSION_RESULTS_MB):
+        self.key = key
+        self.skus = skus
+        self.limit = limit_mb * 1024 * 1024
+        self.size = 0
+        self.flyers = {}  # sku -> PDF bytes; the SKUs of one flyer group share the object
+        self.chunks = {}  # chunk index -> (rendered skus, PDF bytes)
+        self.downloads = {}  # merged -> (packaged spool file path, merge size report or None)
+        self.generated = 0
+        self.processed = 0
+        self.failed = []
+        self.fetch_errors = []
+        self.complete = True
+        self.cancelled = False
+
+    def _keep(self, size):
+        if self.complete and self.size + size > self.limit:
+            logger.info(f"Bulk run flyers exceed {self.limit // (1024 * 1024)} MB, not keeping them to repackage")
+            self.complete = False
+            self.flyers.clear()
+            self.chunks.clear()
+            self.size = 0
+        if self.complete:
+            self.size += size
+        return self.complete
+
+    def add_flyer(self, skus, pdf_bytes):
+        """Record the flyer rendered for ``skus``"""
+        self.generated += len(skus)
+        if self._keep(len(pdf_bytes)):
+            for sku in skus:
+                self.flyers[sku] = pdf_bytes
+
+    def add_chunk(self, index, skus, pdf_bytes):
+        """Record merged chunk ``index``, holding the flyers of ``skus`` in order"""
+        self.generated += len(skus)
+        if pdf_bytes and self._keep(len(pdf_bytes)):
+            self.chunks[index] = (skus, pdf_bytes)
+
+    def keep_download(self, merged, path, report=None):
+        """Keep a packaged spool file, deleting it with these results; returns (path, report)"""
+        if merged in self.downloads:
+            discard(path)
+            return self.downloads[merged]
+        self.downloads[merged] = (path, report)
+        weakref.finalize(self, discard, path)
+        return path, report
+
+    def _flyer_pdfs(self):
+        """(sku, PDF bytes) of every kept flyer in input order; merged chunks are split by page"""
+        for sku in self.skus:
+            if sku in self.flyers:
+                yield sku, self.flyers[sku]
+        for index in sorted(self.chunks):
+            skus, pdf_bytes = self.chunks[index]
+            reader = PdfReader(BytesIO(pdf_bytes))
+            pages_per_flyer = len(reader.pages) // len(skus)
+            if pages_per_flyer * len(skus) != len(reader.pages):
+                raise ValueError(f"chunk {index} has {len(reader.pages)} pages for {len(skus)} flyers")
+            for i, sku in enumerate(skus):
+                writer = PdfWriter()
+                for page in reader.pages[i * pages_per_flyer:(i + 1) * pages_per_flyer]:
+                    writer.add_page(page)
+                flyer = BytesIO()
+                writer.write(flyer)
+                yield sku, flyer.getvalue()
+
+    def package(self, merged):
+        """The kept flyers as a merged PDF or ZIP: (spool file path, merge size report or None).
+
+        Returns None when the flyers were not all kept.
+        """
+        if merged in self.downloads:
+            return self.downloads[merged]
+        if not self.complete:
+            return None
+
+        spool = MergedPdfSpool() if merged else ZipSpool()
+        try:
+            if merged and self.chunks:
+                for i, index in enumerate(sorted(self.chunks)):
+                    spool.add(i, self.chunks[index][1])
+            elif merged:
+                for i, sku in enumerate(sku for sku in self.skus if sku in self.flyers):
+                    spool.add(i, self.flyers[sku])
+            else:
+                for sku, pdf_bytes in self._flyer_pdfs():
+                    spool.add(flyer_entry_name(sku), pdf_bytes)
+        except ValueError as e:
+            logger.warning(f"Cannot repackage the kept flyers: {str(e)}")
+            discard(spool.close())
+            return None
+
+        path = spool.close()
+        return self.keep_download(merged, path, spool.report() if merged else None)
@@ -0,0 +1,175 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+TEMPLATES_DIR = Path(__file__).resolve().parent / 'templates'
+PDF_CACHE_DIR = Path(os.getenv('PDF_CACHE_DIR', '.flyer_cache/pdf'))
+PDF_CACHE_MEMORY_MB = int(os.getenv('PDF_CACHE_MEMORY_MB', '128'))  # In-memory LRU tier
+PDF_CACHE_DISK_MB = int(os.getenv('PDF_CACHE_DISK_MB', '2048'))  # On-disk tier, 0 disables it
+
+
+def template_version():
+    """Hash of every template file, so editing the flyer layout invalidates cached PDFs"""
+    digest = hashlib.sha256()
+    if TEMPLATES_DIR.is_dir():
+        for path in sorted(TEMPLATES_DIR.rglob('*')):
+            if path.is_file():
+                digest.update(path.relative_to(TEMPLATES_DIR).as_posix().encode('utf-8'))
+                digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+TEMPLATE_VERSION = template_version()
+
+
+def cache_key(html_content, options=None):
+    """Content address of a render: rendered HTML, pdfkit options and template version"""
+    digest = hashlib.sha256()
+    digest.update(TEMPLATE_VERSION.encode('utf-8'))
+    digest.update(json.dumps(options or {}, sort_keys=True, default=str).encode('utf-8'))
+    digest.update(html_content.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class PdfCache:
+    """Two-tier PDF cache: a byte-bounded in-memory LRU in front of a size-bounded directory"""
+
+    def __init__(self, directory=PDF_CACHE_DIR, memory_mb=PDF_CACHE_MEMORY_MB, disk_mb=PDF_CACHE_DISK_MB):
+        self.directory = Path(directory)
+        self.memory_limit = memory_mb * 1024 * 1024
+        self.disk_limit = disk_mb * 1024 * 1024
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return self.directory / key[:2] / f'{key}.pdf'
+
+    def _remember(self, key, pdf_bytes):
+        """Insert into the memory tier and evict least recently used entries (lock held)"""
+        if len(pdf_bytes) > self.memory_limit:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = pdf_bytes
+        self._memory_bytes += len(pdf_bytes)
+        while self._memory_bytes > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def get(self, key):
+        """Return cached PDF bytes for a key, or None"""
+        with self._lock:
+            pdf_bytes = self._memory.get(key)
+            if pdf_bytes is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return pdf_bytes
+
+        if self.disk_limit:
+            path = self._path(key)
+            try:
+                pdf_bytes = path.read_bytes()
+                os.utime(path)  # mtime doubles as the disk tier's LRU clock
+            except OSError:
+                pdf_bytes = None
+            if pdf_bytes:
+                with self._lock:
+                    self._remember(key, pdf_bytes)
+                    self.disk_hits += 1
+                return pdf_bytes
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, pdf_bytes):
+        """Store PDF bytes in both tiers"""
+        if not pdf_bytes:
+            return
+        with self._lock:
+            self._remember(key, pdf_bytes)
+
+        if not self.disk_limit:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write atomically so other processes never read a partial PDF
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"PDF cache write failed: {str(e)}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_usage()
+            else:
+                self._disk_bytes += len(pdf_bytes)
+            if self._disk_bytes > self.disk_limit:
+                self._evict_disk()
+
+    def _scan_disk_usage(self):
+        return sum(path.stat().st_size for path in self.directory.rglob('*.pdf'))
+
+    def _evict_disk(self):
+        """Delete least recently used files until the disk tier is 90% full (lock held)"""
+        entries = []
+        for path in self.directory.rglob('*.pdf'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        self._disk_bytes = sum(size for _, size, _ in entries)
+        target = self.disk_limit * 0.9
+        for _, size, path in entries:
+            if self._disk_bytes <= target:
+                break
+            try:
+                path.unlink()
+                self._disk_bytes -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+            }
+
+
+_pdf_cache = None
+_pdf_cache_lock = threading.Lock()
+
+
+def get_pdf_cache():
+    """Return the process-wide PDF cache"""
+    global _pdf_cache
+    with _pdf_cache_lock:
+        if _pdf_cache is None:
+            _pdf_cache = PdfCache()
+        return _pdf_cache
@@ -0,0 +1,138 @@
+"""Size optimizations applied while flyer PDFs are merged.
+
+Identical objects are shared by IncrementalPdfWriter; this module finds
+how large each image is drawn on its page and resamples images that
+carry more pixels than the print resolution can use.
+"""
+import os
+import math
+import logging
+from io import BytesIO
+
+from PIL import Image
+from PyPDF2.generic import ContentStream, EncodedStreamObject, IndirectObject, NameObject, NumberObject
+
+logger = logging.getLogger(__name__)
+
+PDF_IMAGE_MAX_DPI = int(os.getenv('PDF_IMAGE_MAX_DPI', '0'))  # Resample images drawn above this DPI; 0 disables
+PDF_IMAGE_JPEG_QUALITY = int(os.getenv('PDF_IMAGE_JPEG_QUALITY', '85'))
+RESAMPLE_TOLERANCE = 1.25  # Only resample images at least this far above the target resolution
+
+_IDENTITY = [1.0, 0.0, 0.0, 1.0, 0.0, 0.0]
+
+
+def _multiply(m, n):
+    """Compose two PDF transformation matrices (m applied first)"""
+    return [
+        m[0] * n[0] + m[1] * n[2],
+        m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2],
+        m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4],
+        m[4] * n[1] + m[5] * n[3] + n[5],
+    ]
+
+
+def image_display_widths(page, reader):
+    """Map each image XObject drawn on a page, by source reference, to its widest displayed width in points"""
+    resources = page['/Resources'] if '/Resources' in page else {}
+    xobjects = resources['/XObject'] if '/XObject' in resources else {}
+    refs = {name: ref for name, ref in dict.items(xobjects) if isinstance(ref, IndirectObject)}
+    contents = page.get_contents()
+    if not refs or contents is None:
+        return {}
+
+    widths = {}
+    ctm, stack = _IDENTITY, []
+    for operands, operator in ContentStream(contents, reader).operations:
+        if operator == b'q':
+            stack.append(ctm)
+        elif operator == b'Q':
+            ctm = stack.pop() if stack else _IDENTITY
+        elif operator == b'cm' and len(operands) == 6:
+            ctm = _multiply([float(value) for value in operands], ctm)
+        elif operator == b'Do' and operands and operands[0] in refs:
+            ref = refs[operands[0]]
+            key = (ref.idnum, ref.generation)
+            # An image fills the unit square, so the CTM's x axis is its drawn width
+            widths[key] = max(widths.get(key, 0.0), math.hypot(ctm[0], ctm[1]))
+    return widths
+
+
+def _filters(stream):
+    filters = stream.get('/Filter')
+    if filters is None:
+        return []
+    return [filters] if isinstance(filters, str) else list(filters)
+
+
+def _color_components(stream):
+    """Components per pixel of a DeviceGray, DeviceRGB or ICCBased image; None for any other color space"""
+    color_space = stream.get('/ColorSpace')
+    color_space = color_space.get_object() if color_space is not None else None
+    if color_space == '/DeviceGray':
+        return 1
+    if color_space == '/DeviceRGB':
+        return 3
+    if isinstance(color_space, list) and len(color_space) == 2 and color_space[0] == '/ICCBased':
+        components = color_space[1].get_object().get('/N')
+        return components if components in (1, 3) else None
+    return None  # Indexed, CMYK, Separation, Lab... would be recoded with the wrong colors
+
+
+def downsample_image(stream, display_width, max_dpi=PDF_IMAGE_MAX_DPI, quality=PDF_IMAGE_JPEG_QUALITY):
+    """JPEG replacement for an image stream drawn above ``max_dpi``, or None to keep it as is"""
+    if not max_dpi or not display_width or stream.get('/Subtype') != '/Image':
+        return None
+    width, height = int(stream.get('/Width', 0)), int(stream.get('/Height', 0))
+    target_width = max(1, int(display_width / 72 * max_dpi))
+    if not width or not height or width <= target_width * RESAMPLE_TOLERANCE:
+        return None
+    if stream.get('/BitsPerComponent') != 8 or '/Decode' in stream or stream.get('/ImageMask'):
+        return None
+    components = _color_components(stream)
+    if components is None:
+        return None
+
+    try:
+        filters = _filters(stream)
+        if filters == ['/DCTDecode']:
+            image = Image.open(BytesIO(stream._data))
+        elif filters in ([], ['/FlateDecode']):
+            data = stream.get_data()
+            if len(data) != width * height * components:
+                return None
+            image = Image.frombytes('L' if components == 1 else 'RGB', (width, height), data)
+        else:
+            return None
+        if image.mode != ('L' if components == 1 else 'RGB'):
+            return None  # The JPEG does not match its declared color space
+
+        target_height = max(1, round(height * target_width / width))
+        image = image.resize((target_width, target_height), Image.LANCZOS)
+        output = BytesIO()
+        image.save(output, 'JPEG', quality=quality, optimize=True)
+    except Exception as e:
+        logger.warning(f"Could not resample PDF image: {str(e)}")
+        return None
+
+    if output.tell() >= len(stream._data):
+        return None
+
+    replacement = EncodedStreamObject()
+    replacement._data = output.getvalue()
+    replacement.update({key: value for key, value in dict.items(stream)
+                        if key not in ('/Filter', '/DecodeParms', '/Length')})
+    replacement[NameObject('/Filter')] = NameObject('/DCTDecode')
+    replacement[NameObject('/Width')] = NumberObject(target_width)
+    replacement[NameObject('/Height')] = NumberObject(target_height)
+    return replacement
+
+
+def format_size(num_bytes):
+    """Human-readable byte count for reports"""
+    for unit in ('B', 'KB', 'MB'):
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == 'B' else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
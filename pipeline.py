@@ -0,0 +1,167 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '64'))  # Items buffered between two stages
+
+_DONE = object()
+
+
+def is_stopped(stop):
+    """True when ``stop``, a pipeline's stop Event passed down to long calls, is set.
+
+    Renders, fetches and bulk operation polls made from stage functions
+    take the Event explicitly, so worker threads they spawn see it too,
+    and check it to give up early when a run is cancelled. None never stops.
+    """
+    return stop is not None and stop.is_set()
+
+
+class Stage:
+    """One step of a pipeline: ``func`` maps an item to an output, or to an
+    iterable of outputs when ``fan_out`` is set. Returning None drops the item.
+
+    ``flush`` is called once after the last input and may return further
+    outputs, for stages that buffer items (e.g. grouping into chunks).
+    """
+
+    def __init__(self, name, func, workers=1, fan_out=False, flush=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.fan_out = fan_out
+        self.flush = flush
+
+
+class StageError:
+    """Emitted in place of an output when a stage function raises"""
+
+    def __init__(self, stage, item, error):
+        self.stage = stage
+        self.item = item
+        self.error = error
+
+    def __repr__(self):
+        return f"StageError({self.stage}: {self.error})"
+
+
+class Pipeline:
+    """Runs stages concurrently, connected by bounded queues.
+
+    Each stage has its own worker threads, so the first items reach the
+    last stage while later ones are still being fetched, and the bounded
+    queues keep producers from racing ahead of slow consumers.
+    """
+
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE, stopped=None):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+        self.stopped = stopped or threading.Event()  # Stage functions that take the Event stop with the pipeline
+        self._threads = []
+
+    def _put(self, q, item):
+        """Put that gives up when the pipeline is stopped"""
+        while not self.stopped.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self, items):
+        try:
+            for item in items:
+                if not self._put(self.queues[0], item):
+                    return
+        except Exception as e:
+            logger.error(f"Pipeline input failed: {str(e)}")
+            self._put(self.queues[-1], StageError('input', None, e))
+        finally:
+            self._put(self.queues[0], _DONE)
+
+    def _run_stage(self, index, stage, remaining, lock):
+        inbox, outbox = self.queues[index], self.queues[index + 1]
+        while not self.stopped.is_set():
+            try:
+                item = inbox.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                inbox.put(_DONE)  # Let sibling workers see the end of the stream too
+                break
+            try:
+                result = stage.func(item)
+                outputs = (result or ()) if stage.fan_out else ((result,) if result is not None else ())
+                for output in outputs:
+                    if not self._put(outbox, output):
+                        return
+            except Exception as e:
+                logger.error(f"Pipeline stage {stage.name} failed: {str(e)}")
+                self._put(self.queues[-1], StageError(stage.name, item, e))
+
+        with lock:
+            remaining[0] -= 1
+            last_worker = remaining[0] == 0
+        if last_worker:
+            if stage.flush and not self.stopped.is_set():
+                try:
+                    for output in stage.flush() or ():
+                        self._put(outbox, output)
+                except Exception as e:
+                    logger.error(f"Pipeline stage {stage.name} flush failed: {str(e)}")
+                    self._put(self.queues[-1], StageError(stage.name, None, e))
+            self._put(outbox, _DONE)
+
+    def start(self, items):
+        feeder = threading.Thread(target=self._feed, args=(items,), daemon=True)
+        self._threads.append(feeder)
+        for index, stage in enumerate(self.stages):
+            remaining, lock = [stage.workers], threading.Lock()
+            for _ in range(stage.workers):
+                worker = threading.Thread(
+                    target=self._run_stage, args=(index, stage, remaining, lock),
+                    name=f"pipeline-{stage.name}", daemon=True
+                )
+                self._threads.append(worker)
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def threads(self):
+        return list(self._threads)
+
+    def results(self, heartbeat=None):
+        """Yield final-stage outputs (and StageErrors) as they complete.
+
+        With ``heartbeat`` (seconds), None is yielded whenever no output
+        arrives for that long, so the caller regains control while it waits.
+        """
+        outbox = self.queues[-1]
+        try:
+            while True:
+                try:
+                    item = outbox.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield None
+                    continue
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop all stages; items still queued are dropped"""
+        self.stopped.set()
+
+    def join(self, timeout=None):
+        """Wait for the stage threads to finish their in-flight items; returns whether they all did"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
@@ -0,0 +1,242 @@
+"""Pre-generate catalog flyers into a versioned directory the Flask services serve from.
+
+    python pregenerate.py --skus skus.txt
+    python pregenerate.py --all --workers 8
+    python pregenerate.py --incremental
+
+Each run writes PREGENERATED_DIR/<version>/ with one PDF per SKU and a
+manifest of SKU -> (updatedAt, input hash, ETag), then switches
+PREGENERATED_DIR/CURRENT to it. A flyer whose template inputs hash the same
+as in the current version is hard-linked forward instead of re-rendered, and
+the SKUs of one product, which share a flyer, are rendered once.
+
+--incremental only fetches products updated since the previous run's
+watermark and carries every other flyer forward, so a nightly cron run
+costs time proportional to the day's edits.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from pdf_cache import TEMPLATE_VERSION
+from renderer import get_renderer
+from shopify_bulk import fetch_products_bulk
+from static_flyers import CURRENT_FILE, MANIFEST_FILE, PREGENERATED_DIR, flyer_filename, flyer_input_hash
+from streamlitbulk import (
+    FLYER_BACKEND, GRAPHQL_URL, MAX_WORKERS, fetch_all_products, group_by_flyer, parse_skus,
+    prepare_template_context, render_flyer, shopify_headers, sku_context
+)
+
+logger = logging.getLogger(__name__)
+
+KEEP_VERSIONS = 2  # Version directories kept, including the new one
+
+
+def read_skus(path):
+    """SKUs from a text or CSV file, one per line or comma separated"""
+    with open(path, encoding='utf-8') as f:
+        return parse_skus(f.read())
+
+
+def write_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def prune_versions(root, keep):
+    """Remove the oldest version directories beyond ``keep``"""
+    versions = sorted(entry for entry in os.listdir(root) if os.path.isdir(os.path.join(root, entry)))
+    for version in versions[:-keep] if keep > 0 else []:
+        shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+        logger.info(f"Removed old flyer version {version}")
+
+
+def load_manifest(root):
+    """Manifest of the current version, or None before the first run"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding='utf-8') as f:
+            version = f.read().strip()
+        with open(os.path.join(root, version, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    manifest['version'] = version
+    return manifest
+
+
+def input_hash(context):
+    """Input hash of a flyer rendered here with FLYER_BACKEND; see flyer_input_hash"""
+    return flyer_input_hash(context, FLYER_BACKEND)
+
+
+def carry_forward(source, target):
+    """Hard-link (or copy) a previous flyer into the new version"""
+    try:
+        os.link(source, target)
+    except OSError:
+        try:
+            shutil.copyfile(source, target)
+        except OSError:
+            return False
+    return True
+
+
+def build_flyers(skus, products_data, previous_flyers, previous_dir, version_dir):
+    """Write one flyer group (see group_by_flyer) into the new version.
+
+    SKUs whose inputs match their previous render are carried forward; the
+    flyer is rendered once for the rest and written under each of their
+    filenames. Returns [(sku, manifest_entry, outcome, error)], where
+    outcome is a pregenerate stats key.
+    """
+    context, error = prepare_template_context(products_data[skus[0]])
+    if error:
+        return [(sku, None, None, error) for sku in skus]
+
+    results = []
+    stale = []
+    for sku in skus:
+        product_data = products_data[sku]
+        previous = previous_flyers.get(sku)
+        filename = flyer_filename(sku)
+        entry = {
+            'file': filename,
+            'title': product_data.title or '',
+            'updated_at': product_data.updated_at or '',
+            'input_hash': input_hash(sku_context(context, product_data)),
+        }
+        if (previous and previous_dir and previous.get('input_hash') == entry['input_hash']
+                and carry_forward(os.path.join(previous_dir, previous['file']), os.path.join(version_dir, filename))):
+            results.append((sku, dict(previous, **entry), 'unchanged', None))
+        else:
+            stale.append((sku, entry))
+    if not stale:
+        return results
+
+    pdf_bytes, error = render_flyer(context)
+    if error:
+        return results + [(sku, None, None, error) for sku, _ in stale]
+    etag = hashlib.sha256(pdf_bytes).hexdigest()[:32]
+    for i, (sku, entry) in enumerate(stale):
+        write_atomic(os.path.join(version_dir, entry['file']), pdf_bytes)
+        entry.update(etag=etag, generated_at=int(time.time()))
+        results.append((sku, entry, 'shared' if i else 'rendered', None))
+    return results
+
+
+def pregenerate(skus, root=PREGENERATED_DIR, workers=MAX_WORKERS, keep=KEEP_VERSIONS, incremental=False):
+    """Render SKUs into a new version directory and make it current.
+
+    ``skus=None`` walks the whole catalog through a bulk operation.
+    ``incremental`` fetches only products updated since the last run's
+    watermark and carries every other flyer of the current version forward.
+    Returns (version, stats, errors).
+    """
+    root = str(root)
+    previous = load_manifest(root)
+    previous_flyers = (previous or {}).get('flyers', {})
+    previous_dir = os.path.join(root, previous['version']) if previous else None
+    watermark = (previous or {}).get('watermark')
+
+    if incremental and not (previous and watermark and previous.get('template_version') == TEMPLATE_VERSION):
+        # Without a usable baseline (first run, or the templates changed) every flyer is stale
+        logger.info("No incremental baseline for the current templates, pre-generating the whole catalog")
+        incremental, skus = False, None
+
+    catalog_wide = incremental or skus is None
+    if incremental:
+        # >= rather than >: products edited in the watermark's second are re-checked, and
+        # unchanged inputs are carried forward anyway
+        search = f"updated_at:>='{watermark}'"
+        products_data, errors = fetch_products_bulk(None, GRAPHQL_URL, shopify_headers(), search=search)
+        if products_data is None:
+            return None, {}, errors
+        skus = sorted(products_data)
+    elif skus is None:
+        products_data, errors = fetch_products_bulk(None, GRAPHQL_URL, shopify_headers())
+        if products_data is None:
+            return None, {}, errors
+        skus = sorted(products_data)
+    else:
+        products_data, errors = fetch_all_products(skus)
+    logger.info(f"Fetched {len(products_data)} products to check")
+
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{TEMPLATE_VERSION[:8]}"
+    version_dir = os.path.join(root, version)
+    os.makedirs(version_dir, exist_ok=True)
+
+    stats = {'rendered': 0, 'shared': 0, 'unchanged': 0, 'carried': 0}
+    flyers = {}
+    if incremental:
+        for sku, entry in previous_flyers.items():
+            if sku not in products_data and carry_forward(
+                    os.path.join(previous_dir, entry['file']), os.path.join(version_dir, entry['file'])):
+                flyers[sku] = entry
+                stats['carried'] += 1
+
+    get_renderer()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # The SKUs of a product share one flyer, so each group is rendered once
+        futures = [
+            executor.submit(build_flyers, group, products_data, previous_flyers, previous_dir, version_dir)
+            for group in group_by_flyer(skus, products_data)
+        ]
+        for future in as_completed(futures):
+            for sku, entry, outcome, error in future.result():
+                if error:
+                    errors.append(f"{sku}: {error}")
+                    continue
+                flyers[sku] = entry
+                stats[outcome] += 1
+
+    if catalog_wide:
+        # A run over a SKU list does not cover the catalog, so it keeps the previous watermark
+        updated = [entry['updated_at'] for entry in flyers.values() if entry.get('updated_at')]
+        watermark = max(updated + ([watermark] if watermark else []), default=None)
+
+    write_atomic(
+        os.path.join(version_dir, MANIFEST_FILE),
+        json.dumps({
+            'version': version,
+            'template_version': TEMPLATE_VERSION,
+            'watermark': watermark,
+            'flyers': flyers,
+        }).encode('utf-8')
+    )
+    # Switching CURRENT is the commit point: servers reload the manifest when it changes
+    write_atomic(os.path.join(root, CURRENT_FILE), version.encode('utf-8'))
+    prune_versions(root, keep)
+    logger.info(f"Version {version}: {stats}")
+    return version, stats, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--skus', help='file of SKUs to pre-generate')
+    source.add_argument('--all', action='store_true', help='pre-generate every SKU in the catalog')
+    source.add_argument('--incremental', action='store_true',
+                        help='re-check only products updated since the last run, carrying the rest forward')
+    parser.add_argument('--out', default=str(PREGENERATED_DIR))
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    parser.add_argument('--keep', type=int, default=KEEP_VERSIONS, help='version directories to keep')
+    args = parser.parse_args()
+
+    skus = read_skus(args.skus) if args.skus else None
+    version, stats, errors = pregenerate(skus, args.out, args.workers, args.keep, args.incremental)
+    print(f"Version {version}: {stats.get('rendered', 0)} rendered, {stats.get('shared', 0)} sharing a render, "
+          f"{stats.get('unchanged', 0)} unchanged, "
+          f"{stats.get('carried', 0)} carried forward, {len(errors)} errors")
+    for error in errors:
+        print(f"  {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+from flyer_product import from_json, to_json
+
+logger = logging.getLogger(__name__)
+
+# Product cache configuration
+PRODUCT_CACHE_TTL = int(os.getenv('PRODUCT_CACHE_TTL', '3600'))  # Seconds a fetched record stays fresh
+PRODUCT_CACHE_DB = os.getenv('PRODUCT_CACHE_DB', '')  # SQLite file; empty keeps the cache in memory
+
+
+class MemoryProductCache:
+    """Per-process product records keyed by SKU, expiring after a TTL"""
+
+    def __init__(self, ttl=PRODUCT_CACHE_TTL):
+        self.ttl = ttl
+        self._records = {}  # sku -> (expires_at, product_id, record)
+        self._lock = threading.Lock()
+
+    def get_many(self, skus):
+        """Return ({sku: record} for fresh hits, [missing skus])"""
+        now = time.time()
+        found, missing = {}, []
+        with self._lock:
+            for sku in skus:
+                entry = self._records.get(sku)
+                if entry and entry[0] > now:
+                    found[sku] = entry[2]
+                else:
+                    self._records.pop(sku, None)
+                    missing.append(sku)
+        return found, missing
+
+    def put_many(self, records):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            for sku, record in records.items():
+                self._records[sku] = (expires_at, record.product_id, record)
+
+    def evict(self, skus=(), product_ids=()):
+        """Drop records by SKU or by parent product; returns the number evicted"""
+        skus, product_ids = set(skus), set(product_ids)
+        with self._lock:
+            doomed = [sku for sku, entry in self._records.items()
+                      if sku in skus or (entry[1] and entry[1] in product_ids)]
+            for sku in doomed:
+                del self._records[sku]
+        return len(doomed)
+
+
+class SqliteProductCache:
+    """Product records persisted in SQLite so they survive restarts and are shared between processes"""
+
+    def __init__(self, path=PRODUCT_CACHE_DB, ttl=PRODUCT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                " sku TEXT PRIMARY KEY,"
+                " product_id TEXT,"
+                " expires_at REAL NOT NULL,"
+                " record TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS products_product_id ON products (product_id)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_many(self, skus):
+        skus = list(skus)
+        found = {}
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            for start in range(0, len(skus), 500):
+                chunk = skus[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f"SELECT sku, record FROM products WHERE sku IN ({placeholders}) AND expires_at > ?",
+                    [*chunk, now],
+                )
+                for sku, record in rows:
+                    try:
+                        found[sku] = from_json(record)
+                    except ValueError:
+                        pass  # Written by an older version: refetched like a miss
+        return found, [sku for sku in skus if sku not in found]
+
+    def put_many(self, records):
+        expires_at = time.time() + self.ttl
+        rows = [(sku, record.product_id, expires_at, to_json(record))
+                for sku, record in records.items()]
+        with self._lock, self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?)", rows)
+            conn.execute("DELETE FROM products WHERE expires_at <= ?", (time.time(),))
+
+    def evict(self, skus=(), product_ids=()):
+        skus, product_ids = list(skus), list(product_ids)
+        evicted = 0
+        with self._lock, self._connect() as conn:
+            for column, values in (('sku', skus), ('product_id', product_ids)):
+                for start in range(0, len(values), 500):
+                    chunk = values[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    evicted += conn.execute(
+                        f"DELETE FROM products WHERE {column} IN ({placeholders})", chunk
+                    ).rowcount
+        return evicted
+
+
+_product_cache = None
+_product_cache_lock = threading.Lock()
+
+
+def get_product_cache():
+    """Return the process-wide product cache (SQLite when PRODUCT_CACHE_DB is set)"""
+    global _product_cache
+    with _product_cache_lock:
+        if _product_cache is None:
+            _product_cache = SqliteProductCache() if PRODUCT_CACHE_DB else MemoryProductCache()
+        return _product_cache
+
+
+def skus_from_webhook(payload):
+    """SKUs and product GID affected by a products/update webhook payload"""
+    skus = [variant.get('sku') for variant in payload.get('variants') or [] if variant.get('sku')]
+    product_id = payload.get('admin_graphql_api_id')
+    if not product_id and payload.get('id'):
+        product_id = f"gid://shopify/Product/{payload['id']}"
+    return skus, product_id
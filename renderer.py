@@ -0,0 +1,340 @@
+import os
+import atexit
+import logging
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pdfkit
+
+from asset_cache import has_remote_images, localize_html_images
+from pdf_cache import cache_key, get_pdf_cache
+from pipeline import is_stopped
+
+logger = logging.getLogger(__name__)
+
+# Renderer configuration
+WKHTMLTOPDF_PATH = os.getenv('WKHTMLTOPDF_PATH', r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe")
+RENDERER_POOL_SIZE = int(os.getenv('RENDERER_POOL_SIZE', '4'))  # 0 disables the pool (one process per flyer)
+RENDERER_MAX_JOBS = int(os.getenv('RENDERER_MAX_JOBS', '200'))  # Recycle a worker after this many renders
+RENDERER_MAX_MEMORY_MB = int(os.getenv('RENDERER_MAX_MEMORY_MB', '512'))  # Recycle a worker above this RSS
+RENDERER_TIMEOUT = int(os.getenv('RENDERER_TIMEOUT', '120'))  # Seconds to wait for a single render
+RENDERER_QUEUE_TIMEOUT = int(os.getenv('RENDERER_QUEUE_TIMEOUT', '300'))  # Seconds a render waits for a free worker
+
+WARMUP_HTML = "<html><body><p style=\"font-family: sans-serif;\">warmup</p></body></html>"
+
+
+class RenderError(Exception):
+    """Raised when a renderer worker fails to produce a PDF"""
+
+
+def _quote_arg(arg):
+    """Quote an argument for wkhtmltopdf's --read-args-from-stdin parser"""
+    arg = str(arg)
+    if arg and not any(c in arg for c in ' \t"\'\\'):
+        return arg
+    return '"' + arg.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def options_to_args(options):
+    """Convert a pdfkit-style options dict into wkhtmltopdf arguments"""
+    args = []
+    for key, value in (options or {}).items():
+        key = key if key.startswith('--') else f'--{key}'
+        # Workers report completion on stderr, so they can never run quietly
+        if key == '--quiet':
+            continue
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                args.append(key)
+                args.extend(item if isinstance(item, (list, tuple)) else [item])
+        elif value is None or value == '':
+            args.append(key)
+        else:
+            args.extend([key, value])
+    return args
+
+
+def _process_memory_mb(pid):
+    """Resident memory of a process in MB, or None when it cannot be measured"""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    except Exception:
+        return None
+
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class RendererWorker:
+    """A long-lived wkhtmltopdf process fed one job per line on stdin.
+
+    wkhtmltopdf's ``--read-args-from-stdin`` mode keeps Qt/WebKit and
+    fontconfig loaded between conversions, so only the first job pays the
+    startup cost.
+    """
+
+    def __init__(self, wkhtmltopdf=WKHTMLTOPDF_PATH):
+        self.wkhtmltopdf = wkhtmltopdf
+        self.jobs_done = 0
+        self.workdir = Path(tempfile.mkdtemp(prefix='flyer_renderer_'))
+        self._events = queue.Queue()
+        self.process = subprocess.Popen(
+            [wkhtmltopdf, '--read-args-from-stdin'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        self._reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self._reader.start()
+
+    def _read_stderr(self):
+        """Turn wkhtmltopdf progress output into completion events"""
+        buffer = b''
+        stream = self.process.stderr
+        while True:
+            chunk = stream.read1(4096) if hasattr(stream, 'read1') else stream.read(1)
+            if not chunk:
+                break
+            buffer += chunk.replace(b'\r', b'\n')
+            *lines, buffer = buffer.split(b'\n')
+            for raw_line in lines:
+                line = raw_line.decode('utf-8', 'replace').strip()
+                # "Done" closes every conversion, including ones that hit
+                # network errors; the output file decides success.
+                if line == 'Done':
+                    self._events.put((True, line))
+                elif line.startswith(('Exit with code', 'Warning:', 'Error:')):
+                    logger.warning(f"wkhtmltopdf[{self.process.pid}]: {line}")
+        self._events.put((False, 'wkhtmltopdf process exited'))
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def memory_mb(self):
+        return _process_memory_mb(self.process.pid)
+
+    def render(self, html_content, options=None, timeout=RENDERER_TIMEOUT):
+        """Render an HTML string and return the PDF bytes"""
+        if not self.alive:
+            raise RenderError("Renderer worker is not running")
+
+        job_id = uuid.uuid4().hex
+        html_path = self.workdir / f'{job_id}.html'
+        pdf_path = self.workdir / f'{job_id}.pdf'
+        html_path.write_text(html_content, encoding='utf-8')
+
+        args = options_to_args(options) + [html_path.as_posix(), pdf_path.as_posix()]
+        line = ' '.join(_quote_arg(arg) for arg in args) + '\n'
+
+        try:
+            self.process.stdin.write(line.encode('utf-8'))
+            self.process.stdin.flush()
+            try:
+                ok, message = self._events.get(timeout=timeout)
+            except queue.Empty:
+                self.close()
+                raise RenderError(f"Render timed out after {timeout}s")
+            self.jobs_done += 1
+            if not ok:
+                raise RenderError(message)
+            if not pdf_path.exists() or pdf_path.stat().st_size == 0:
+                raise RenderError("wkhtmltopdf produced no output")
+            return pdf_path.read_bytes()
+        except (BrokenPipeError, OSError) as e:
+            raise RenderError(f"Renderer worker failed: {str(e)}")
+        finally:
+            for path in (html_path, pdf_path):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def kill(self):
+        """Abort the conversion in progress; the pending render fails and the pool replaces the worker"""
+        if self.alive:
+            self.process.kill()
+
+    def close(self):
+        if self.alive:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except Exception:
+                self.process.kill()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class RendererPool:
+    """Fixed-size pool of warm renderer workers with job/memory based recycling.
+
+    A slot whose replacement worker could not be started holds None and is
+    respawned by the next render that takes it, so failed spawns never
+    shrink the pool.
+    """
+
+    def __init__(self, size=RENDERER_POOL_SIZE, max_jobs=RENDERER_MAX_JOBS,
+                 max_memory_mb=RENDERER_MAX_MEMORY_MB, wkhtmltopdf=WKHTMLTOPDF_PATH):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_memory_mb = max_memory_mb
+        self.wkhtmltopdf = wkhtmltopdf
+        self._idle = queue.Queue()  # Idle workers, or None for a slot still to be respawned
+        self._busy = {}  # worker -> stop Event of the run waiting on its render
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        worker = RendererWorker(self.wkhtmltopdf)
+        try:
+            worker.render(WARMUP_HTML)
+        except RenderError as e:
+            logger.warning(f"Renderer warm-up failed: {str(e)}")
+        return worker
+
+    def _needs_recycling(self, worker):
+        if not worker.alive:
+            return True
+        if self.max_jobs and worker.jobs_done >= self.max_jobs:
+            return True
+        if self.max_memory_mb:
+            memory = worker.memory_mb()
+            if memory is not None and memory > self.max_memory_mb:
+                logger.info(f"Recycling renderer worker using {memory:.0f} MB")
+                return True
+        return False
+
+    def render(self, html_content, options=None, timeout=RENDERER_TIMEOUT, stop=None):
+        """Render HTML on the next idle worker and return the PDF bytes.
+
+        ``stop`` is the Event of the run the render belongs to, see cancel().
+        """
+        if self._closed:
+            raise RenderError("Renderer pool is closed")
+        if is_stopped(stop):
+            raise RenderError("Render cancelled")
+
+        try:
+            worker = self._idle.get(timeout=RENDERER_QUEUE_TIMEOUT)
+        except queue.Empty:
+            raise RenderError(f"No renderer worker became free within {RENDERER_QUEUE_TIMEOUT}s")
+        if worker is None:
+            try:
+                worker = self._spawn()
+            except Exception as e:
+                self._idle.put(None)
+                raise RenderError(f"Could not start a renderer worker: {str(e)}")
+        with self._lock:
+            self._busy[worker] = stop
+        try:
+            return worker.render(html_content, options, timeout)
+        finally:
+            with self._lock:
+                del self._busy[worker]
+            if self._needs_recycling(worker):
+                worker.close()
+                try:
+                    worker = self._spawn()
+                except Exception as e:
+                    logger.warning(f"Could not replace renderer worker, respawning on next use: {str(e)}")
+                    worker = None
+            self._idle.put(worker)
+
+    def cancel(self, stop):
+        """Kill the workers rendering for the run with stop Event ``stop``, freeing their memory; returns how many"""
+        with self._lock:
+            workers = [worker for worker, busy_stop in self._busy.items() if stop is not None and busy_stop is stop]
+        for worker in workers:
+            worker.kill()
+        return len(workers)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not None:
+                worker.close()
+
+
+class SubprocessRenderer:
+    """One wkhtmltopdf process per render; used when the pool is disabled"""
+
+    def __init__(self, wkhtmltopdf=WKHTMLTOPDF_PATH):
+        self.config = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf)
+
+    def render(self, html_content, options=None, timeout=RENDERER_TIMEOUT, stop=None):
+        if is_stopped(stop):
+            raise RenderError("Render cancelled")
+        return pdfkit.from_string(html_content, False, options=options, configuration=self.config)
+
+    def cancel(self, stop):
+        """pdfkit owns its processes, so renders already running here finish"""
+        return 0
+
+    def close(self):
+        pass
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    """Return the process-wide renderer, starting and warming it on first use"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            started = time.time()
+            if RENDERER_POOL_SIZE > 0:
+                _renderer = RendererPool()
+                logger.info(f"Started {RENDERER_POOL_SIZE} renderer workers in {time.time() - started:.1f}s")
+            else:
+                _renderer = SubprocessRenderer()
+            atexit.register(_renderer.close)
+        return _renderer
+
+
+def render_pdf(html_content, options=None, stop=None):
+    """Render HTML to PDF bytes through the shared renderer.
+
+    Identical renders are served from the content-addressed PDF cache
+    without touching wkhtmltopdf. When local file access is enabled, remote
+    images are swapped for cached print-sized copies before rendering; a
+    render missing an image that could not be fetched is not cached, so the
+    next request for it tries the image again.
+    ``stop`` is the stop Event of a cancellable run.
+    """
+    cache = get_pdf_cache()
+    key = cache_key(html_content, options)
+    pdf_bytes = cache.get(key)
+    if pdf_bytes is not None:
+        return pdf_bytes
+
+    complete = True
+    if options and 'enable-local-file-access' in options:
+        html_content = localize_html_images(html_content)
+        complete = not has_remote_images(html_content)
+    pdf_bytes = get_renderer().render(html_content, options, stop=stop)
+    if complete:
+        cache.put(key, pdf_bytes)
+    else:
+        logger.info("Not caching a render whose images could not all be fetched")
+    return pdf_bytes
@@ -0,0 +1,196 @@
+import os
+import time
+import logging
+
+import requests
+
+from flyer_fields import build_bulk_products_query
+from flyer_product import flyer_product, json_loads
+from pipeline import is_stopped
+
+logger = logging.getLogger(__name__)
+
+# Bulk operation configuration
+BULK_OPERATION_THRESHOLD = int(os.getenv('BULK_OPERATION_THRESHOLD', '2000'))  # SKU count that switches engines
+BULK_POLL_INTERVAL = float(os.getenv('BULK_POLL_INTERVAL', '5'))  # Seconds between status polls
+BULK_TIMEOUT = int(os.getenv('BULK_TIMEOUT', '3600'))  # Give up on an operation after this many seconds
+
+BULK_PRODUCTS_QUERY = build_bulk_products_query()
+
+RUN_BULK_MUTATION = """
+mutation RunBulkQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation {
+      id
+      status
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+"""
+
+CURRENT_BULK_OPERATION_QUERY = """
+query {
+  currentBulkOperation {
+    id
+    status
+    errorCode
+    objectCount
+    url
+  }
+}
+"""
+
+
+class BulkOperationError(Exception):
+    """Raised when a bulk operation cannot be started or does not complete"""
+
+
+def _graphql(graphql_url, headers, query, variables=None):
+    response = requests.post(
+        graphql_url,
+        json={'query': query, 'variables': variables or {}},
+        headers=headers,
+        timeout=30
+    )
+    response.raise_for_status()
+    data = response.json()
+    if data.get('errors'):
+        raise BulkOperationError('; '.join(err.get('message', 'Unknown GraphQL error') for err in data['errors']))
+    return data.get('data') or {}
+
+
+def start_bulk_query(graphql_url, headers, query=BULK_PRODUCTS_QUERY):
+    """Start a bulkOperationRunQuery and return the operation id"""
+    result = _graphql(graphql_url, headers, RUN_BULK_MUTATION, {'query': query})
+    payload = result.get('bulkOperationRunQuery') or {}
+    user_errors = payload.get('userErrors') or []
+    if user_errors:
+        raise BulkOperationError('; '.join(err.get('message', '') for err in user_errors))
+    operation = payload.get('bulkOperation') or {}
+    if not operation.get('id'):
+        raise BulkOperationError("Shopify did not return a bulk operation id")
+    return operation['id']
+
+
+def wait_for_bulk_operation(graphql_url, headers, operation_id,
+                            poll_interval=BULK_POLL_INTERVAL, timeout=BULK_TIMEOUT, stop=None):
+    """Poll until the operation completes; returns the result URL (None when it matched nothing).
+
+    Gives up once ``stop``, the stop Event of a cancellable run, is set.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        operation = _graphql(graphql_url, headers, CURRENT_BULK_OPERATION_QUERY).get('currentBulkOperation') or {}
+        if operation.get('id') != operation_id:
+            raise BulkOperationError(f"Bulk operation {operation_id} is no longer the current operation")
+        status = operation.get('status')
+        if status == 'COMPLETED':
+            logger.info(f"Bulk operation {operation_id} completed with {operation.get('objectCount')} objects")
+            return operation.get('url')
+        if status in ('FAILED', 'CANCELED', 'CANCELING', 'EXPIRED'):
+            raise BulkOperationError(f"Bulk operation {operation_id} {status.lower()}: {operation.get('errorCode')}")
+        if time.monotonic() > deadline:
+            raise BulkOperationError(f"Bulk operation {operation_id} timed out after {timeout}s")
+        if is_stopped(stop):
+            raise BulkOperationError(f"Stopped waiting for bulk operation {operation_id}: the run was cancelled")
+        time.sleep(poll_interval)
+
+
+def iter_bulk_products(lines):
+    """Reassemble products from bulk JSONL lines, one product at a time.
+
+    Shopify writes each product before its child variant lines (linked by
+    __parentId), so only the product being assembled is held in memory.
+    Metafield lines are accepted too, for queries that select them as a
+    connection.
+    """
+    product = None
+    for line in lines:
+        if not line:
+            continue
+        record = json_loads(line)
+        parent_id = record.pop('__parentId', None)
+        if parent_id is None:
+            if product is not None:
+                yield product
+            product = dict(record, variants={'edges': []})
+            product.setdefault('metafields', {'edges': []})
+        elif product is None or parent_id != product['id']:
+            logger.warning(f"Skipping orphan bulk line for parent {parent_id}")
+        elif 'sku' in record:
+            product['variants']['edges'].append({'node': record})
+        elif 'key' in record and isinstance(product['metafields'], dict):
+            product['metafields']['edges'].append({'node': record})
+    if product is not None:
+        yield product
+
+
+def product_records(product, wanted_skus):
+    """Build products_by_sku FlyerProducts for the requested SKUs (every SKU when None) of one product"""
+    shared = {}  # The product's SKUs share one copy of its metafields and variants
+    records = {}
+    for edge in product['variants']['edges']:
+        variant = edge['node']
+        sku = variant.get('sku')
+        if sku and (wanted_skus is None or sku in wanted_skus):
+            records[sku] = flyer_product(variant, product, shared)
+    return records
+
+
+def stream_products_bulk(skus, graphql_url, headers, poll_interval=BULK_POLL_INTERVAL, timeout=BULK_TIMEOUT,
+                         search=None, stop=None):
+    """Run a bulk operation and yield products_by_sku FlyerProducts one product at a time.
+
+    Products are yielded while the result file is still downloading, so
+    callers can start on them before the export is read to the end.
+    ``skus=None`` yields every SKU in the catalog, or of the products
+    matching ``search``. Raises BulkOperationError (also when ``stop`` is
+    set), requests' RequestException or ValueError.
+    """
+    wanted_skus = set(skus) if skus is not None else None
+    query = build_bulk_products_query(search) if search else BULK_PRODUCTS_QUERY
+    operation_id = start_bulk_query(graphql_url, headers, query)
+    logger.info(f"Started bulk operation {operation_id} for "
+                f"{len(wanted_skus) if wanted_skus is not None else 'all'} SKUs")
+    url = wait_for_bulk_operation(graphql_url, headers, operation_id, poll_interval, timeout, stop)
+    if not url:
+        return
+
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        for product in iter_bulk_products(response.iter_lines(decode_unicode=True)):
+            if is_stopped(stop):
+                raise BulkOperationError(f"Stopped reading bulk operation {operation_id}: the run was cancelled")
+            records = product_records(product, wanted_skus)
+            if records:
+                yield records
+
+
+def fetch_products_bulk(skus, graphql_url, headers, poll_interval=BULK_POLL_INTERVAL, timeout=BULK_TIMEOUT,
+                        search=None, stop=None):
+    """Fetch products for many SKUs through a Shopify bulk operation.
+
+    Returns (products_by_sku, errors) in the same shape as the paginated
+    fetch, streaming the result file so memory stays flat regardless of
+    catalog size. ``skus=None`` returns every SKU in the catalog, or of the
+    products matching ``search`` (a Shopify product search string).
+    Setting ``stop`` (an Event) abandons the operation.
+    """
+    products_by_sku = {}
+    try:
+        for records in stream_products_bulk(skus, graphql_url, headers, poll_interval, timeout, search, stop):
+            products_by_sku.update(records)
+        return products_by_sku, []
+
+    except (requests.exceptions.RequestException, BulkOperationError, ValueError) as e:
+        error_msg = f"Bulk operation failed: {str(e)}"
+        logger.error(error_msg)
+        return None, [error_msg]
+    except Exception as e:
+        error_msg = f"Unexpected error: {str(e)}"
+        logger.error(error_msg)
+        return None, [error_msg]
@@ -0,0 +1,139 @@
+"""Local stand-in for the Shopify side of the flyer services.
+
+    python shopify_standin.py webhook --sku 9788126912345 --product-id 123
+    python shopify_standin.py sample --products 5000 --out bulk.jsonl
+    python shopify_standin.py serve --jsonl bulk.jsonl --port 8765
+
+With the server running, point the bulk tool at it with
+SHOPIFY_GRAPHQL_URL=http://127.0.0.1:8765/graphql.json.
+"""
+import os
+import hmac
+import json
+import base64
+import hashlib
+import argparse
+import itertools
+
+import requests
+from dotenv import load_dotenv
+from flask import Flask, request, jsonify, send_file
+
+load_dotenv()
+
+
+def post_products_update(url, skus, product_id=None, secret=None):
+    """Post a products/update payload signed like Shopify does"""
+    payload = {
+        'id': int(product_id) if product_id else None,
+        'admin_graphql_api_id': f"gid://shopify/Product/{product_id}" if product_id else None,
+        'variants': [{'sku': sku} for sku in skus],
+    }
+    body = json.dumps(payload).encode('utf-8')
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Shopify-Topic': 'products/update',
+    }
+    if secret:
+        digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()
+        headers['X-Shopify-Hmac-Sha256'] = base64.b64encode(digest).decode('utf-8')
+    response = requests.post(url, data=body, headers=headers, timeout=10)
+    return response.status_code, response.text
+
+
+def create_bulk_app(jsonl_path, polls_until_complete=1):
+    """Flask app answering the bulk operation GraphQL calls and serving a canned JSONL result"""
+    app = Flask(__name__)
+    operation = {'id': None, 'polls': 0}
+    operation_ids = itertools.count(1)
+
+    @app.route('/graphql.json', methods=['POST'])
+    def graphql():
+        query = (request.get_json(silent=True) or {}).get('query', '')
+        if 'metafields(identifiers' in query:
+            # Storefront API only; the Admin API fails validation on it
+            return jsonify({'errors': [{'message': "Field 'metafields' doesn't accept argument 'identifiers'"}]})
+        if 'bulkOperationRunQuery' in query:
+            operation['id'] = f"gid://shopify/BulkOperation/{next(operation_ids)}"
+            operation['polls'] = 0
+            return jsonify({'data': {'bulkOperationRunQuery': {
+                'bulkOperation': {'id': operation['id'], 'status': 'CREATED'},
+                'userErrors': [],
+            }}})
+        if 'currentBulkOperation' in query:
+            operation['polls'] += 1
+            done = operation['polls'] > polls_until_complete
+            return jsonify({'data': {'currentBulkOperation': {
+                'id': operation['id'],
+                'status': 'COMPLETED' if done else 'RUNNING',
+                'errorCode': None,
+                'objectCount': None,
+                'url': request.host_url + 'bulk.jsonl' if done else None,
+            }}})
+        return jsonify({'errors': [{'message': 'Stand-in only answers bulk operation queries'}]}), 400
+
+    @app.route('/bulk.jsonl')
+    def bulk_result():
+        return send_file(os.path.abspath(jsonl_path), mimetype='application/jsonl')
+
+    return app
+
+
+def write_sample_jsonl(path, products, variants_per_product=3):
+    """Write a bulk result file in Shopify's flattened JSONL layout"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for p in range(1, products + 1):
+            product_id = f"gid://shopify/Product/{p}"
+            f.write(json.dumps({
+                'id': product_id,
+                'title': f"Sample Book {p}",
+                'productType': 'Books',
+                'featuredImage': None,
+                'custom_about_the_book': {'value': f"<p>About sample book {p}.</p>"},
+                'custom_author': {'value': f"Author {p}"},
+                'custom_publisher': {'value': 'Atlantic'},
+                'custom_pages': None,
+            }) + '\n')
+            for v in range(variants_per_product):
+                f.write(json.dumps({
+                    'id': f"gid://shopify/ProductVariant/{p * 10 + v}",
+                    'sku': f"978{p:07d}{v:03d}",
+                    'title': ['Hardcover', 'Paperback', 'eBook'][v % 3],
+                    'price': '499.00',
+                    'metafield': {'value': '1st'},
+                    '__parentId': product_id,
+                }) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    webhook = subparsers.add_parser('webhook', help='post a products/update webhook')
+    webhook.add_argument('--url', default='http://127.0.0.1:5000/webhooks/products-update')
+    webhook.add_argument('--sku', action='append', default=[], help='affected SKU (repeatable)')
+    webhook.add_argument('--product-id', help='numeric Shopify product id')
+    webhook.add_argument('--secret', default=os.getenv('SHOPIFY_WEBHOOK_SECRET'))
+
+    sample = subparsers.add_parser('sample', help='write a canned bulk operation JSONL file')
+    sample.add_argument('--products', type=int, default=1000)
+    sample.add_argument('--out', default='bulk.jsonl')
+
+    serve = subparsers.add_parser('serve', help='serve bulk operation calls from a JSONL file')
+    serve.add_argument('--jsonl', required=True)
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--polls', type=int, default=1, help='status polls answered RUNNING before COMPLETED')
+
+    args = parser.parse_args()
+    if args.command == 'webhook':
+        status, text = post_products_update(args.url, args.sku, args.product_id, args.secret)
+        print(status, text)
+    elif args.command == 'sample':
+        write_sample_jsonl(args.out, args.products)
+        print(f"Wrote {args.products} products to {args.out}")
+    elif args.command == 'serve':
+        create_bulk_app(args.jsonl, args.polls).run(port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import os
+import time
+import random
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Throttle configuration
+THROTTLE_MAX_CONCURRENCY = int(os.getenv('SHOPIFY_MAX_CONCURRENCY', '10'))
+THROTTLE_MIN_CONCURRENCY = 1
+THROTTLE_START_CONCURRENCY = 2  # Ramp up from here once the bucket proves healthy
+THROTTLE_HEALTHY_RATIO = 0.5  # Grow concurrency while at least this share of the bucket is left
+THROTTLE_LOW_RATIO = 0.2  # Shrink concurrency once the bucket drops below this share
+SINGLE_QUERY_COST_LIMIT = 1000  # Shopify rejects any single query requesting more than this
+BATCH_COST_HEADROOM = 0.9  # Aim batches at this share of the cost ceiling
+MAX_PAGE_SIZE = 250  # Largest `first` Shopify accepts
+BACKOFF_BASE = 1.0  # Seconds; doubled per attempt, with full jitter
+BACKOFF_MAX = 30.0
+
+
+def is_cost_exceeded(data):
+    """True when a query was refused because its requested cost is above the single-query limit"""
+    for error in (data or {}).get('errors') or []:
+        if isinstance(error, dict) and (error.get('extensions') or {}).get('code') == 'MAX_COST_EXCEEDED':
+            return True
+    return False
+
+
+def is_throttled(data):
+    """True when a GraphQL response was rejected for exceeding the cost budget"""
+    for error in (data or {}).get('errors') or []:
+        if isinstance(error, dict) and (error.get('extensions') or {}).get('code') == 'THROTTLED':
+            return True
+    return False
+
+
+class CostThrottle:
+    """Shared Shopify GraphQL rate limiter driven by extensions.cost.throttleStatus.
+
+    Every call reserves its expected query cost from a local model of
+    Shopify's leaky bucket and waits for the bucket to refill when the
+    budget is short. Concurrency grows while the bucket stays healthy and
+    halves on THROTTLED responses.
+    """
+
+    def __init__(self, max_concurrency=THROTTLE_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.concurrency = min(THROTTLE_START_CONCURRENCY, max_concurrency)
+        self.maximum = None  # Bucket size, learned from the first response
+        self.available = None
+        self.restore_rate = 50.0
+        self.expected_cost = 0.0  # Running estimate of a call's requested cost
+        self.updated_at = time.monotonic()
+        self.active = 0
+        self.reserved = 0.0
+        self.throttled_count = 0
+        self._cond = threading.Condition()
+
+    def _projected_available(self, now):
+        if self.available is None:
+            return float('inf')
+        refilled = self.available + (now - self.updated_at) * self.restore_rate
+        return min(refilled, self.maximum) if self.maximum else refilled
+
+    def acquire(self, cost=None):
+        """Block until a call of the given cost fits the budget; returns the reserved cost.
+
+        The reservation is capped at the bucket size, which a full bucket
+        always covers; a call whose cost is above it is refused by Shopify
+        rather than throttled, so waiting for more could never end.
+        """
+        with self._cond:
+            requested = self.expected_cost if cost is None else cost
+            while True:
+                cost = min(requested, self.maximum) if self.maximum else requested
+                now = time.monotonic()
+                budget = self._projected_available(now) - self.reserved
+                if self.active < self.concurrency and budget >= cost:
+                    break
+                wait = 0.5
+                if self.active < self.concurrency and self.restore_rate:
+                    wait = max(0.05, (cost - budget) / self.restore_rate)
+                self._cond.wait(timeout=wait)
+            self.active += 1
+            self.reserved += cost
+            return cost
+
+    def release(self, reserved_cost, data=None, throttled=False):
+        """Return a slot and fold the response's cost report into the model"""
+        extensions = (data or {}).get('extensions') or {}
+        cost = extensions.get('cost') or {}
+        status = cost.get('throttleStatus') or {}
+
+        with self._cond:
+            self.active -= 1
+            self.reserved = max(0.0, self.reserved - reserved_cost)
+            if status:
+                self.maximum = status.get('maximumAvailable', self.maximum)
+                self.restore_rate = status.get('restoreRate', self.restore_rate) or self.restore_rate
+                self.available = status.get('currentlyAvailable', self.available)
+                self.updated_at = time.monotonic()
+            requested = cost.get('requestedQueryCost')
+            if requested and not throttled and not is_cost_exceeded(data):
+                # Exponential moving average keeps the estimate stable across batch sizes; refused
+                # queries are retried smaller, so their cost says nothing about the next call
+                self.expected_cost = requested if not self.expected_cost else 0.7 * self.expected_cost + 0.3 * requested
+
+            if throttled:
+                self.throttled_count += 1
+                self.concurrency = max(THROTTLE_MIN_CONCURRENCY, self.concurrency // 2)
+                logger.warning(f"Shopify throttled a call, concurrency now {self.concurrency}")
+            elif self.maximum and self.available is not None:
+                if self.available >= self.maximum * THROTTLE_HEALTHY_RATIO:
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                elif self.available < self.maximum * THROTTLE_LOW_RATIO:
+                    self.concurrency = max(THROTTLE_MIN_CONCURRENCY, self.concurrency - 1)
+            self._cond.notify_all()
+
+    def backoff(self, attempt):
+        """Sleep with full jitter before retrying a failed call"""
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        time.sleep(delay)
+        return delay
+
+
+class BatchSizer:
+    """Picks SKUs per query from the cost Shopify reports for previous batches.
+
+    The per-SKU requested cost is tracked as a moving average, and batches
+    are sized to fill the single-query ceiling (or the bucket, if smaller)
+    without exceeding it.
+    """
+
+    def __init__(self, initial_size, max_size=MAX_PAGE_SIZE):
+        self.size = initial_size
+        self.max_size = max_size
+        self.cost_per_sku = None
+        self._lock = threading.Lock()
+
+    def next_size(self):
+        with self._lock:
+            return self.size
+
+    def observe(self, batch_size, data, throttle=None):
+        """Resize from the requestedQueryCost/actualQueryCost of a successful page"""
+        cost = ((data or {}).get('extensions') or {}).get('cost') or {}
+        requested = cost.get('requestedQueryCost')
+        if not requested or not batch_size:
+            return
+        with self._lock:
+            per_sku = requested / batch_size
+            self.cost_per_sku = per_sku if self.cost_per_sku is None else 0.7 * self.cost_per_sku + 0.3 * per_sku
+            ceiling = SINGLE_QUERY_COST_LIMIT
+            if throttle is not None and throttle.maximum:
+                ceiling = min(ceiling, throttle.maximum)
+            self.size = max(1, min(self.max_size, int(ceiling * BATCH_COST_HEADROOM / self.cost_per_sku)))
+            logger.debug(f"Batch of {batch_size} requested {requested} (actual {cost.get('actualQueryCost')}), "
+                         f"next batch size {self.size}")
+
+    def shrink(self, failed_size):
+        """Halve the batch size after a query was refused as too expensive"""
+        with self._lock:
+            self.size = max(1, min(self.size, failed_size // 2))
+            return self.size
+
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+
+def get_throttle():
+    """Return the process-wide throttle shared by every Shopify call"""
+    global _throttle
+    with _throttle_lock:
+        if _throttle is None:
+            _throttle = CostThrottle()
+        return _throttle
@@ -0,0 +1,176 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from pathlib import Path
+
+from flask import jsonify, send_file, url_for
+
+from jobs import FlyerRequestError, wants_async
+from pdf_cache import TEMPLATE_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Pre-generated flyer configuration
+PREGENERATED_DIR = Path(os.getenv('PREGENERATED_DIR', '.flyer_cache/pregenerated'))
+PREGENERATED_MAX_AGE = int(os.getenv('PREGENERATED_MAX_AGE', '3600'))  # Cache-Control max-age for served flyers
+CURRENT_FILE = 'CURRENT'  # Names the version directory endpoints serve from
+MANIFEST_FILE = 'manifest.json'
+
+_UNSAFE_CHARS_RE = re.compile(r'[^A-Za-z0-9._-]')
+
+
+def flyer_filename(sku):
+    """File name of a SKU's flyer inside a version directory"""
+    return _UNSAFE_CHARS_RE.sub('_', str(sku)) + '.pdf'
+
+
+def flyer_input_hash(context, backend):
+    """Hash of everything a flyer is rendered from: its template context, the templates and the backend"""
+    digest = hashlib.sha256(f"{TEMPLATE_VERSION}:{backend}".encode('utf-8'))
+    digest.update(json.dumps(context, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+class PregeneratedFlyers:
+    """Read side of the pre-generated catalog.
+
+    ``pregenerate.py`` writes ``<root>/<version>/`` with one PDF per SKU and a
+    manifest of ETags, then points ``<root>/CURRENT`` at it. The manifest is
+    reloaded whenever CURRENT changes, so a finished run goes live without
+    restarting the services.
+    """
+
+    def __init__(self, root=PREGENERATED_DIR):
+        self.root = Path(root)
+        self.version = None
+        self.manifest = {}
+        self._current_mtime = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        current = self.root / CURRENT_FILE
+        try:
+            mtime = current.stat().st_mtime
+        except OSError:
+            self.version, self.manifest, self._current_mtime = None, {}, None
+            return
+        if mtime == self._current_mtime:
+            return
+        try:
+            version = current.read_text(encoding='utf-8').strip()
+            manifest = json.loads((self.root / version / MANIFEST_FILE).read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load pre-generated flyers: {str(e)}")
+            return
+        self.version, self.manifest, self._current_mtime = version, manifest.get('flyers', {}), mtime
+        logger.info(f"Serving {len(self.manifest)} pre-generated flyers from version {version}")
+
+    def lookup(self, sku):
+        """Return (path, manifest entry) for a SKU's current flyer, or None"""
+        with self._lock:
+            self._refresh()
+            entry = self.manifest.get(str(sku))
+            version = self.version
+        if not entry:
+            return None
+        path = self.root / version / entry['file']
+        if not path.is_file():
+            return None
+        return path, entry
+
+    def discard(self, skus):
+        """Delete flyers whose product changed, so requests fall back to a live render"""
+        removed = 0
+        for sku in skus:
+            found = self.lookup(sku)
+            if found:
+                try:
+                    found[0].unlink()
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+_pregenerated = None
+_pregenerated_lock = threading.Lock()
+
+
+def get_pregenerated():
+    """Return the process-wide pre-generated flyer index"""
+    global _pregenerated
+    with _pregenerated_lock:
+        if _pregenerated is None:
+            _pregenerated = PregeneratedFlyers()
+        return _pregenerated
+
+
+def send_pregenerated(sku, download_name=None):
+    """Serve a SKU's pre-generated flyer with ETag/Last-Modified, or None on a miss.
+
+    Conditional GETs (If-None-Match / If-Modified-Since) are answered 304.
+    """
+    found = get_pregenerated().lookup(sku)
+    if not found:
+        return None
+    path, entry = found
+    return send_file(
+        path,
+        mimetype='application/pdf',
+        download_name=download_name or f"{entry.get('title') or 'flyer'}_flyer.pdf",
+        conditional=True,
+        etag=entry['etag'],
+        last_modified=entry.get('generated_at'),
+        max_age=PREGENERATED_MAX_AGE
+    )
+
+
+def pregenerated_response(sku, download_name=None, input_hash=None):
+    """Answer a POST flyer request from the pre-generated catalog, or None on a miss.
+
+    With ``input_hash`` (see flyer_input_hash) the flyer is only served when
+    it was rendered from the same inputs, so a request carrying its own
+    content gets a live render instead of the catalog's flyer. Async
+    clients get the static URL to download from instead of a job.
+    """
+    found = get_pregenerated().lookup(sku) if sku else None
+    if not found:
+        return None
+    if input_hash is not None and found[1].get('input_hash') != input_hash:
+        return None
+    if wants_async():
+        return jsonify({'status': 'done', 'download_url': url_for('pregenerated_flyer', sku=sku)}), 200
+    return send_pregenerated(sku, download_name)
+
+
+def register_flyer_routes(app, render_live=None):
+    """Add GET /flyers/<sku>.pdf, served from the pre-generated catalog.
+
+    On a miss ``render_live(sku)`` (returning (pdf_bytes, download_name))
+    renders the flyer instead; without it the route answers 404.
+    """
+
+    @app.route('/flyers/<sku>.pdf', methods=['GET'])
+    def pregenerated_flyer(sku):
+        response = send_pregenerated(sku)
+        if response is not None:
+            return response
+        if render_live is None:
+            return jsonify({"error": "Flyer not pre-generated"}), 404
+        try:
+            pdf, download_name = render_live(sku)
+        except FlyerRequestError as e:
+            return jsonify(e.body), e.status
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        return send_file(
+            BytesIO(pdf),
+            mimetype='application/pdf',
+            download_name=download_name,
+            conditional=True,
+            etag=hashlib.sha256(pdf).hexdigest()[:32]
+        )
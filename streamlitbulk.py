@@ -1,18 +1,35 @@
 import os
+import re
 import requests
 import logging
 import traceback
+import threading
 from flask import Flask, request, render_template, send_file, jsonify
 from flask_cors import CORS
-import pdfkit
 import streamlit as st
 from datetime import datetime
-from PyPDF2 import PdfMerger
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from PyPDF2 import PdfMerger, PdfReader, PdfWriter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
 from io import BytesIO 
 from dotenv import load_dotenv
+from renderer import get_renderer, render_pdf
+from pdf_cache import TEMPLATE_VERSION, get_pdf_cache
+from asset_cache import prefetch_images
+from product_cache import get_product_cache
+from shopify_throttle import BatchSizer, get_throttle, is_cost_exceeded, is_throttled
+from shopify_bulk import BULK_OPERATION_THRESHOLD, BulkOperationError, fetch_products_bulk, stream_products_bulk
+from flyer_fields import build_variants_query
+from flyer_product import flyer_product, json_loads
+from pipeline import Pipeline, Stage, StageError, is_stopped
+from output_spool import (
+    DOWNLOAD_MAX_MB, PARTIAL_ZIP_FLYERS, FlyerResults, MergedPdfSpool, RollingZipSpool, ZipSpool, discard,
+    flyer_entry_name
+)
+from pdf_optimize import format_size
+from text_fit import fit_flyer_context
+from native_flyer import NativeFlyerBackend
 import jinja2
-from bs4 import BeautifulSoup
 import time
 import math
 
@@ -22,31 +39,39 @@ load_dotenv()
 SHOPIFY_DOMAIN = os.getenv('SHOPIFY_DOMAIN')
 ADMIN_API_TOKEN = os.getenv('SHOPIFY_ADMIN_API_TOKEN')
 API_VERSION = os.getenv('SHOPIFY_API_VERSION', '2025-04')
-WKHTMLTOPDF_PATH = r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe"
-
-# Configure pdfkit
-config = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
+GRAPHQL_URL = os.getenv('SHOPIFY_GRAPHQL_URL') or f"https://{SHOPIFY_DOMAIN}/admin/api/{API_VERSION}/graphql.json"
 
 # Jinja2 setup
 template_loader = jinja2.FileSystemLoader(searchpath='./templates')
 template_env = jinja2.Environment(loader=template_loader)
 
 # Set up logging
+LOG_FILE = os.getenv('FLYER_LOG_FILE', 'flyer_generator.log')  # Empty logs to the console only
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('flyer_generator.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[logging.FileHandler(LOG_FILE), logging.StreamHandler()] if LOG_FILE else [logging.StreamHandler()]
 )
 logger = logging.getLogger(__name__)
 
 # Constants
-MAX_API_BATCH_SIZE = 100  # Shopify's GraphQL limit
+MAX_API_BATCH_SIZE = 100  # Starting batch size; later batches are sized from the reported query cost
 MAX_WORKERS = 10  # Optimal balance between speed and resource usage
 MAX_RETRIES = 3  # For API calls
-RETRY_DELAY = 2  # Seconds between retries
+MAX_THROTTLE_RETRIES = 10  # THROTTLED responses retried once the cost budget refills
+MISSING_SKU_RETRIES = 1  # Extra passes for SKUs absent from the results
+BATCH_CHUNK_SIZE = 50  # Flyers rendered per renderer call for merged output
+PAGES_PER_FLYER = 1  # Expected pages per flyer; anything else means the layout broke
+FETCH_CHUNK_SIZE = 250  # SKUs per fetch stage item; rendering starts once the first one lands
+FETCH_STAGE_WORKERS = 2  # Fetch slices in flight; the throttle bounds the Shopify calls underneath
+PREPARE_STAGE_WORKERS = 2  # Threads building template contexts
+CANCEL_WAIT_SECONDS = 15  # How long a cancelled run's in-flight items get to wind down
+RESULTS_HEARTBEAT_SECONDS = 1  # Longest wait for a result before the page is touched, so Cancel is seen
+ISBN_PATTERN = re.compile(r"\d{9}[\dX]|\d{13}")  # ISBN-10 or ISBN-13 once hyphens and spaces are dropped
+FLYER_BACKEND = os.getenv('FLYER_BACKEND', 'html')  # 'native' draws flyers with reportlab, wkhtmltopdf as fallback
+
+# Shared across fetches so every batch benefits from the cost already observed
+batch_sizer = BatchSizer(MAX_API_BATCH_SIZE)
 
 def safe_get(dictionary, keys, default=''):
     """Safely get nested dictionary keys with error handling"""
@@ -61,208 +86,138 @@ def safe_get(dictionary, keys, default=''):
     except (AttributeError, TypeError):
         return default
 
-def truncate_html_preserving_tags(html_content, char_limit):
-    """Truncate HTML content while preserving tag structure"""
-    if not html_content or not isinstance(html_content, str):
-        return ''
-    
-    try:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        total_chars = 0
-
-        def truncate_node(node):
-            nonlocal total_chars
-            if node.name is None:  # Text node
-                if total_chars >= char_limit:
-                    node.extract()
-                    return
-                text_len = len(node)
-                if total_chars + text_len > char_limit:
-                    node.replace_with(node[:char_limit - total_chars])
-                    total_chars = char_limit
-                else:
-                    total_chars += text_len
-            else:
-                for child in list(node.contents):
-                    if total_chars >= char_limit:
-                        child.extract()
-                    else:
-                        truncate_node(child)
-
-        truncate_node(soup)
+def normalize_sku(value):
+    """Trim a pasted SKU; ISBN-shaped ones lose their hyphens and spaces"""
+    sku = value.strip().strip('"\'').strip()
+    compact = re.sub(r'[\s-]', '', sku).upper()
+    return compact if ISBN_PATTERN.fullmatch(compact) else sku
 
-        if total_chars >= char_limit:
-            note = soup.new_tag("p")
-            note.string = "[... visit our website to learn more]"
-            soup.append(note)
+def normalize_skus(values):
+    """Normalized SKUs in input order, without blanks or repeats"""
+    return list(dict.fromkeys(sku for sku in map(normalize_sku, values) if sku))
 
-        return str(soup)
-    except Exception as e:
-        logger.error(f"HTML truncation failed: {str(e)}")
-        return html_content[:char_limit] if html_content else ''
-    
-def calculate_optimal_content_distribution(about_book, about_author, max_total_chars=2000):
-    """Dynamically adjust space allocation between book and author sections
-    based on their content length.
-    """
-    # Calculate initial lengths
-    book_len = len(about_book) if about_book else 0
-    author_len = len(about_author) if about_author else 0
-    total_len = book_len + author_len
-    
-    # If total content fits within limits, return as-is
-    if total_len <= max_total_chars:
-        return about_book, about_author
-    
-    # Calculate ideal ratios based on content length
-    if book_len == 0:
-        return '', truncate_html_preserving_tags(about_author, max_total_chars)
-    if author_len == 0:
-        return truncate_html_preserving_tags(about_book, max_total_chars), ''
-    
-    # Calculate dynamic ratio (minimum 30% for each section)
-    book_ratio = max(0.3, min(0.7, book_len / total_len))
-    author_ratio = 1 - book_ratio
-    
-    # Calculate allocated characters
-    book_chars = int(max_total_chars * book_ratio)
-    author_chars = max_total_chars - book_chars
-    
-    # Truncate content
-    truncated_book = truncate_html_preserving_tags(about_book, book_chars)
-    truncated_author = truncate_html_preserving_tags(about_author, author_chars)
-    
-    return truncated_book, truncated_author
+def parse_skus(text):
+    """SKUs from text with one per line or comma separated"""
+    return normalize_skus(s for line in text.split('\n') for s in line.split(','))
 
-def fetch_products_batch(skus, attempt=1):
-    """Fetch a batch of products with retry logic"""
-    headers = {
+def shopify_headers():
+    """Admin API request headers"""
+    return {
         "X-Shopify-Access-Token": ADMIN_API_TOKEN,
         "Content-Type": "application/json",
         "Accept": "application/json"
     }
 
-    sku_query = ' OR '.join(f'sku:{sku}' for sku in skus)
-    query = """
-    query GetProductsBySkus($first: Int!, $query: String!) {
-      productVariants(first: $first, query: $query) {
-        edges {
-          node {
-            sku
-            title
-            price
-            product {
-              title
-              productType
-              featuredImage {
-                url
-              }
-              variants(first: 10) {
-                edges {
-                  node {
-                    sku
-                    title
-                    price
-                    metafield(namespace: "custom", key: "edition") {
-                      value
-                    }
-                  }
-                }
-              }
-              metafields(first: 100) {
-                edges {
-                  node {
-                    namespace
-                    key
-                    value
-                  }
-                }
-              }
-            }
-          }
-        }
-      }
-    }
+def fetch_products_batch(skus, attempt=1, throttled_attempts=0, after=None, stop=None, page_size=None):
+    """Fetch a batch of products with retry logic, following pagination cursors.
+
+    Pages hold ``page_size`` matches (all the SKUs by default). Retries and
+    further pages are skipped once ``stop`` (an Event) is set.
     """
+    if is_stopped(stop):
+        return None, ["Fetch cancelled"]
+    headers = shopify_headers()
 
+    sku_query = ' OR '.join(f'sku:{sku}' for sku in skus)
+    query = build_variants_query()
+
+    first = page_size or len(skus)
     variables = {
-        "first": len(skus),
-        "query": sku_query
+        "first": first,
+        "query": sku_query,
+        "after": after
     }
 
+    throttle = get_throttle()
     try:
-        response = requests.post(
-            f"https://{SHOPIFY_DOMAIN}/admin/api/{API_VERSION}/graphql.json",
-            json={'query': query, 'variables': variables},
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
-        
-        data = response.json()
+        # Wait for room in the shared cost budget before calling Shopify
+        reserved_cost = throttle.acquire()
+        data = None
+        throttled = False
+        try:
+            response = requests.post(
+                GRAPHQL_URL,
+                json={'query': query, 'variables': variables},
+                headers=headers,
+                timeout=30
+            )
+            throttled = response.status_code == 429
+            if not throttled:
+                response.raise_for_status()
+                data = json_loads(response.content)
+                throttled = is_throttled(data)
+        finally:
+            throttle.release(reserved_cost, data, throttled)
+
+        if throttled:
+            # The throttle has the fresh bucket state, so the retry waits exactly for the refill
+            if throttled_attempts < MAX_THROTTLE_RETRIES:
+                return fetch_products_batch(skus, attempt, throttled_attempts + 1, after, stop, page_size)
+            return None, [f"Shopify kept throttling the request after {MAX_THROTTLE_RETRIES} retries"]
+
+        if is_cost_exceeded(data) and len(skus) > 1 and after is None:
+            # Too expensive for one query: shrink future batches and split this one
+            size = batch_sizer.shrink(len(skus))
+            logger.warning(f"Batch of {len(skus)} SKUs exceeded the query cost limit, splitting into {size}")
+            products_by_sku, errors = {}, []
+            for i in range(0, len(skus), size):
+                part_result, part_errors = fetch_products_batch(skus[i:i + size], stop=stop)
+                if part_result:
+                    products_by_sku.update(part_result)
+                errors.extend(part_errors or [])
+            return products_by_sku, errors
+
+        if is_cost_exceeded(data) and after is not None and first > 1:
+            # Splitting the SKUs would lose the cursor, so fetch the rest in smaller pages instead
+            size = max(1, first // 2)
+            logger.warning(f"Page of {first} matches exceeded the query cost limit, continuing with {size}")
+            return fetch_products_batch(skus, attempt, throttled_attempts, after, stop, size)
         
         if safe_get(data, 'errors'):
             errors = [err.get('message', 'Unknown GraphQL error') for err in safe_get(data, 'errors', [])]
             logger.error(f"GraphQL Errors: {errors}")
             if attempt <= MAX_RETRIES:
-                time.sleep(RETRY_DELAY * attempt)
-                return fetch_products_batch(skus, attempt + 1)
+                throttle.backoff(attempt)
+                return fetch_products_batch(skus, attempt + 1, throttled_attempts, after, stop, page_size)
             return None, errors
             
+        batch_sizer.observe(len(skus), data, throttle)
         edges = safe_get(data, ['data', 'productVariants', 'edges'], [])
         
         products_by_sku = {}
         errors = []
-        
+        shared = {}  # Product id -> parts shared by that product's SKUs
+
         for edge in edges:
+            sku = None
             try:
                 node = safe_get(edge, 'node', {})
                 sku = safe_get(node, 'sku')
                 if not sku:
                     continue
-                    
-                product = safe_get(node, 'product', {})
-                
-                # Process metafields
-                metafield_edges = safe_get(product, ['metafields', 'edges'], [])
-                metafields = {}
-                for mf in metafield_edges:
-                    mf_node = safe_get(mf, 'node', {})
-                    namespace = safe_get(mf_node, 'namespace')
-                    key = safe_get(mf_node, 'key')
-                    value = safe_get(mf_node, 'value')
-                    if namespace and key and value is not None:
-                        metafields[f"{namespace}_{key}"] = value
-                
-                # Get edition from variant metafield
-                variant_metafield = None
-                for v_edge in safe_get(product, ['variants', 'edges'], []):
-                    v_node = safe_get(v_edge, 'node', {})
-                    if safe_get(v_node, 'sku') == sku:
-                        variant_metafield = safe_get(v_node, ['metafield', 'value'])
-                        break
-                
-                products_by_sku[sku] = {
-                    'variant': node,
-                    'product': product,
-                    'metafields': metafields,
-                    'edition': variant_metafield
-                }
-
-                print(products_by_sku)
+                products_by_sku[sku] = flyer_product(node, safe_get(node, 'product', {}), shared)
             except Exception as e:
                 error_msg = f"Error processing product {sku}: {str(e)}"
                 logger.error(error_msg)
                 errors.append(error_msg)
 
+        # Matches past the first page used to be dropped silently
+        page_info = safe_get(data, ['data', 'productVariants', 'pageInfo'], {})
+        if safe_get(page_info, 'hasNextPage', False) and safe_get(page_info, 'endCursor'):
+            next_result, next_errors = fetch_products_batch(skus, after=page_info['endCursor'], stop=stop,
+                                                            page_size=page_size)
+            if next_result:
+                products_by_sku.update(next_result)
+            errors.extend(next_errors or [])
+
         return products_by_sku, errors
 
     except requests.exceptions.RequestException as e:
         logger.error(f"API request failed (attempt {attempt}): {str(e)}")
         
         if attempt <= MAX_RETRIES:
-            time.sleep(RETRY_DELAY * attempt)
-            return fetch_products_batch(skus, attempt + 1)
+            throttle.backoff(attempt)
+            return fetch_products_batch(skus, attempt + 1, throttled_attempts, after, stop, page_size)
         return None, [f"API request failed after {MAX_RETRIES} attempts: {str(e)}"]
 
     except Exception as e:
@@ -271,75 +226,121 @@ def fetch_products_batch(skus, attempt=1):
         return None, [error_msg]
     
 
-def fetch_all_products(skus):
-    """Fetch all products in batches"""
+def fetch_all_products(skus, stop=None):
+    """Fetch all products in batches; setting ``stop`` (an Event) abandons the fetch"""
+    all_errors = []
+
+    # Only SKUs without a fresh cached record go to Shopify
+    product_cache = get_product_cache()
+    products_by_sku, skus = product_cache.get_many(skus)
+    if not skus:
+        return products_by_sku, all_errors
+
+    # Catalog-scale runs go through a bulk operation; fall back to batches if it fails
+    if len(skus) > BULK_OPERATION_THRESHOLD:
+        bulk_result, bulk_errors = fetch_products_bulk(skus, GRAPHQL_URL, shopify_headers(), stop=stop)
+        if bulk_result is not None:
+            products_by_sku.update(bulk_result)
+            product_cache.put_many(bulk_result)
+            all_errors.extend(bulk_errors)
+            # The export holds every product, so a SKU missing from it does not exist
+            all_errors.extend(f"{sku}: not found in Shopify" for sku in skus if sku not in bulk_result)
+            return products_by_sku, all_errors
+        if is_stopped(stop):
+            return products_by_sku, all_errors + bulk_errors
+        logger.warning("Falling back to batched product fetch")
+
+    batch_result, batch_errors = fetch_products_batched(skus, stop)
+    products_by_sku.update(batch_result)
+    return products_by_sku, all_errors + batch_errors
+
+
+def fetch_products_batched(skus, stop=None):
+    """Fetch SKUs with paginated queries, giving SKUs missing from the results another pass.
+
+    Returns (products_by_sku, errors), with an error for every SKU still missing.
+    """
     products_by_sku = {}
     all_errors = []
-    
-    # Split SKUs into batches
-    batches = [skus[i:i + MAX_API_BATCH_SIZE] for i in range(0, len(skus), MAX_API_BATCH_SIZE)]
-    
-    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(batches))) as executor:
-        futures = {executor.submit(fetch_products_batch, batch): batch for batch in batches}
-        
-        for future in as_completed(futures):
-            batch_result, batch_errors = future.result()
-            if batch_result:
-                products_by_sku.update(batch_result)
-            if batch_errors:
-                all_errors.extend(batch_errors)
+    product_cache = get_product_cache()
+    remaining = skus
+    for fetch_pass in range(MISSING_SKU_RETRIES + 1):
+        pass_result, pass_errors = fetch_products_adaptive(remaining, stop)
+        products_by_sku.update(pass_result)
+        product_cache.put_many(pass_result)
+        remaining = [sku for sku in remaining if sku not in products_by_sku]
+        if not remaining or fetch_pass == MISSING_SKU_RETRIES or is_stopped(stop):
+            all_errors.extend(pass_errors)
+            break
+        logger.info(f"Re-queueing {len(remaining)} SKUs missing from the results")
+
+    if not is_stopped(stop):
+        all_errors.extend(f"{sku}: not found in Shopify" for sku in remaining)
+    return products_by_sku, all_errors
+
+
+def fetch_products_adaptive(skus, stop=None):
+    """Fetch SKUs in batches sized from the query cost Shopify reports.
+
+    The executor threads get ``stop`` explicitly; once it is set no new
+    batches are queued and those in flight skip their retries.
+    """
+    products_by_sku = {}
+    all_errors = []
+    pending = deque(skus)
+    throttle = get_throttle()
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        in_flight = {}
+        while pending or in_flight:
+            if is_stopped(stop):
+                pending.clear()
+            # Only queue as many batches as the throttle lets run, so new sizes apply quickly
+            while pending and len(in_flight) < max(1, min(MAX_WORKERS, throttle.concurrency)):
+                size = batch_sizer.next_size()
+                batch = [pending.popleft() for _ in range(min(size, len(pending)))]
+                in_flight[executor.submit(fetch_products_batch, batch, stop=stop)] = batch
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.pop(future)
+                batch_result, batch_errors = future.result()
+                if batch_result:
+                    products_by_sku.update(batch_result)
+                if batch_errors:
+                    all_errors.extend(batch_errors)
     
     return products_by_sku, all_errors
 
 
 def prepare_template_context(product_data):
-    """Prepare template context with null checks"""
+    """Prepare template context from a FlyerProduct"""
     if not product_data:
         return {}, "No product data provided"
     
     try:
-        product = safe_get(product_data, 'product', {})
-        variant = safe_get(product_data, 'variant', {})
-        metafields = safe_get(product_data, 'metafields', {})
+        metafields = product_data.metafields
         
         # Process variants
-        variants = []
-        variant_errors = []
-        for edge in safe_get(product, ['variants', 'edges'], []):
-            try:
-                v_node = safe_get(edge, 'node', {})
-                variants.append({
-                    'isbn': safe_get(v_node, 'sku', ''),
-                    'title': safe_get(v_node, 'title', ''),
-                    'price': safe_get(v_node, 'price', '0.00'),
-                    'edition': safe_get(v_node, ['metafield', 'value'], '')
-                })
-            except Exception as e:
-                variant_errors.append(f"Variant error: {str(e)}")
-        
-        if variant_errors:
-            logger.warning(f"Variant processing errors: {variant_errors}")
+        variants = [
+            {
+                'isbn': v.sku or '',
+                'title': v.title or '',
+                'price': v.price or '0.00',
+                'edition': v.edition or ''
+            }
+            for v in product_data.variants
+        ]
         
         # Process subject field
         subject_raw = safe_get(metafields, 'custom_subject', '')
         subject = subject_raw.strip('[]').replace('"', '').replace("'", '')
         subject = ", ".join(item.strip() for item in subject.split(',') if item.strip())
 
-        # Get raw about the book and author content
-        raw_book_desc = safe_get(metafields, 'custom_about_the_book', '')
-        raw_about_author = safe_get(metafields, 'custom_about_the_author', '')
-
-        # Dynamically balance content
-        book_desc, about_author = calculate_optimal_content_distribution(
-            raw_book_desc, 
-            raw_about_author,
-            max_total_chars=2000  # Adjust based on your layout needs
-        )
-        
         context = {
-            'product_title': safe_get(product, 'title', 'Untitled Product'),
-            'product_image': safe_get(product, ['featuredImage', 'url'], ''),
-            'product_category': safe_get(product, 'productType', ''),
+            'product_title': product_data.title or 'Untitled Product',
+            'product_image': product_data.image_url or '',
+            'product_category': product_data.product_type or '',
             'publisher_imprint': safe_get(metafields, 'custom_imprint', ''),
             'publishing_date': safe_get(metafields, 'custom_publication_date', ''),
             'pages': safe_get(metafields, 'custom_pages', ''),
@@ -348,21 +349,21 @@ def prepare_template_context(product_data):
                 safe_get(metafields, 'custom_author'),
                 safe_get(metafields, 'custom_author'),
             ])),
-            'book_desc':book_desc,
-            'about_author': about_author,
-            'toc': truncate_html_preserving_tags(
-                safe_get(metafields, 'custom_table_of_contents', ''), 
-                900
-            ),
+            'book_desc': safe_get(metafields, 'custom_about_the_book', ''),
+            'about_author': safe_get(metafields, 'custom_about_the_author', ''),
+            'toc': safe_get(metafields, 'custom_table_of_contents', ''),
             'publisher': safe_get(metafields, 'custom_publisher', ''),
             'subject': subject,
             'volume': safe_get(metafields, 'custom_volume', ''),
-            'edition': safe_get(product_data, 'edition', ''),
-            'isbn': safe_get(variant, 'sku', ''),
-            'price': safe_get(variant, 'price', '0.00'),
+            'edition': product_data.edition or '',
+            'isbn': product_data.sku or '',
+            'price': product_data.price or '0.00',
             'variants': variants,
             'current_year': datetime.now().year
         }
+
+        # Cut the HTML sections at the lines that fill the page, measured from the template's fonts
+        fit_flyer_context(context)
         
         return context, None
         
@@ -371,8 +372,33 @@ def prepare_template_context(product_data):
         logger.error(error_msg)
         return {}, error_msg
 
-def generate_pdf(html_content):
-    """Generate PDF with error handling"""
+def sku_context(context, product_data):
+    """A context prepared for another SKU of the same product, re-pointed at ``product_data``'s SKU"""
+    return dict(
+        context,
+        isbn=product_data.sku or '',
+        price=product_data.price or '0.00',
+        edition=product_data.edition or ''
+    )
+
+def flyer_group_key(product_data):
+    """SKUs with equal keys render to the same flyer.
+
+    The template draws the product's fields and its whole variant list, but
+    not the SKU's own isbn or price, and only whether it has an edition.
+    """
+    return (product_data.product_id or product_data.sku, product_data.updated_at, bool(product_data.edition))
+
+def group_by_flyer(skus, products_data):
+    """Fetched SKUs grouped by flyer_group_key, in input order"""
+    groups = {}
+    for sku in skus:
+        if sku in products_data:
+            groups.setdefault(flyer_group_key(products_data[sku]), []).append(sku)
+    return list(groups.values())
+
+def generate_pdf(html_content, stop=None):
+    """Generate PDF with error handling; ``stop`` is the stop Event of a cancellable run"""
     if not html_content:
         return None, "No HTML content provided"
     
@@ -398,13 +424,17 @@ def generate_pdf(html_content):
                 }
 
        
-        pdf_bytes = pdfkit.from_string(html_content, False, options=options, configuration=config)
+        pdf_bytes = render_pdf(html_content, options, stop)
         return pdf_bytes, None
     except Exception as e:
         error_msg = f"PDF generation failed: {str(e)}"
         logger.error(error_msg)
         return None, error_msg
 
+def render_flyer(context, stop=None):
+    """Render a prepared template context to a flyer PDF with the configured backend"""
+    return get_flyer_backend().render(context, stop)
+
 def generate_single_flyer(sku, products_data):
     """Generate a single flyer with complete error handling"""
     try:
@@ -419,17 +449,8 @@ def generate_single_flyer(sku, products_data):
         if context_error:
             return None, context_error
         
-        # Render template
-        try:
-            template = template_env.get_template('flyer_template.html')
-            html_content = template.render(**context)
-        except Exception as e:
-            error_msg = f"Template rendering failed: {str(e)}"
-            logger.error(error_msg)
-            return None, error_msg
-        
-        # Generate PDF
-        pdf_bytes, pdf_error = generate_pdf(html_content)
+        # Render template and generate PDF
+        pdf_bytes, pdf_error = render_flyer(context)
         if pdf_error:
             return None, pdf_error
         
@@ -440,9 +461,337 @@ def generate_single_flyer(sku, products_data):
         logger.error(error_msg)
         return None, error_msg
 
+def count_pdf_pages(pdf_bytes):
+    """Count the pages of an in-memory PDF"""
+    return len(PdfReader(BytesIO(pdf_bytes)).pages)
+
+def render_flyer_chunk(contexts, stop=None):
+    """Render a chunk of prepared (sku, context) pairs as one document with the configured backend.
+
+    Returns (pdf_bytes, rendered_skus, errors).
+    """
+    return get_flyer_backend().render_chunk(contexts, stop)
+
+class HtmlFlyerBackend:
+    """Renders the Jinja template and converts it with wkhtmltopdf"""
+
+    name = 'html'
+
+    def render(self, context, stop=None):
+        """Render one prepared template context; returns (pdf_bytes, error)"""
+        try:
+            template = template_env.get_template('flyer_template.html')
+            html_content = template.render(**context)
+        except Exception as e:
+            error_msg = f"Template rendering failed: {str(e)}"
+            logger.error(error_msg)
+            return None, error_msg
+
+        return generate_pdf(html_content, stop)
+
+    def render_chunk(self, contexts, stop=None):
+        """Render (sku, context) pairs as one document with forced page breaks.
+
+        Falls back to rendering each flyer on its own when the combined render
+        fails or its page count shows that a product broke the layout.
+        Returns (pdf_bytes, rendered_skus, errors).
+        """
+        pages = []
+        rendered = []
+        errors = []
+
+        for sku, context in contexts:
+            try:
+                pages.append(template_env.get_template('_flyer_page.html').render(**context))
+                rendered.append((sku, context))
+            except Exception as e:
+                error_msg = f"Template rendering failed: {str(e)}"
+                logger.error(error_msg)
+                errors.append(f"{sku}: {error_msg}")
+
+        if not pages:
+            return None, [], errors
+
+        try:
+            html_content = template_env.get_template('flyer_batch.html').render(pages=pages)
+            pdf_bytes, pdf_error = generate_pdf(html_content, stop)
+            if pdf_bytes and count_pdf_pages(pdf_bytes) == len(pages) * PAGES_PER_FLYER:
+                return pdf_bytes, [sku for sku, _ in rendered], errors
+            logger.warning(
+                f"Batch render of {len(pages)} flyers failed or broke the layout "
+                f"({pdf_error or 'unexpected page count'}), rendering individually"
+            )
+        except Exception as e:
+            logger.warning(f"Batch render of {len(pages)} flyers failed ({str(e)}), rendering individually")
+
+        # Per-chunk fallback: render every flyer on its own and merge the chunk
+        merger = PdfMerger()
+        fallback_skus = []
+        for sku, context in rendered:
+            if is_stopped(stop):
+                errors.append(f"{sku}: Render cancelled")
+                continue
+            pdf_bytes, error = self.render(context, stop)
+            if pdf_bytes:
+                merger.append(BytesIO(pdf_bytes))
+                fallback_skus.append(sku)
+            if error:
+                errors.append(f"{sku}: {error}")
+
+        if not fallback_skus:
+            return None, [], errors
+
+        chunk_pdf = BytesIO()
+        merger.write(chunk_pdf)
+        merger.close()
+        return chunk_pdf.getvalue(), fallback_skus, errors
+
+# Rendering backends by name; the native one hands what it cannot draw to wkhtmltopdf
+html_backend = HtmlFlyerBackend()
+FLYER_BACKENDS = {backend.name: backend for backend in (html_backend, NativeFlyerBackend(fallback=html_backend))}
+
+def get_flyer_backend(name=None):
+    """The backend named ``name``, or FLYER_BACKEND"""
+    name = name or FLYER_BACKEND
+    backend = FLYER_BACKENDS.get(name)
+    if backend is None:
+        logger.warning(f"Unknown flyer backend {name!r}, using html")
+        return html_backend
+    return backend
+
+def generate_flyer_chunk(skus, products_data):
+    """Prepare and render a chunk of flyers as one document; returns (pdf_bytes, rendered_skus, errors)"""
+    contexts = []
+    errors = []
+    for sku in skus:
+        if sku not in products_data:
+            errors.append(f"{sku}: Product data not found for SKU: {sku}")
+            continue
+        context, context_error = prepare_template_context(products_data[sku])
+        if context_error:
+            errors.append(f"{sku}: {context_error}")
+            continue
+        contexts.append((sku, context))
+
+    pdf_bytes, rendered_skus, render_errors = render_flyer_chunk(contexts)
+    return pdf_bytes, rendered_skus, errors + render_errors
+
+class ChunkCollector:
+    """Pipeline stage grouping prepared jobs into fixed input ranges.
+
+    Chunk k always holds input positions [k*size, (k+1)*size), whatever
+    order the jobs arrive in, so merged output keeps the input order. A job
+    fills every position in its ``slots``, which all lie in one chunk.
+    """
+
+    def __init__(self, total, chunk_size=BATCH_CHUNK_SIZE):
+        self.total = total
+        self.chunk_size = chunk_size
+        self.pending = {}
+        self.filled = {}
+        self._lock = threading.Lock()
+
+    def add(self, job):
+        chunk_index = job['index'] // self.chunk_size
+        expected = min(self.chunk_size, self.total - chunk_index * self.chunk_size)
+        with self._lock:
+            jobs = self.pending.setdefault(chunk_index, [])
+            jobs.append(job)
+            self.filled[chunk_index] = self.filled.get(chunk_index, 0) + len(job['slots'])
+            if self.filled[chunk_index] < expected:
+                return None
+            del self.pending[chunk_index], self.filled[chunk_index]
+        return {'index': chunk_index, 'jobs': sorted(jobs, key=lambda j: j['index'])}
+
+    def flush(self):
+        """Emit chunks left incomplete because an earlier stage dropped jobs"""
+        with self._lock:
+            chunks = [{'index': index, 'jobs': sorted(jobs, key=lambda j: j['index'])}
+                      for index, jobs in sorted(self.pending.items())]
+            self.pending.clear()
+            self.filled.clear()
+        return chunks
+
+def prepare_stage(job):
+    """Pipeline stage: build the template context for a fetched job"""
+    if not job['error']:
+        job['context'], job['error'] = prepare_template_context(job['product_data'])
+    job['product_data'] = None  # The product record is not needed past this point
+    return job
+
+def render_job_stage(job, stop=None):
+    """Pipeline stage: render one prepared job to its own PDF"""
+    job['pdf'] = None
+    if not job['error']:
+        job['pdf'], job['error'] = render_flyer(job['context'], stop)
+    job['context'] = None
+    return job
+
+def fan_out_pages(pdf_bytes, rendered_skus, jobs):
+    """Repeat each rendered flyer at the input positions of every SKU that shares it.
+
+    Returns (pdf_bytes, rendered_skus), or None when the document does not
+    hold PAGES_PER_FLYER pages per rendered flyer.
+    """
+    reader = PdfReader(BytesIO(pdf_bytes))
+    if len(reader.pages) != len(rendered_skus) * PAGES_PER_FLYER:
+        return None
+    first_page = {sku: i * PAGES_PER_FLYER for i, sku in enumerate(rendered_skus)}
+    slots = sorted((index, sku, job['sku']) for job in jobs if job['sku'] in first_page for index, sku in job['slots'])
+    writer = PdfWriter()
+    for _, _, rendered_sku in slots:
+        start = first_page[rendered_sku]
+        for page in reader.pages[start:start + PAGES_PER_FLYER]:
+            writer.add_page(page)
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue(), [sku for _, sku, _ in slots]
+
+def render_chunk_stage(chunk, stop=None):
+    """Pipeline stage: render a chunk of prepared jobs as one document.
+
+    Each job is rendered once, then repeated for the other SKUs of its group.
+    """
+    jobs = chunk['jobs']
+    errors = [f"{sku}: {job['error']}" for job in jobs if job['error'] for _, sku in job['slots']]
+    ready = [job for job in jobs if not job['error']]
+    pdf_bytes, rendered_skus, render_errors = render_flyer_chunk([(job['sku'], job['context']) for job in ready], stop)
+    if pdf_bytes and any(len(job['slots']) > 1 for job in ready):
+        fanned_out = fan_out_pages(pdf_bytes, rendered_skus, ready)
+        if fanned_out is None:
+            logger.warning(f"Chunk {chunk['index']} flyers span uneven pages, rendering every SKU")
+            pdf_bytes, rendered_skus, render_errors = render_flyer_chunk(
+                [(sku, job['context']) for job in ready for _, sku in sorted(job['slots'])], stop
+            )
+        else:
+            pdf_bytes, rendered_skus = fanned_out
+            errors += [f"{sku}: flyer shared with {job['sku']} failed to render"
+                       for job in ready if job['sku'] not in rendered_skus for _, sku in job['slots'][1:]]
+    return {
+        'index': chunk['index'],
+        'skus': [sku for _, sku in sorted(slot for job in jobs for slot in job['slots'])],
+        'pdf': pdf_bytes,
+        'rendered_skus': rendered_skus,
+        'errors': errors + render_errors
+    }
+
+def start_flyer_pipeline(skus, merged, render_workers, fetch_errors):
+    """Start streaming SKUs through fetch → prepare → render.
+
+    Each fetched slice is grouped by flyer_group_key, so SKUs that share a
+    flyer become one job whose ``slots`` list every (index, sku) it fills;
+    with merged output a group never crosses a chunk. A bulk-sized run is
+    one slice whose jobs are yielded as the export streams in. Returns the running
+    Pipeline, whose results() yields rendered chunks (merged output) or
+    rendered jobs (individual files) as they complete, plus StageErrors;
+    fetch errors are appended to ``fetch_errors``. The fetches and renders
+    get the pipeline's stop Event, which cancel_flyer_pipeline sets.
+    """
+    indexed = list(enumerate(skus))
+    # A bulk operation exports the whole catalog in one go, so it gets a single fetch item
+    bulk = len(indexed) > BULK_OPERATION_THRESHOLD
+    fetch_size = len(indexed) if bulk else FETCH_CHUNK_SIZE
+    fetch_batches = (indexed[i:i + fetch_size] for i in range(0, len(indexed), fetch_size))
+    chunk_size = BATCH_CHUNK_SIZE
+    stop = threading.Event()
+
+    def fetch_stage(batch):
+        """Pipeline stage: fetch one slice of the input, yielding a job per distinct flyer"""
+        products_data, errors = fetch_all_products([sku for _, sku in batch], stop)
+        fetch_errors.extend(errors)
+        yield from fetched_jobs(batch, products_data)
+
+    def bulk_fetch_stage(batch):
+        """Pipeline stage: stream a bulk export, yielding each product's jobs as soon as it is read.
+
+        Cached SKUs are yielded first. When the operation fails, the SKUs
+        still waiting are fetched in batches instead.
+        """
+        product_cache = get_product_cache()
+        cached, uncached = product_cache.get_many([sku for _, sku in batch])
+        if len(uncached) <= BULK_OPERATION_THRESHOLD:
+            yield from fetch_stage(batch)
+            return
+        waiting = {}  # sku -> its (index, sku) slots, until its product is read
+        for index, sku in batch:
+            if sku not in cached:
+                waiting.setdefault(sku, []).append((index, sku))
+        yield from fetched_jobs([slot for slot in batch if slot[1] in cached], cached)
+        try:
+            for records in stream_products_bulk(list(waiting), GRAPHQL_URL, shopify_headers(), stop=stop):
+                product_cache.put_many(records)
+                slots = sorted(slot for sku in records if sku in waiting for slot in waiting.pop(sku))
+                yield from fetched_jobs(slots, records)
+        except (requests.exceptions.RequestException, BulkOperationError, ValueError) as e:
+            logger.error(f"Bulk operation failed: {str(e)}")
+            if is_stopped(stop):
+                return
+            logger.warning("Falling back to batched product fetch")
+            products_data, errors = fetch_products_batched(list(waiting), stop)
+            fetch_errors.extend(errors)
+        else:
+            # The export holds every product, so a SKU missing from it does not exist
+            products_data = {}
+            fetch_errors.extend(f"{sku}: not found in Shopify" for sku in waiting)
+        yield from fetched_jobs(sorted(slot for slots in waiting.values() for slot in slots), products_data)
+
+    def fetched_jobs(batch, products_data):
+        """A job per distinct flyer among the (index, sku) pairs of ``batch``"""
+        prefetch_images(products_data[sku].image_url for _, sku in batch if sku in products_data)
+        groups = {}
+        for index, sku in batch:
+            product_data = products_data.get(sku)
+            if not product_data:
+                yield {
+                    'index': index,
+                    'sku': sku,
+                    'slots': [(index, sku)],
+                    'product_data': None,
+                    'error': f"Product data not found for SKU: {sku}"
+                }
+                continue
+            key = flyer_group_key(product_data)
+            groups.setdefault((index // chunk_size, key) if merged else key, []).append((index, sku))
+        for slots in groups.values():
+            index, sku = slots[0]
+            yield {'index': index, 'sku': sku, 'slots': slots, 'product_data': products_data[sku], 'error': None}
+
+    stages = [
+        Stage('fetch', bulk_fetch_stage if bulk else fetch_stage, workers=FETCH_STAGE_WORKERS, fan_out=True),
+        Stage('prepare', prepare_stage, workers=PREPARE_STAGE_WORKERS),
+    ]
+    if merged:
+        collector = ChunkCollector(len(skus), chunk_size)
+        stages += [
+            Stage('chunk', collector.add, flush=collector.flush),
+            Stage('render', lambda chunk: render_chunk_stage(chunk, stop), workers=render_workers),
+        ]
+    else:
+        stages.append(Stage('render', lambda job: render_job_stage(job, stop), workers=render_workers))
+    pipeline = Pipeline(stages, stopped=stop)
+    pipeline.start(fetch_batches)
+    return pipeline
+
+def cancel_flyer_pipeline(pipeline):
+    """Stop a run: drop its queued items, kill the renders it waits on and let its threads wind down"""
+    pipeline.stop()
+    renderer = get_renderer()
+    deadline = time.monotonic() + CANCEL_WAIT_SECONDS
+    killed = 0
+    # Kill again on every pass: a render may have taken a worker just before the stop
+    while True:
+        killed += renderer.cancel(pipeline.stopped)
+        if pipeline.join(0.5) or time.monotonic() > deadline:
+            break
+    logger.info(f"Cancelled flyer run: {killed} renders killed, "
+                f"{sum(thread.is_alive() for thread in pipeline.threads)} threads still finishing")
+
 def main():
     st.set_page_config(page_title="Bulk Flyer Generator", layout="wide")
     st.title("📚 Bulk Product Flyer Generator")
+
+    # Start the shared renderer workers once per server process
+    get_renderer()
     
     # Input section
     with st.expander("📥 Input Options", expanded=True):
@@ -455,16 +804,13 @@ def main():
             sku_text = st.text_area("Enter ISBNs/SKUs (one per line or comma separated):", 
                                   height=150)
             if sku_text:
-                skus = [s.strip() for line in sku_text.split('\n') 
-                       for s in line.split(',') if s.strip()]
+                skus = parse_skus(sku_text)
         else:
             uploaded_file = st.file_uploader("Upload a text file with ISBNs/SKUs", 
                                            type=["txt", "csv"])
             if uploaded_file:
                 try:
-                    file_contents = uploaded_file.getvalue().decode("utf-8")
-                    skus = [s.strip() for line in file_contents.split('\n') 
-                           for s in line.split(',') if s.strip()]
+                    skus = parse_skus(uploaded_file.getvalue().decode("utf-8"))
                 except Exception as e:
                     st.error(f"Error reading file: {str(e)}")
                     return
@@ -482,104 +828,192 @@ def main():
         max_workers = st.slider("Parallel processing threads:", 
                                min_value=1, max_value=10, value=4)
     
+    # Results live in the session, so reruns (a download click, a widget change) keep them
+    merged = output_format == "Single merged PDF"
+    run_key = (tuple(skus), TEMPLATE_VERSION, FLYER_BACKEND)
+    results = st.session_state.get('flyer_results')
+    if results is not None and results.key != run_key:
+        # Other SKUs or templates: the kept flyers no longer apply
+        del st.session_state['flyer_results']
+        results = None
+
+    download = None
     if st.button("🚀 Generate Flyers", type="primary"):
-        if len(skus) > 1000:
-            st.warning("Processing large batch (1000+ SKUs), this may take several minutes...")
-        
-        st.info(f"Preparing to generate {len(skus)} flyers...")
-        
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        results_placeholder = st.empty()
-        
-        # Track results
-        generated_pdfs = {}
-        failed_skus = []
-        processed_count = 0
-        
-        # Step 1: Fetch all product data first (batched)
-        with st.spinner("Fetching product data from Shopify..."):
-            products_data, fetch_errors = fetch_all_products(skus)
-            if fetch_errors:
-                st.warning(f"Encountered {len(fetch_errors)} errors while fetching products")
-        
-        # Step 2: Generate PDFs in parallel
-        with st.spinner("Generating flyers..."):
-            with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, max_workers)) as executor:
-                futures = {
-                    executor.submit(generate_single_flyer, sku, products_data): sku 
-                    for sku in skus if sku in products_data
-                }
-                
-                for future in as_completed(futures):
-                    sku = futures[future]
-                    try:
-                        pdf_bytes, error = future.result()
-                        if pdf_bytes:
-                            generated_pdfs[sku] = pdf_bytes
-                        if error:
-                            failed_skus.append(f"{sku}: {error}")
-                    except Exception as e:
-                        failed_skus.append(f"{sku}: {str(e)}")
-                    
-                    processed_count += 1
-                    progress = processed_count / len(skus)
-                    progress_bar.progress(min(progress, 1.0))
+        results, download = generate_flyers(skus, merged, max_workers, run_key)
+
+    if results is not None:
+        show_results(results, merged, download)
+
+def generate_flyers(skus, merged, max_workers, run_key):
+    """Run the pipeline with live progress, rolling partial ZIPs and a Cancel button.
+
+    Returns the run's FlyerResults and its (download spool path, size report).
+    """
+    if len(skus) > 1000:
+        st.warning("Processing large batch (1000+ SKUs), this may take several minutes...")
+    
+    st.info(f"Preparing to generate {len(skus)} flyers...")
+    
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    # Any click reruns the script and interrupts this loop; the finally below then stops the run
+    st.button("⏹️ Cancel", help="Stop the run; flyers finished so far stay downloadable")
+    parts_area = st.container()
+    
+    # Track results; kept in the session from the start, so a cancelled run's flyers survive the rerun
+    results = FlyerResults(run_key, skus)
+    st.session_state['flyer_results'] = results
+    # Finished flyers go straight to a temp-file spool, so memory stays flat
+    spool = MergedPdfSpool() if merged else ZipSpool()
+    # ...and into rolling partial ZIPs offered while the run goes on
+    partial = RollingZipSpool() if PARTIAL_ZIP_FLYERS else None
+    
+    # Fetch, prepare, render and package run as one streaming pipeline:
+    # the first flyers are packaged while later SKUs are still being fetched
+    pipeline = start_flyer_pipeline(skus, merged, min(MAX_WORKERS, max_workers), results.fetch_errors)
+    finished = False
+    try:
+        with st.spinner("Fetching products and generating flyers..."):
+            for result in pipeline.results(heartbeat=RESULTS_HEARTBEAT_SECONDS):
+                if result is None:
+                    # Nothing finished yet; updating the page lets a Cancel click interrupt the wait
                     status_text.text(
-                        f"Processed {processed_count}/{len(skus)} SKUs | "
-                        f"Success: {len(generated_pdfs)} | "
-                        f"Failed: {len(failed_skus)}"
+                        f"Waiting for Shopify and the renderer... Processed {results.processed}/{len(skus)} SKUs"
                     )
-        
-        progress_bar.empty()
-        
-        # Display results
-        with results_placeholder.container():
-            if generated_pdfs:
-                st.success(f"Successfully generated {len(generated_pdfs)} flyers!")
-                
-                if output_format == "Single merged PDF":
-                    with st.spinner("Merging PDFs..."):
-                        try:
-                            merger = PdfMerger()
-                            for pdf_bytes in generated_pdfs.values():
-                                merger.append(BytesIO(pdf_bytes))
-                            
-                            merged_pdf = BytesIO()
-                            merger.write(merged_pdf)
-                            merged_pdf.seek(0)
-                            
-                            st.download_button(
-                                label="⬇️ Download Merged PDF",
-                                data=merged_pdf,
-                                file_name="merged_flyers.pdf",
-                                mime="application/pdf"
-                            )
-                        except Exception as e:
-                            st.error(f"Failed to merge PDFs: {str(e)}")
+                    continue
+                finished_parts = []
+                if isinstance(result, StageError):
+                    item = result.item
+                    if isinstance(item, list):  # A fetch slice of (index, sku) pairs
+                        affected = [sku for _, sku in item]
+                    elif isinstance(item, dict) and 'jobs' in item:
+                        affected = [sku for job in item['jobs'] for _, sku in job['slots']]
+                        spool.add(item['index'], None)
+                    elif isinstance(item, dict):
+                        affected = [sku for _, sku in item['slots']]
+                    else:
+                        affected = []
+                    results.failed.extend(f"{sku}: {result.error}" for sku in affected)
+                    results.processed += len(affected)
+                elif merged:
+                    # Chunks can finish out of order; the spool appends them in input order
+                    spool.add(result['index'], result['pdf'])
+                    results.add_chunk(result['index'], result['rendered_skus'], result['pdf'])
+                    results.failed.extend(result['errors'])
+                    results.processed += len(result['skus'])
+                    if partial and result['pdf']:
+                        first = result['index'] * BATCH_CHUNK_SIZE + 1
+                        name = f"flyers_{first:05d}-{first + len(result['skus']) - 1:05d}.pdf"
+                        finished_parts.append(partial.add(name, result['pdf']))
                 else:
-                    with st.spinner("Creating ZIP archive..."):
-                        try:
-                            import zipfile
-                            zip_buffer = BytesIO()
-                            with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-                                for sku, pdf_bytes in generated_pdfs.items():
-                                    zip_file.writestr(f"flyer_{sku}.pdf", pdf_bytes)
-                            zip_buffer.seek(0)
-                            
-                            st.download_button(
-                                label="⬇️ Download All Flyers (ZIP)",
-                                data=zip_buffer,
-                                file_name="flyers.zip",
-                                mime="application/zip"
-                            )
-                        except Exception as e:
-                            st.error(f"Failed to create ZIP: {str(e)}")
-            
-            if failed_skus:
-                with st.expander("⚠️ Failed SKUs", expanded=False):
-                    st.warning(f"{len(failed_skus)} flyers failed to generate:")
-                    st.code("\n".join(failed_skus))
+                    # One render serves every SKU of the group, each under its own filename
+                    group = [sku for _, sku in result['slots']]
+                    if result['pdf']:
+                        for sku in group:
+                            spool.add(flyer_entry_name(sku), result['pdf'])
+                            if partial:
+                                finished_parts.append(partial.add(flyer_entry_name(sku), result['pdf']))
+                        results.add_flyer(group, result['pdf'])
+                    if result['error']:
+                        results.failed.extend(f"{sku}: {result['error']}" for sku in group)
+                    results.processed += len(group)
+                
+                for number, data, count in filter(None, finished_parts):
+                    # 'ignore' keeps the click from rerunning, and so from stopping, the run
+                    parts_area.download_button(
+                        label=f"⬇️ Part {number}: {count} finished {'documents' if merged else 'flyers'} (ZIP)",
+                        data=data,
+                        file_name=f"flyers_part_{number:03d}.zip",
+                        mime="application/zip",
+                        key=f"partial_zip_{number}",
+                        on_click='ignore'
+                    )
+                progress = results.processed / len(skus)
+                progress_bar.progress(min(progress, 1.0))
+                status_text.text(
+                    f"Processed {results.processed}/{len(skus)} SKUs | "
+                    f"Success: {results.generated} | "
+                    f"Failed: {len(results.failed)}"
+                )
+        finished = True
+    finally:
+        if partial:
+            partial.discard()
+        if not finished:
+            # Interrupted by Cancel (or another widget): stop the fetches and renders
+            # in the background, so the rerun does not wait for them
+            results.cancelled = True
+            discard(spool.close())
+            threading.Thread(target=cancel_flyer_pipeline, args=(pipeline,), daemon=True).start()
+
+    spool_path = spool.close()
+    progress_bar.empty()
+    logger.info(f"PDF cache stats: {get_pdf_cache().stats()}")
+    # The session keeps the spool file's path, not its contents
+    download = results.keep_download(merged, spool_path, spool.report() if merged else None)
+    return results, download
+
+def read_download(path):
+    """Download button data that reads the spool file only once the button is clicked"""
+    def read():
+        with open(path, 'rb') as f:
+            return f.read()
+    return read
+
+def show_results(results, merged, download=None):
+    """Report a run and offer its flyers in the chosen format, repackaging kept flyers when it changed"""
+    if results.cancelled:
+        st.warning(f"Run cancelled after {results.processed} of {len(results.skus)} SKUs; "
+                   f"the flyers finished by then are below")
+    if results.fetch_errors:
+        st.warning(f"Encountered {len(results.fetch_errors)} errors while fetching products")
+    
+    if results.generated:
+        st.success(f"Successfully generated {results.generated} flyers!")
+        cache_stats = get_pdf_cache().stats()
+        st.caption(
+            f"PDF cache: {cache_stats['memory_hits'] + cache_stats['disk_hits']} hits, "
+            f"{cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)"
+        )
+        
+        if download is None:
+            with st.spinner("Packaging flyers..."):
+                download = results.package(merged)
+        if download is None:
+            st.info("These flyers were too large to keep for repackaging. "
+                    "Generate them again for this output format.")
+        else:
+            path, size_report = download
+            if size_report:
+                st.caption(
+                    f"Merged PDF: {format_size(size_report['output_bytes'])} "
+                    f"(rendered chunks {format_size(size_report['input_bytes'])}; "
+                    f"{size_report['objects_shared']} duplicate objects shared, "
+                    f"{size_report['images_resampled']} images resampled)"
+                )
+            size = os.path.getsize(path)
+            if size > DOWNLOAD_MAX_MB * 1024 * 1024:
+                st.error(f"The {'merged PDF' if merged else 'ZIP'} is {format_size(size)}, above the "
+                         f"{DOWNLOAD_MAX_MB} MB download limit. Generate fewer SKUs per run.")
+            elif merged:
+                st.download_button(
+                    label="⬇️ Download Merged PDF",
+                    data=read_download(path),
+                    file_name="merged_flyers.pdf",
+                    mime="application/pdf"
+                )
+            else:
+                st.download_button(
+                    label="⬇️ Download All Flyers (ZIP)",
+                    data=read_download(path),
+                    file_name="flyers.zip",
+                    mime="application/zip"
+                )
+    
+    if results.failed:
+        with st.expander("⚠️ Failed SKUs", expanded=False):
+            st.warning(f"{len(results.failed)} flyers failed to generate:")
+            st.code("\n".join(results.failed))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
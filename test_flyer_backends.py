@@ -0,0 +1,123 @@
+import os
+import difflib
+import subprocess
+from io import BytesIO
+
+import pytest
+from PyPDF2 import PdfReader
+
+from renderer import WKHTMLTOPDF_PATH
+
+MIN_TEXT_SIMILARITY = 0.9  # Word-sequence similarity below which a section's text counts as different
+BOX_TOLERANCE = 0.04  # Largest shift of a section edge, as a share of the header-to-footer distance
+HEADINGS = ('about the book', 'about the author', 'content:')
+HEADER_ANCHOR = 'www.atlanticbooks.com'
+FOOTER_ANCHOR = 'please send your orders to:'
+
+
+def wkhtmltopdf_installed():
+    try:
+        result = subprocess.run([WKHTMLTOPDF_PATH, '--version'], stdin=subprocess.DEVNULL,
+                                capture_output=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return b'wkhtmltopdf' in result.stdout
+
+
+pytestmark = pytest.mark.skipif(not wkhtmltopdf_installed(), reason='wkhtmltopdf is not installed')
+
+
+def text_runs(pdf_bytes):
+    """[(x, y, text)] per page, y growing downwards, one entry per line of text"""
+    pages = []
+    for page in PdfReader(BytesIO(pdf_bytes)).pages:
+        runs = []
+        height = float(page.mediabox.height)
+
+        def visit(text, cm, tm, font_dict, font_size):
+            x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+            y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+            for line in text.split('\n'):
+                if line.strip():
+                    runs.append((x, height - y, line.strip()))
+
+        page.extract_text(visitor_text=visit)
+        pages.append(runs)
+    return pages
+
+
+def words(runs):
+    return [word.casefold() for _, _, text in runs for word in text.split()]
+
+
+def sections(runs):
+    """heading -> (top, bottom, runs) of each section, placed between the header and the footer (0 to 1)"""
+    anchors = {text.casefold(): y for _, y, text in runs}
+    header, footer = anchors.get(HEADER_ANCHOR), anchors.get(FOOTER_ANCHOR)
+    assert header is not None and footer is not None and footer > header
+
+    def place(y):
+        return (y - header) / (footer - header)
+
+    headings = [(text.casefold(), x, y) for x, y, text in runs if text.casefold() in HEADINGS]
+    left = min(x for x, _, _ in runs)
+    main_x = [x for name, x, _ in headings if name.startswith('about')]
+    # The main column starts where its headings do; the sidebar's text is left of it
+    boundary = (left + min(main_x)) / 2 if main_x else None
+
+    found = {}
+    for name, x, y in headings:
+        in_column = x >= boundary if boundary is not None else None
+        below = [other_y for other, other_x, other_y in headings
+                 if other_y > y and (boundary is None or (other_x >= boundary) == in_column)]
+        end = min(below + ([footer] if in_column is not False else []), default=float('inf'))
+        body = [run for run in runs if y < run[1] < end
+                and (boundary is None or (run[0] >= boundary) == in_column)]
+        bottom = max((run_y for _, run_y, _ in body), default=y)
+        found[name] = (place(y), place(bottom), body)
+    return found
+
+
+@pytest.fixture(scope='module')
+def flyers():
+    """(sku, native PDF, html PDF) for every sample flyer the native layout can draw"""
+    os.environ.setdefault('FLYER_LOG_FILE', '')  # Importing streamlitbulk would log to the working directory
+    from bench_backends import sample_contexts, unsupported
+    from native_flyer import NativeFlyerBackend
+    from streamlitbulk import FLYER_BACKENDS
+
+    native, html = NativeFlyerBackend(overlay=False), FLYER_BACKENDS['html']
+    rendered = []
+    for sku, context in sample_contexts():
+        if unsupported(context):
+            continue
+        native_pdf, native_error = native.render(context)
+        html_pdf, html_error = html.render(context)
+        assert not native_error and not html_error, (sku, native_error, html_error)
+        rendered.append((sku, text_runs(native_pdf), text_runs(html_pdf)))
+    assert rendered
+    return rendered
+
+
+def test_page_count(flyers):
+    for sku, native_pages, html_pages in flyers:
+        assert len(native_pages) == len(html_pages), sku
+
+
+def test_text_runs(flyers):
+    for sku, native_pages, html_pages in flyers:
+        for native_runs, html_runs in zip(native_pages, html_pages):
+            similarity = difflib.SequenceMatcher(None, words(html_runs), words(native_runs), autojunk=False).ratio()
+            assert similarity >= MIN_TEXT_SIMILARITY, (sku, similarity)
+
+
+def test_section_boxes(flyers):
+    for sku, native_pages, html_pages in flyers:
+        native, html = sections(native_pages[0]), sections(html_pages[0])
+        assert sorted(native) == sorted(html), sku
+        for heading, (native_top, native_bottom, native_body) in native.items():
+            html_top, html_bottom, html_body = html[heading]
+            assert abs(native_top - html_top) <= BOX_TOLERANCE, (sku, heading, native_top, html_top)
+            assert abs(native_bottom - html_bottom) <= BOX_TOLERANCE, (sku, heading, native_bottom, html_bottom)
+            similarity = difflib.SequenceMatcher(None, words(html_body), words(native_body), autojunk=False).ratio()
+            assert similarity >= MIN_TEXT_SIMILARITY, (sku, heading, similarity)
@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from shopify_bulk import fetch_products_bulk, iter_bulk_products
+from shopify_standin import create_bulk_app, write_sample_jsonl
+
+PRODUCTS = 40
+VARIANTS_PER_PRODUCT = 3
+
+
+@pytest.fixture(scope='module')
+def standin(tmp_path_factory):
+    """GraphQL URL of a stand-in server answering bulk operation calls from a canned JSONL file"""
+    jsonl_path = tmp_path_factory.mktemp('bulk') / 'bulk.jsonl'
+    write_sample_jsonl(jsonl_path, PRODUCTS, VARIANTS_PER_PRODUCT)
+    server = make_server('127.0.0.1', 0, create_bulk_app(str(jsonl_path), polls_until_complete=2))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/graphql.json", jsonl_path
+    server.shutdown()
+
+
+def test_fetch_requested_skus(standin):
+    graphql_url, _ = standin
+    skus = ['9780000001000', '9780000001002', '9780000040001', '9789999999999']
+
+    products, errors = fetch_products_bulk(skus, graphql_url, {}, poll_interval=0.01)
+
+    assert errors == []
+    assert sorted(products) == sorted(skus[:3])
+    record = products['9780000001002']
+    assert record.title == 'Sample Book 1'
+    assert record.product_id == 'gid://shopify/Product/1'
+    assert record.edition == '1st'
+    assert [variant.sku for variant in record.variants] == ['9780000001000', '9780000001001', '9780000001002']
+    # The variants of one product share a single copy of its metafields
+    assert record.metafields is products['9780000001000'].metafields
+
+
+def test_fetch_whole_catalog(standin):
+    graphql_url, _ = standin
+
+    products, errors = fetch_products_bulk(None, graphql_url, {}, poll_interval=0.01)
+
+    assert errors == []
+    assert len(products) == PRODUCTS * VARIANTS_PER_PRODUCT
+
+
+def test_products_are_streamed_one_at_a_time(standin):
+    _, jsonl_path = standin
+    read = []
+
+    def lines():
+        with open(jsonl_path, encoding='utf-8') as f:
+            for line in f:
+                read.append(line)
+                yield line
+
+    products = iter_bulk_products(lines())
+    first = next(products)
+
+    # The first product is complete once the second product's line is read, not at the end of the file
+    assert len(read) == VARIANTS_PER_PRODUCT + 2
+    assert first['id'] == 'gid://shopify/Product/1'
+    assert len(first['variants']['edges']) == VARIANTS_PER_PRODUCT
+    assert sum(1 for _ in products) == PRODUCTS - 1
@@ -0,0 +1,40 @@
+import threading
+
+from shopify_throttle import CostThrottle
+
+
+def cost_report(requested, available, maximum=1000.0, restore_rate=50.0, code=None):
+    data = {'extensions': {'cost': {
+        'requestedQueryCost': requested,
+        'throttleStatus': {
+            'maximumAvailable': maximum,
+            'currentlyAvailable': available,
+            'restoreRate': restore_rate,
+        },
+    }}}
+    if code:
+        data['errors'] = [{'message': code, 'extensions': {'code': code}}]
+    return data
+
+
+def test_acquire_after_cost_above_bucket_does_not_block():
+    throttle = CostThrottle()
+    reserved = throttle.acquire()
+    throttle.release(reserved, cost_report(1500, 1000.0))
+
+    acquired = []
+    thread = threading.Thread(target=lambda: acquired.append(throttle.acquire(1500)), daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert acquired == [1000.0]
+
+
+def test_refused_query_cost_is_not_expected():
+    throttle = CostThrottle()
+    throttle.release(throttle.acquire(), cost_report(100, 900.0))
+    throttle.release(throttle.acquire(), cost_report(1500, 1000.0, code='MAX_COST_EXCEEDED'))
+    throttle.release(throttle.acquire(), cost_report(800, 200.0, code='THROTTLED'), throttled=True)
+
+    assert throttle.expected_cost == 100
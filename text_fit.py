@@ -0,0 +1,384 @@
+import re
+import unicodedata
+from bisect import bisect_right
+from collections import namedtuple
+from functools import lru_cache
+from itertools import accumulate
+
+from html_truncate import TRUNCATION_NOTE, VOID_TAGS, SerializingParser, truncate_html_preserving_tags
+
+# Glyph advance widths (1/1000 em) of the template's sans-serif face for ' ' through '~'.
+# wkhtmltopdf resolves sans-serif to Liberation Sans/Arial, which share Helvetica's metrics.
+_REGULAR_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+_BOLD_WIDTHS = [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+]
+# Punctuation common in metafield copy outside ASCII: (regular, bold)
+_EXTRA_WIDTHS = {
+    ' ': (278, 278), '–': (556, 556), '—': (1000, 1000), '‘': (222, 278),
+    '’': (222, 278), '“': (333, 500), '”': (333, 500), '•': (350, 350),
+    '…': (1000, 1000), '·': (278, 278), '©': (737, 737), '®': (737, 737),
+}
+_DEFAULT_WIDTH = (556, 611)  # Unknown glyphs are taken as a digit's width
+
+# Flyer geometry in CSS px, from templates/_flyer_styles.html on an A4 page (794px at 96 dpi)
+LETTER_SPACING = 0.5  # `* { letter-spacing: 0.5px }`
+LINE_HEIGHT = 1.5  # `* { line-height: 1.5em }`
+BASE_FONT_SIZE = 16  # Browser default, inherited where the stylesheet sets none
+DESCRIPTION_FONT_SIZE = 15  # .product_desc, .about_author
+CONTAINER_HEIGHT = 1376  # .flyer_container 370mm less its 10px padding and 1px border
+MAIN_COLUMN_WIDTH = 462  # .flyer_content (65% of 772px) less .flyer_description's 20px padding
+SIDEBAR_COLUMN_WIDTH = 254  # .sidebar (35% of 772px) less .table_of_content's 8px padding
+LIST_INDENT = 25  # ol, ul { padding-left: 25px }
+LIST_ITEM_FONT_SIZE = 12  # li { font-size: 12px }
+LIST_ITEM_LINE_HEIGHT = 20.8  # li { line-height: 1.3rem }
+HR_HEIGHT = 42  # hr { margin: 20px 0 } plus its border
+HEADER_HEIGHT = 110  # .flyer_header: 20px padding around the logo
+FOOTER_HEIGHT = 368  # .flyer_footer: the office addresses wrap with word-break: break-all
+COVER_HEIGHT = 390  # .book_image: 15px padding around a 2:3 cover 240px wide
+FIT_SLACK = 24  # px kept free per column for rounding in the estimates above
+
+HEADING_SCALE = {'h1': 2.0, 'h2': 1.5, 'h3': 1.17, 'h4': 1.0, 'h5': 0.83, 'h6': 0.67}
+BOLD_TAGS = frozenset(['b', 'strong', 'th']) | frozenset(HEADING_SCALE)
+ITALIC_TAGS = frozenset(['i', 'em', 'cite', 'var'])
+BLOCK_TAGS = frozenset([
+    'p', 'div', 'li', 'ul', 'ol', 'dl', 'dt', 'dd', 'blockquote', 'pre', 'table', 'tr', 'section',
+    'article', 'header', 'footer', 'figure', 'figcaption', 'address',
+]) | frozenset(HEADING_SCALE)
+HIDDEN_TAGS = frozenset(['script', 'style', 'head', 'title', 'template'])
+ASCII_SPACES = ' \n\t\r\x0c'
+_WORD_RE = re.compile(r'\S+')
+WORD_CACHE_SIZE = 200000  # Words whose widths are remembered, per weight
+LAYOUT_CACHE_SIZE = 1024  # Sections whose layouts are remembered
+
+
+def _glyph_width(char, bold):
+    code = ord(char)
+    if 32 <= code < 127:
+        return (_BOLD_WIDTHS if bold else _REGULAR_WIDTHS)[code - 32]
+    if char in _EXTRA_WIDTHS:
+        return _EXTRA_WIDTHS[char][bold]
+    base = unicodedata.normalize('NFKD', char)[:1]
+    if base and 32 <= ord(base) < 127:
+        return _glyph_width(base, bold)
+    return 1000 if unicodedata.east_asian_width(char) in ('W', 'F') else _DEFAULT_WIDTH[bold]
+
+
+class _WidthTable(dict):
+    """char -> width, filled in for non-ASCII characters on first use"""
+
+    def __init__(self, bold):
+        super().__init__((chr(32 + i), _glyph_width(chr(32 + i), bold)) for i in range(95))
+        self.bold = bold
+
+    def __missing__(self, char):
+        width = self[char] = _glyph_width(char, self.bold)
+        return width
+
+
+_WIDTHS = (_WidthTable(False), _WidthTable(True))
+_WORD_WIDTHS = ({}, {})  # word -> width in 1/1000 em, which scales to any font size, per weight
+
+
+def text_width(text, font_size, bold=False):
+    """Advance width of ``text`` in px, letter spacing included"""
+    widths = _WORD_WIDTHS[bold]
+    width = widths.get(text)
+    if width is None:
+        width = sum(map(_WIDTHS[bold].__getitem__, text))
+        if len(widths) < WORD_CACHE_SIZE:
+            widths[text] = width
+    return width * font_size / 1000 + LETTER_SPACING * len(text)
+
+
+def wrap_text(text, width, font_size, bold=False):
+    """Plain text broken into the lines it wraps to"""
+    words = text.split()
+    lines, start = [], 0
+    for end in _wrap([(word, bold) for word in words], width, font_size):
+        lines.append(' '.join(words[start:end + 1]))
+        start = end + 1
+    return lines
+
+
+def line_count(text, width, font_size, bold=False):
+    """Lines a single paragraph of plain text wraps to"""
+    return max(len(wrap_text(text, width, font_size, bold)), 1)
+
+
+def _wrap(words, width, font_size):
+    """Greedy line breaking of (word, bold) pairs; returns the index of each line's last word"""
+    space = text_width(' ', font_size)
+    # Where each word ends on one unbroken line with a space after every word, so a line's
+    # last word is found by bisection: it is the last one ending within ``width`` of the start
+    ends = list(accumulate(text_width(word, font_size, bold) + space for word, bold in words))
+    line_ends = []
+    start, offset = 0, 0.0
+    while start < len(ends):
+        # A word wider than the column overflows on its own line
+        end = max(start, bisect_right(ends, offset + width + space, start) - 1)
+        line_ends.append(end)
+        offset = ends[end]
+        start = end + 1
+    return line_ends
+
+
+# One laid-out line: its height, the truncation limit that keeps it, and what to draw.
+# ``words`` holds (word, bold, italic) triples and is None for an <hr>; ``marker`` is the
+# list bullet or number on an item's first line; ``last`` ends a paragraph (not justified).
+Line = namedtuple('Line', 'height end font_size indent words marker last')
+
+
+class _ColumnFull(Exception):
+    pass
+
+
+class _LayoutParser(SerializingParser):
+    """Lays a metafield's HTML out into Lines.
+
+    Character offsets count text the way truncate_html_preserving_tags does,
+    so a line's offset is the limit that keeps exactly the text up to it,
+    and the serialized HTML kept while parsing gives the cut at that limit.
+    Parsing stops once the lines are taller than ``max_height``.
+    """
+
+    def __init__(self, width, font_size, max_height):
+        super().__init__()
+        self.width = width
+        self.font_size = font_size
+        self.max_height = max_height
+        self.height = 0
+        self.words = []  # [word, bold, end offset, italic] of the open block
+        self.style = None  # Style of the open block, taken at its first word
+        self.joined = False  # Next text continues the last word (no whitespace in between)
+        self.counters = []  # Item count of each open list, None for <ul>
+        self.marker = None  # Marker of the list item whose first line is still to come
+        self.lines = []
+        self.open_styles = {'bold': 0, 'italic': 0, 'hidden': 0}  # Open tags that set each style
+
+    def _style(self):
+        """(font size, line height, indent) for text in the current block"""
+        indent = LIST_INDENT * len(self.counters)
+        for name in reversed(self.stack):
+            if name in HEADING_SCALE:
+                size = self.font_size * HEADING_SCALE[name]
+                return size, size * LINE_HEIGHT, indent
+            if name == 'li':
+                if self.stack[-1] == 'li':
+                    return LIST_ITEM_FONT_SIZE, LIST_ITEM_LINE_HEIGHT, indent
+                return LIST_ITEM_FONT_SIZE, LIST_ITEM_FONT_SIZE * LINE_HEIGHT, indent
+        return self.font_size, self.font_size * LINE_HEIGHT, indent
+
+    def add_line(self, line):
+        self.lines.append(line)
+        self.height += line.height
+        if self.height > self.max_height:
+            raise _ColumnFull()
+
+    def end_block(self):
+        words, self.words, self.joined = self.words, [], False
+        if not words:
+            return
+        font_size, line_height, indent = self.style
+        start = 0
+        line_ends = _wrap([(word, bold) for word, bold, _, _ in words], self.width - indent, font_size)
+        for number, end in enumerate(line_ends, 1):
+            line_words = tuple((word, bold, italic) for word, bold, _, italic in words[start:end + 1])
+            self.add_line(Line(
+                line_height, words[end][2], font_size, indent, line_words, self.marker, number == len(line_ends)
+            ))
+            self.marker = None
+            start = end + 1
+
+    def _count_style(self, tag, step):
+        """Track how many open tags make text bold, italic or hidden"""
+        if tag in BOLD_TAGS:
+            self.open_styles['bold'] += step
+        elif tag in ITALIC_TAGS:
+            self.open_styles['italic'] += step
+        elif tag in HIDDEN_TAGS:
+            self.open_styles['hidden'] += step
+
+    def start_tag(self, tag, attrs):
+        super().start_tag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self._count_style(tag, 1)
+        if tag in BLOCK_TAGS or tag == 'br':
+            self.end_block()
+        elif tag == 'hr':
+            self.end_block()
+            self.add_line(Line(HR_HEIGHT, self.chars, 0, 0, None, None, True))
+        if tag in ('ul', 'ol'):
+            self.counters.append(0 if tag == 'ol' else None)
+        elif tag == 'li' and self.counters:
+            if self.counters[-1] is None:
+                self.marker = '•'
+            else:
+                self.counters[-1] += 1
+                self.marker = f"{self.counters[-1]}."
+
+    def end_tag(self, tag):
+        super().end_tag(tag)
+        self._count_style(tag, -1)
+        if tag in BLOCK_TAGS:
+            self.end_block()
+        if tag in ('ul', 'ol') and self.counters:
+            self.counters.pop()
+
+    def text_node(self, text, kind):
+        start = self.chars
+        super().text_node(text, kind)
+        if kind or self.open_styles['hidden']:
+            return
+        bold = self.open_styles['bold'] > 0
+        italic = self.open_styles['italic'] > 0
+        if not self.words:
+            self.style = self._style()
+        words = self.words
+        join = bool(self.joined and words) and text[:1] not in ASCII_SPACES
+        for match in _WORD_RE.finditer(text):
+            if join:
+                words[-1][0] += match.group()
+                words[-1][2] = start + match.end()
+                join = False
+            else:
+                words.append([match.group(), bold, start + match.end(), italic])
+        self.joined = text[-1:] not in ASCII_SPACES
+
+
+# A section's Lines, the running height below each one, and the parser that holds its serialized HTML
+Layout = namedtuple('Layout', 'lines bottoms parser')
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def _layout(html_content, width, font_size, max_height):
+    parser = _LayoutParser(width, font_size, max_height)
+    try:
+        parser.feed(html_content)
+        parser.close()
+        parser.flush()
+        parser.end_block()
+    except _ColumnFull:
+        pass
+    lines = tuple(parser.lines)
+    parser.lines = parser.words = None
+    parser.rawdata = ''  # Unparsed rest of the HTML, past the column
+    return Layout(lines, tuple(accumulate(line.height for line in lines)), parser)
+
+
+def layout_lines(html_content, width, font_size, max_height=float('inf')):
+    """Lines the HTML takes in a column ``width`` px wide, up to the first past ``max_height``"""
+    return _layout(html_content, width, font_size, max_height).lines
+
+
+def section_height(html_content, width, font_size, max_height=float('inf')):
+    """Height of the HTML in px, or just past ``max_height`` when it is taller"""
+    bottoms = _layout(html_content, width, font_size, max_height).bottoms
+    return bottoms[-1] if bottoms else 0
+
+
+def fit_html(html_content, height, width, font_size, note=TRUNCATION_NOTE, layout_height=None):
+    """Truncate HTML at the last line that, with the note below it, fits in ``height`` px.
+
+    ``layout_height`` (at least ``height``) reuses a layout measured for a taller space.
+    """
+    if not html_content or not isinstance(html_content, str):
+        return ''
+    layout = _layout(html_content, width, font_size, layout_height or height)
+    if not layout.bottoms or layout.bottoms[-1] <= height:
+        return html_content
+
+    budget = height - line_count(note, width, font_size) * font_size * LINE_HEIGHT
+    kept = bisect_right(layout.bottoms, budget)
+    limit = layout.lines[kept - 1].end if kept else 0
+    truncated = layout.parser.cut(limit, note)
+    return truncated if truncated is not None else truncate_html_preserving_tags(html_content, limit, note)
+
+
+def _heading_height(text, width, font_size, uppercase=True):
+    if not text:
+        return 0
+    text = text.upper() if uppercase else text
+    return line_count(text, width, font_size, bold=True) * font_size * LINE_HEIGHT
+
+
+def main_column_height(context):
+    """Height left for About The Book and About The Author below the title block"""
+    height = CONTAINER_HEIGHT - HEADER_HEIGHT - FOOTER_HEIGHT - 60 - FIT_SLACK  # .flyer_description padding
+    height -= _heading_height(context.get('product_title') or '', MAIN_COLUMN_WIDTH, 20) + 10
+    editions = ' | '.join(str(v.get('edition')) for v in context.get('variants') or [] if v.get('edition'))
+    if context.get('volume') or editions:
+        height -= _heading_height(f"{context.get('volume') or ''} | {editions}", MAIN_COLUMN_WIDTH, BASE_FONT_SIZE, False)
+    height -= _heading_height(f"By {context.get('author') or ''}", MAIN_COLUMN_WIDTH, 16) + 10
+    return height
+
+
+def sidebar_height(context):
+    """Height left for the table of contents below the cover and product details"""
+    lines = [f"{context.get('publisher') or ''} | {context.get('publishing_date') or ''} | {context.get('pages') or ''}pp"]
+    lines += [
+        f"{v.get('isbn') or ''} | {v.get('title') or ''} | {v.get('currency') or ''} {v.get('price') or ''}"
+        for v in context.get('variants') or []
+    ]
+    meta = 20 + 5 * (len(lines) + 2)  # .meta_info padding and the paragraphs' collapsed 5px margins
+    meta += _heading_height(context.get('product_category') or '', SIDEBAR_COLUMN_WIDTH, 15)
+    meta += sum(line_count(line.upper(), SIDEBAR_COLUMN_WIDTH, 13) * 13 * LINE_HEIGHT for line in lines)
+    heading = round(BASE_FONT_SIZE * 1.17 * LINE_HEIGHT)  # "Content:" h3
+    return CONTAINER_HEIGHT - COVER_HEIGHT - meta - 20 - heading - FIT_SLACK
+
+
+def fit_flyer_context(context, note=TRUNCATION_NOTE, sections=('book_desc', 'about_author', 'toc')):
+    """Truncate the flyer's HTML sections so they fill the page without overflowing.
+
+    About The Book and About The Author share the main column: each keeps its
+    full height when both fit, otherwise the space is split in proportion to
+    their length (30-70%) and whatever one leaves unused goes to the other.
+    The table of contents gets the sidebar below the product details.
+    Updates and returns ``context``.
+
+    Each section is parsed once per (width, font size) and cached: a flyer
+    with long, unseen sections takes about 4 ms, some 40% of it in Python's
+    HTMLParser, and a repeat about 75 us.
+    """
+    book = context.get('book_desc') if isinstance(context.get('book_desc'), str) else ''
+    author = context.get('about_author') if isinstance(context.get('about_author'), str) else ''
+
+    if ('book_desc' in sections and book) or ('about_author' in sections and author):
+        available = main_column_height(context)
+        available -= (37 if book else 0) + (37 if author else 0)  # .heading: 27px line and 10px margin
+        available -= HR_HEIGHT * ((1 if book or author else 0) + (1 if book and author else 0))
+        # Layout stops a line past the column, so a section taller than the whole column counts as one column
+        book_height = section_height(book, MAIN_COLUMN_WIDTH, DESCRIPTION_FONT_SIZE, available)
+        author_height = section_height(author, MAIN_COLUMN_WIDTH, DESCRIPTION_FONT_SIZE, available)
+
+        book_space, author_space = available - author_height, available - book_height
+        if book and author and book_height + author_height > available:
+            ratio = max(0.3, min(0.7, book_height / (book_height + author_height)))
+            book_space, author_space = available * ratio, available * (1 - ratio)
+            if book_height < book_space:
+                author_space = available - book_height
+            elif author_height < author_space:
+                book_space = available - author_height
+        if 'book_desc' in sections:
+            context['book_desc'] = fit_html(book, book_space, MAIN_COLUMN_WIDTH, DESCRIPTION_FONT_SIZE, note, available)
+        if 'about_author' in sections:
+            context['about_author'] = fit_html(
+                author, author_space, MAIN_COLUMN_WIDTH, DESCRIPTION_FONT_SIZE, note, available
+            )
+
+    toc = context.get('toc')
+    if 'toc' in sections and isinstance(toc, str) and toc:
+        context['toc'] = fit_html(toc, sidebar_height(context), SIDEBAR_COLUMN_WIDTH, BASE_FONT_SIZE, note)
+    return context